@@ -0,0 +1,32 @@
+"""
+Import time benchmarks.
+
+Each import runs in a new interpreter, so nothing is already loaded.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+class ImportSuite(object):
+    timeout = 120
+
+    def timeraw_import_puq(self):
+        return "import puq"
+
+    def timeraw_import_options(self):
+        return "from puq import options"
+
+    def timeraw_import_testprogram(self):
+        # what every job's control script pays
+        return "from puq import TestProgram"
+
+    def timeraw_import_parameter(self):
+        return "from puq import UniformParameter"
+
+    def timeraw_import_hdf(self):
+        # what 'puq status' pays
+        return "import puq.hdf"
+
+    def timeraw_import_all(self):
+        return "from puq import *"
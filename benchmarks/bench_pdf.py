@@ -0,0 +1,118 @@
+"""
+PDF arithmetic, construction from data, and kernel density estimates.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+import numpy as np
+from puq import options, NormalPDF, UniformPDF, LognormalPDF, ExperimentalPDF, gaussian_kde
+
+class PDFArithmetic(object):
+    params = [100, 1000, 10000]
+    param_names = ['numpart']
+
+    def setup(self, numpart):
+        self.numpart = options['pdf']['numpart']
+        options['pdf']['numpart'] = numpart
+        self.a = NormalPDF(10, 1)
+        self.b = UniformPDF(5, 8)
+
+    def teardown(self, numpart):
+        options['pdf']['numpart'] = self.numpart
+
+    def time_add(self, numpart):
+        self.a + self.b
+
+    def time_mul(self, numpart):
+        self.a * self.b
+
+    def time_div(self, numpart):
+        self.a / self.b
+
+
+class ProductQuotient(object):
+    """
+    Products and quotients of PDFs. The lognormals have exact
+    products and quotients, so the error (in percent) of their mean
+    and deviation is tracked too, as is the error for uniforms that
+    start near 0.
+    """
+    params = [100, 1000, 10000]
+    param_names = ['numpart']
+
+    def setup(self, numpart):
+        self.numpart = options['pdf']['numpart']
+        options['pdf']['numpart'] = numpart
+        self.a = LognormalPDF(0, .25, min=.1)
+        self.b = LognormalPDF(1, .5, min=.1)
+        self.c = NormalPDF(0, 1)
+        self.d = UniformPDF(5, 8)
+        self.e = UniformPDF(.001, 1)
+        self.f = NormalPDF(10, 1)
+        self.g = UniformPDF(.01, 1)
+
+    def teardown(self, numpart):
+        options['pdf']['numpart'] = self.numpart
+
+    def _error(self, p, mean, dev):
+        return 100 * max(abs(p.mean - mean) / mean, abs(p.dev - dev) / dev)
+
+    def _lognormal_error(self, p, mu, sigma):
+        mean = np.exp(mu + sigma**2 / 2)
+        dev = mean * np.sqrt(np.exp(sigma**2) - 1)
+        return self._error(p, mean, dev)
+
+    def time_mul(self, numpart):
+        self.a * self.b
+
+    def time_div(self, numpart):
+        self.a / self.b
+
+    def time_mul_crossing(self, numpart):
+        self.c * self.d
+
+    def time_div_crossing(self, numpart):
+        self.c / self.d
+
+    def track_mul_error(self, numpart):
+        return self._lognormal_error(self.a * self.b, 1, np.sqrt(.3125))
+
+    def track_div_error(self, numpart):
+        return self._lognormal_error(self.a / self.b, -1, np.sqrt(.3125))
+
+    def track_mul_near_zero_error(self, numpart):
+        m2 = (.001**2 + .001 + 1) / 3
+        return self._error(self.e * self.e, .5005**2, np.sqrt(m2**2 - .5005**4))
+
+    def track_div_near_zero_error(self, numpart):
+        mean = 10 * np.log(100) / .99
+        return self._error(self.f / self.g, mean, np.sqrt(101 * 100 - mean**2))
+
+
+class ExperimentalPDFSuite(object):
+    params = [1000, 100000]
+    param_names = ['samples']
+
+    def setup(self, samples):
+        np.random.seed(0)
+        self.data = np.random.normal(10, 2, samples)
+
+    def time_histogram(self, samples):
+        ExperimentalPDF(self.data, fit=False)
+
+    def time_kde(self, samples):
+        ExperimentalPDF(self.data, fit=True)
+
+
+class KDEEvaluate(object):
+    params = ([1000, 10000], [100, 1000])
+    param_names = ['samples', 'points']
+
+    def setup(self, samples, points):
+        np.random.seed(0)
+        self.kde = gaussian_kde(np.random.normal(10, 2, samples))
+        self.x = np.linspace(0, 20, points)
+
+    def time_evaluate(self, samples, points):
+        self.kde.evaluate(self.x)
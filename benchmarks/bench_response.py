@@ -0,0 +1,33 @@
+"""
+Response surfaces.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+import numpy as np
+from puq import SampledFunc, pickle, unpickle
+
+class SampledFuncSuite(object):
+    params = [100, 1000]
+    param_names = ['points']
+
+    def setup(self, points):
+        np.random.seed(0)
+        self.x = np.random.uniform(0, 1, points)
+        self.y = np.random.uniform(0, 1, points)
+        self.z = np.sin(4 * self.x) + self.y ** 2
+        self.vars = [('x', (0, 1)), ('y', (0, 1))]
+        self.sf = SampledFunc(self.x, self.y, self.z, vars=self.vars)
+        self.pickled = pickle(self.sf)
+        self.ex = np.random.uniform(0, 1, 10000)
+        self.ey = np.random.uniform(0, 1, 10000)
+
+    def time_fit(self, points):
+        SampledFunc(self.x, self.y, self.z, vars=self.vars)
+
+    def time_eval(self, points):
+        self.sf.eval(self.ex, self.ey)
+
+    def time_unpickle(self, points):
+        unpickle(self.pickled)
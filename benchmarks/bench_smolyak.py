@@ -0,0 +1,68 @@
+"""
+Smolyak sparse grids and polynomial chaos.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+import numpy as np
+from puq import options, UniformParameter, Smolyak
+from puq.smolyak_funcs import memoize, chaos_sequence, legendre_nd
+
+try:
+    import sparse_grid_cc
+except ImportError:
+    sparse_grid_cc = None
+
+def _clear_memo():
+    # chaos_sequence() and friends are memoized in one dict,
+    # the default argument of memoize().
+    memoize.func_defaults[0].clear()
+
+class SparseGrid(object):
+    params = ([2, 5, 10], [2, 4])
+    param_names = ['ndim', 'level']
+
+    def setup(self, ndim, level):
+        if sparse_grid_cc is None:
+            raise NotImplementedError
+
+    def time_sgrid(self, ndim, level):
+        sparse_grid_cc.sgrid(ndim, level)
+
+
+class Chaos(object):
+    params = ([2, 5, 10], [2, 4])
+    param_names = ['ndim', 'level']
+
+    def setup(self, ndim, level):
+        self.x = np.linspace(-1, 1, ndim)
+
+    def time_chaos_sequence(self, ndim, level):
+        _clear_memo()
+        chaos_sequence(ndim, level)
+
+    def time_legendre_nd(self, ndim, level):
+        legendre_nd(self.x, ndim, level)
+
+
+class Uhat(object):
+    params = ([2, 5], [2, 4])
+    param_names = ['ndim', 'level']
+    timeout = 300
+
+    def setup(self, ndim, level):
+        if sparse_grid_cc is None:
+            raise NotImplementedError
+        self.verbose = options['verbose']
+        options['verbose'] = 0
+        params = [UniformParameter('x%d' % i, 'x%d' % i, min=0, max=1) for i in range(ndim)]
+        self.uq = Smolyak(params, level)
+        x = self.uq.pgrid[:, :-1]
+        self.results = np.sum(x ** 2, axis=1) + x[:, 0]
+
+    def teardown(self, ndim, level):
+        options['verbose'] = self.verbose
+
+    def time_uhat(self, ndim, level):
+        self.uq._uhat(self.results)
@@ -0,0 +1,78 @@
+"""
+Collecting job output and running jobs.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+import os, shutil, tempfile
+import h5py
+import numpy as np
+from puq import options, UniformParameter, MonteCarlo, Sweep, InteractiveHost
+from puq.hdf import set_job_output
+
+def _stdout(job, nvars):
+    # what a TestProgram prints, with some untagged lines mixed in
+    lines = ['Starting job %d' % job]
+    for i in range(nvars):
+        lines.append("HDF5:{'name':'y%d','value':%r,'desc':'output %d'}:5FDH" % (i, job * 0.5 + i, i))
+        lines.append('step %d done' % i)
+    return '\n'.join(lines) + '\n'
+
+
+class _TempDir(object):
+    def setup(self, *args):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.verbose = options['verbose']
+        options['verbose'] = 0
+
+    def teardown(self, *args):
+        options['verbose'] = self.verbose
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+
+class ExtractHDF5(_TempDir):
+    params = ([100, 1000], [1, 10])
+    param_names = ['jobs', 'outputs']
+    # _extract_hdf5 only parses jobs it has not collected,
+    # so every sample needs a fresh file
+    number = 1
+    repeat = 5
+
+    def setup(self, jobs, outputs):
+        _TempDir.setup(self)
+        x = UniformParameter('x', 'x', min=0, max=1)
+        self.sw = Sweep(MonteCarlo([x], jobs), InteractiveHost(), 'true')
+        self.hf = h5py.File('extract.hdf5', 'w')
+        for j in range(jobs):
+            set_job_output(self.hf, j, 'stdout', _stdout(j, outputs))
+            set_job_output(self.hf, j, 'stderr', "HDF5:{'name':'time','value':0.1,'desc':''}:5FDH\n")
+        self.jobs = range(jobs)
+
+    def teardown(self, jobs, outputs):
+        self.hf.close()
+        _TempDir.teardown(self)
+
+    def time_extract(self, jobs, outputs):
+        self.sw._extract_hdf5(self.hf, self.jobs)
+
+
+class HostThroughput(_TempDir):
+    # Runs jobs through InteractiveHost with dryrun, so each job
+    # is an 'echo' and the time is puq's overhead per job.
+    params = ([50, 200], [1, 4])
+    param_names = ['jobs', 'cpus']
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, jobs, cpus):
+        _TempDir.setup(self)
+        x = UniformParameter('x', 'x', min=0, max=1)
+        self.sw = Sweep(MonteCarlo([x], jobs), InteractiveHost(cpus=cpus), 'true')
+
+    def time_run(self, jobs, cpus):
+        self.sw.run('throughput', overwrite=True, dryrun=True)
@@ -1,24 +1,79 @@
-from hosts import InteractiveHost,InteractiveHostMP
-from submithost import SubmitHost
-from montecarlo import MonteCarlo
-from lhs import LHS
-from morris import Morris
+"""
+PUQ, a framework for uncertainty quantification.
+
+The names below are imported from their submodules when they are first
+used, so ``import puq`` and ``from puq import options`` are fast and
+don't load scipy, sympy, matplotlib or a GUI toolkit.
+"""
+import sys, types
 from options import options
-from parameter import Parameter, NormalParameter, LognormalParameter,WeibullParameter, RayleighParameter, ExponParameter, CustomParameter, UniformParameter, DParameter, ConstantParameter, TriangParameter
-from smolyak import Smolyak
-from scaling import Scaling
-from scaling import Scaling
-from sweep import Sweep
-from simplesweep import SimpleSweep
-from psweep import PSweep
-from testprogram import TestProgram
-from pdf import PDF, ExperimentalPDF, NormalPDF, LognormalPDF,WeibullPDF, UniformPDF, HPDF, TrianglePDF, posterior, RayleighPDF, ExponPDF, NetPDF
-from constant import Constant
-from pbshost import PBSHost
-from util import Callback
-from response import Function, ResponseFunc, SampledFunc
-from jpickle import pickle, unpickle, NetObj, LoadObj, write_json
-from kde import gaussian_kde
-from analyzer import analyzer
-from calibrate import calibrate
 from .version import __version__
+
+# exported name -> submodule it is defined in
+_exports = {}
+for _mod, _names in [
+        ('hosts', 'InteractiveHost InteractiveHostMP'),
+        ('submithost', 'SubmitHost'),
+        ('montecarlo', 'MonteCarlo'),
+        ('lhs', 'LHS'),
+        ('morris', 'Morris'),
+        ('parameter', 'Parameter NormalParameter LognormalParameter WeibullParameter '
+         'RayleighParameter ExponParameter CustomParameter UniformParameter '
+         'DParameter ConstantParameter TriangParameter'),
+        ('smolyak', 'Smolyak'),
+        ('scaling', 'Scaling'),
+        ('sweep', 'Sweep'),
+        ('simplesweep', 'SimpleSweep'),
+        ('psweep', 'PSweep'),
+        ('testprogram', 'TestProgram'),
+        ('pdf', 'PDF ExperimentalPDF BinnedPDF NormalPDF LognormalPDF WeibullPDF '
+         'UniformPDF HPDF TrianglePDF posterior RayleighPDF ExponPDF NetPDF PDFExpr AdaptivePDF'),
+        ('pdfarray', 'PDFArray'),
+        ('pdfbuilder', 'PDFBuilder'),
+        ('constant', 'Constant'),
+        ('pbshost', 'PBSHost'),
+        ('util', 'Callback'),
+        ('response', 'Function ResponseFunc SampledFunc'),
+        ('jpickle', 'pickle unpickle NetObj LoadObj write_json'),
+        ('kde', 'gaussian_kde'),
+        ('analyzer', 'analyzer'),
+        ('calibrate', 'calibrate'),
+        ]:
+    for _name in _names.split():
+        _exports[_name] = _mod
+del _mod, _names, _name
+
+# Exports with the same name as their submodule. Importing the
+# submodule sets the package attribute to the module.
+_shadowed = set([n for n, m in _exports.iteritems() if n == m])
+
+__all__ = ['options'] + sorted(_exports)
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        # only called for names not set yet
+        try:
+            modname = 'puq.' + _exports[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute '%s'" % name)
+        __import__(modname)
+        value = getattr(sys.modules[modname], name)
+        self.__dict__[name] = value
+        return value
+
+    def __getattribute__(self, name):
+        value = types.ModuleType.__getattribute__(self, name)
+        if name in _shadowed and type(value) is types.ModuleType:
+            value = getattr(value, name)
+            self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_exports))
+
+_lazy = _LazyModule(__name__, __doc__)
+_lazy.__dict__.update(sys.modules[__name__].__dict__)
+# The functions above use this module's globals, which Python 2 clears
+# when a module is freed, so keep it alive.
+_lazy._module = sys.modules[__name__]
+sys.modules[__name__] = _lazy
@@ -27,6 +27,7 @@ import os, weakref, re
 from urlparse import urlparse
 import h5py
 from puq import Parameter, PDF, ExperimentalPDF, pickle, unpickle, gaussian_kde, SampledFunc
+from puq.hdf import get_job_numbers, get_num_jobs, get_job_output, get_psamples_view
 import math
 import webbrowser, shutil, atexit, shelve
 
@@ -449,7 +450,7 @@ class InitFrame:
                 val = ''
             MyLabel(self.tframe, a, val, bg='white').frame.pack(side=LEFT, padx=5)
 
-        numjobs = len(h5['/output/jobs'])-1
+        numjobs = get_num_jobs(h5)
         MyLabel(self.tframe, 'Jobs', numjobs, bg='white').frame.pack(side=LEFT, padx=5)
 
         self.paneframe = PanedWindow(parent, orient=VERTICAL)
@@ -536,7 +537,8 @@ class StdoutFrame:
                     val = 'All jobs completed successfully.'
             else:
                 try:
-                    val = h5[path].value
+                    job, stream = path.split('/')[-2:]
+                    val = get_job_output(h5, job, stream)
                 except:
                     val = ''
 
@@ -576,7 +578,7 @@ class TextFrame:
         elif st == 'D_PSWEEP':
             if path in h5:
                 outvars = map(str, h5[path].keys())
-                numjobs = len(h5['/output/jobs']) - 1
+                numjobs = get_num_jobs(h5)
                 tval = "%s Jobs\n\nOUTPUT VARIABLES:\n" % numjobs
                 for var in outvars:
                     desc = h5['%s/%s' % (path, var)].attrs['description']
@@ -1644,7 +1646,7 @@ class MyApp:
         h5 = self.h5
         p = re.compile('Command exited with non-zero status \d+')
         try:
-            err = h5['output/jobs/%s/stderr' % job].value
+            err = get_job_output(h5, job, 'stderr')
         except:
             err = ''
         res = p.findall(err)
@@ -1655,7 +1657,7 @@ class MyApp:
 
         results = False
         try:
-            out = h5['output/jobs/%s/stdout' % job].value
+            out = get_job_output(h5, job, 'stdout')
         except:
             out = ''
         for line in out.split('\n'):
@@ -1682,7 +1684,7 @@ class MyApp:
         err_id = t.insert(data_id, "end", text="stderr", values=['', 'D_STDOUT'])
         out_id = t.insert(data_id, "end", text="stdout", values=['', 'D_STDOUT'])
 
-        keys = sorted(map(int, [x for x in h5['/output/jobs'].keys() if x.isdigit()]))
+        keys = get_job_numbers(h5)
         self.errlist = []
         for j in keys:
             tout = None
@@ -1753,10 +1755,7 @@ class MyApp:
                 rs = unpickle(self.h5["%s/response" % dir].value)
                 MyApp.state_changed('PROGRESS', val)
                 root.update()
-                if 'psamples' in self.h5:
-                    psamples = self.h5['psamples'].value
-                else:
-                    psamples = None
+                psamples = get_psamples_view(self.h5)
                 val, samples = rs.pdf(fit=False, return_samples=True, psamples=psamples)
                 if path in self.h5:
                     del self.h5[path]
@@ -0,0 +1,48 @@
+"""
+Selects the matplotlib backend.
+
+Modules that plot import matplotlib through :func:`pyplot`, when they
+first plot, instead of at module load.  Importing puq then does not
+need matplotlib or a display, and scripts and jobs that never plot
+don't pay for loading it.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+import os, sys
+from puq.options import options
+
+def have_display():
+    """have_display()
+
+    Returns True if interactive plot windows can be opened.
+    """
+    if sys.platform in ['darwin', 'win32']:
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def backend():
+    """backend()
+
+    Returns the name of the matplotlib backend to use.  This is
+    options['plot']['iformat'] if plot windows can be opened, and
+    'Agg', which only writes files, otherwise.
+    """
+    if have_display():
+        return options['plot']['iformat']
+    return 'Agg'
+
+def pyplot():
+    """pyplot()
+
+    Imports and returns matplotlib.pyplot.  The first time, the backend
+    is set to :func:`backend`, unless the MPLBACKEND environment
+    variable selects one or pyplot was already imported.
+    """
+    if not 'matplotlib.pyplot' in sys.modules and not os.environ.get('MPLBACKEND'):
+        import matplotlib
+        matplotlib.use(backend(), warn=False)
+    import matplotlib.pyplot as plt
+    return plt
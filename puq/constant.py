@@ -15,6 +15,8 @@ PDF, when needed.
 """
 
 import numpy as np
+from puq.options import options
+from puq.backend import pyplot
 
 class Constant(object):
     """
@@ -110,7 +112,7 @@ class Constant(object):
         """
         return self.data + np.zeros(np.shape(arr))
 
-    def lhs1(self, num):
+    def lhs1(self, num, rng=None):
         """
         Latin Hypercube Sample in [-1,1] for this distribution.
 
@@ -122,12 +124,13 @@ class Constant(object):
 
         Args:
           num: Number of samples to generate.
+          rng: Ignored. For compatibility with :class:`PDF`.
         Returns:
           1D array of length *num*.
         """        
         return self.data + np.zeros(num)
 
-    def ds1(self, num):
+    def ds1(self, num, rng=None):
         '''
         Generates a descriptive sample in [-1,1] for this distribution.
 
@@ -138,11 +141,12 @@ class Constant(object):
         This method is used by :mod:`puq.Smolyak`.
 
         :param num: Number of samples to generate.
+        :param rng: Ignored. For compatibility with :class:`PDF`.
         :returns: 1D array of length *num*.
         '''
         return self.data + np.zeros(num)
 
-    def lhs(self, num):
+    def lhs(self, num, rng=None):
         '''
         Latin Hypercube Sample for this distribution.
 
@@ -151,11 +155,12 @@ class Constant(object):
         This method is used by :class:`LHS`.
 
         :param num: Number of samples to generate.
+        :param rng: Ignored. For compatibility with :class:`PDF`.
         :returns: 1D array of length *num*.
         '''
         return self.data + np.zeros(num)
 
-    def ds(self, num):
+    def ds(self, num, rng=None):
         '''
         Generates a descriptive sample for this distribution.
 
@@ -165,21 +170,38 @@ class Constant(object):
         This method is used by :class:`LHS`.
 
         :param num: Number of samples to generate.
+        :param rng: Ignored. For compatibility with :class:`PDF`.
         :returns: 1D array of length *num*.
         '''
         return self.data + np.zeros(num)
 
-    def random(self, num):
+    def random(self, num, rng=None):
         """
         Generate random numbers fitting this parameter's distribution.
 
         This method is used by :class:`MonteCarlo`.
 
         :param num: Number of samples to generate.
+        :param rng: Ignored. For compatibility with :class:`PDF`.
         :returns: 1D array of length *num*.
         """
         return self.data + np.zeros(num)
 
+    def chunks(self, num, chunksize=None, rng=None):
+        """
+        Generates the constant in chunks, like :meth:`PDF.chunks`.
+
+        :param num: Total number of samples to generate.
+        :param chunksize: Maximum number of samples in each chunk.
+          Default is options['pdf']['chunksize'].
+        :param rng: Ignored. For compatibility with :class:`PDF`.
+        :returns: A generator of 1D arrays.
+        """
+        if chunksize is None:
+            chunksize = options['pdf']['chunksize']
+        for start in xrange(0, num, chunksize):
+            yield self.random(min(chunksize, num - start))
+
     def __neg__(self):
         return self.data*-1
 
@@ -249,6 +271,7 @@ class Constant(object):
         :type fig: Boolean.
         :returns: A list of lines that were added.
         """
+        plt = pyplot()
         if fig:
             plt.figure()
         if color:            
@@ -7,11 +7,58 @@ See LICENSE file for terms.
 import numpy as np
 import csv
 import os.path
+import zipfile
+import tempfile
+from puq.options import options
 
-def dump(h5, fname):
+def _columns(h5, vars):
+    # Returns a list of (name, source, index, shape) for the selected
+    # variables. source is 'param' (index is the column of
+    # param_array) or the output dataset (index is None).
+    pnames = [str(p) for p in h5['/input/param_array'].attrs['name']]
+    outvars = []
+    if '/output/data' in h5:
+        outvars = [str(v) for v in h5['/output/data'].keys()]
+    if vars is None:
+        vars = pnames + outvars
+
+    cols = []
+    for var in vars:
+        if var in pnames:
+            cols.append((var, 'param', pnames.index(var), ()))
+        elif var in outvars:
+            ds = h5['/output/data/%s' % var]
+            cols.append((var, ds, None, ds.shape[1:]))
+        else:
+            raise ValueError("Unknown variable '%s'" % var)
+    return cols
+
+def _names(name, shape, flatten):
+    # column names of a variable
+    if not shape or not flatten:
+        return [name]
+    return ['%s%s' % (name, [ind for ind in index]) for index in np.ndindex(shape)]
+
+def _read(h5, cols, start, stop):
+    # Reads rows start:stop of each column. Returns a list of arrays.
+    pblock = None
+    if [c for c in cols if c[1] == 'param']:
+        pblock = h5['/input/param_array'][start:stop]
+    out = []
+    for name, src, index, shape in cols:
+        if src == 'param':
+            out.append(pblock[:, index])
+        else:
+            out.append(src[start:stop])
+    return out
+
+def dump(h5, fname, format='csv', vars=None, rows=None, flatten=False, chunksize=None):
     """
-    Dumps all parameters and output value[s] to a single csv file.
-    There is a two line header on the file.
+    Dumps parameters and output value[s] to a single file.
+    The data is read and written in blocks of rows, so files larger
+    than memory can be dumped.
+
+    For CSV there is a two line header on the file.
     Example:
 
     v,m,energy,kinetic_energy
@@ -21,20 +68,125 @@ def dump(h5, fname):
     7.8781617391,5.0,91.6597791301,155.163580969
     5.0,2.1218382609,28.3402208699,26.5229782613
     ...
+
+    'npy' writes a structured array with one field per column, so
+    np.load(fname)['energy'] gets a column. 'npz' writes one array per
+    variable, keeping the shape of multidimensional outputs.
+
+    Args:
+      h5: An open HDF5 filehandle.
+      fname: Output filename. The extension is replaced by the format.
+      format: 'csv', 'npy' or 'npz'.
+      vars: List of parameter and output names to dump. Default is
+        all parameters followed by all outputs.
+      rows: Tuple (start, stop) of the rows (jobs) to dump. Default
+        is all.
+      flatten: Write each element of multidimensional outputs to its
+        own column, named like 'name[i, j]'. Required for these
+        outputs with 'csv' and 'npy'.
+      chunksize: Number of rows to read at a time. Default is
+        options['hdf5']['chunksize'].
+    Returns:
+      The name of the file written, or None on error.
     """
-    pnames = h5['/input/param_array'].attrs['name']
-    data = h5['/input/param_array'].value
-    outvars = h5['/output/data'].keys()
-    for var in outvars:
-        d = h5['/output/data/%s' % var].value
-        if len(d.shape) != 1:
-            print "ERROR: Cannot dump multidimensional data to CSV file."
-            print "Output data '%s' has dimensions %s" % (var, d.shape)
-            return
-        data = np.column_stack((data, d))
-    fname = os.path.splitext(fname)[0] + '.csv'
-    print 'Dumping CSV data to %s' % fname
-    w = csv.writer(open(fname, 'wb'))
-    w.writerow([p for p in pnames] + outvars)
+    if format not in ['csv', 'npy', 'npz']:
+        raise ValueError("Unknown dump format '%s'" % format)
+    if chunksize is None:
+        chunksize = options['hdf5']['chunksize']
+
+    cols = _columns(h5, vars)
+    if format != 'npz' and not flatten:
+        for name, src, index, shape in cols:
+            if shape:
+                print "ERROR: Cannot dump multidimensional data to a %s file without flattening." % format.upper()
+                print "Output data '%s' has dimensions %s" % (name, (src.shape[0],) + shape)
+                return None
+
+    nrows = h5['/input/param_array'].shape[0]
+    for name, src, index, shape in cols:
+        if src != 'param' and src.shape[0] != nrows:
+            print "WARNING: '%s' has %s rows. Expected %s." % (name, src.shape[0], nrows)
+            nrows = min(nrows, src.shape[0])
+    start, stop = 0, nrows
+    if rows is not None:
+        start, stop = slice(*rows).indices(nrows)[:2]
+    stop = max(start, stop)
+
+    fname = os.path.splitext(fname)[0] + '.' + format
+    print 'Dumping %s data to %s' % (format.upper(), fname)
+    if format == 'csv':
+        _dump_csv(h5, fname, cols, start, stop, flatten, chunksize)
+    elif format == 'npy':
+        _dump_npy(h5, fname, cols, start, stop, chunksize)
+    else:
+        _dump_npz(h5, fname, cols, start, stop, flatten, chunksize)
+    return fname
+
+def _dump_csv(h5, fname, cols, start, stop, flatten, chunksize):
+    f = open(fname, 'wb')
+    w = csv.writer(f)
+    names = []
+    for name, src, index, shape in cols:
+        names += _names(name, shape, flatten)
+    w.writerow(names)
     w.writerow([40*'-'])
-    w.writerows(data)
+    for row in xrange(start, stop, chunksize):
+        block = _read(h5, cols, row, min(row + chunksize, stop))
+        w.writerows(np.column_stack([b.reshape(len(b), -1) for b in block]))
+    f.close()
+
+def _dump_npy(h5, fname, cols, start, stop, chunksize):
+    names = []
+    for name, src, index, shape in cols:
+        names += _names(name, shape, True)
+    dtype = np.dtype([(n, np.float64) for n in names])
+    out = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=(stop - start,))
+    for row in xrange(start, stop, chunksize):
+        block = _read(h5, cols, row, min(row + chunksize, stop))
+        block = np.column_stack([b.reshape(len(b), -1) for b in block])
+        for i, n in enumerate(names):
+            out[n][row - start:row - start + len(block)] = block[:, i]
+    out.flush()
+    del out
+
+def _dump_npz(h5, fname, cols, start, stop, flatten, chunksize):
+    # np.savez needs every array in memory, so each variable is
+    # streamed to temporary .npy files which are then added to the zip.
+    zf = zipfile.ZipFile(fname, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    try:
+        for col in cols:
+            name, src, index, shape = col
+            if flatten and shape:
+                names = _names(name, shape, True)
+                oshape = (stop - start,)
+            else:
+                names = [name]
+                oshape = (stop - start,) + shape
+            tmpnames = []
+            try:
+                outs = []
+                for n in names:
+                    fd, tmpname = tempfile.mkstemp(suffix='.npy')
+                    os.close(fd)
+                    tmpnames.append(tmpname)
+                    outs.append(np.lib.format.open_memmap(tmpname, mode='w+',
+                                                          dtype=np.float64, shape=oshape))
+                for row in xrange(start, stop, chunksize):
+                    b = _read(h5, [col], row, min(row + chunksize, stop))[0]
+                    r0 = row - start
+                    if len(names) > 1:
+                        b = b.reshape(len(b), -1)
+                        for i, out in enumerate(outs):
+                            out[r0:r0 + len(b)] = b[:, i]
+                    else:
+                        outs[0][r0:r0 + len(b)] = b
+                for out in outs:
+                    out.flush()
+                del outs, out
+                for n, tmpname in zip(names, tmpnames):
+                    zf.write(tmpname, n + '.npy')
+            finally:
+                for tmpname in tmpnames:
+                    os.remove(tmpname)
+    finally:
+        zf.close()
@@ -8,23 +8,181 @@ Copyright (c) 2013 PUQ Authors
 See LICENSE file for terms.
 """
 
+import os
 import h5py
+import numpy as np
 from puq.jpickle import unpickle
+from puq.options import options
 from functools import wraps
 
+# name of the group holding packed job output inside /output/jobs
+_PACKED = 'packed'
+
+# (filename, group, stream) -> (rows, {job: (offset, length)}) for
+# the packed streams read so far
+_index_cache = {}
+
+# open HDF5Sessions, by absolute filename
+_sessions = {}
+
 def hdf5_wrap(func):
     @wraps(func)
     def wrapped(hf, *args, **kargs):
         close = False
         if type(hf) == str or type(hf)==unicode:
-            hf = h5py.File(hf, 'r')
-            close = True
-        res = func(hf, *args, **kargs)
-        if close:
-            hf.close()
-        return res
+            # use the handle of an open session on this file, if any
+            sess = _sessions.get(os.path.abspath(hf))
+            if sess is not None and sess.is_open():
+                hf = sess.hf
+            else:
+                hf = open_reader(hf)
+                close = True
+        try:
+            return func(hf, *args, **kargs)
+        finally:
+            if close:
+                hf.close()
     return wrapped
 
+def swmr_supported():
+    """swmr_supported()
+
+    Returns True if h5py and the HDF5 library it was built
+    with support SWMR (single writer, multiple reader) access.
+    HDF5 1.10 or later is required.
+    """
+    return hasattr(h5py.File, 'swmr_mode') and \
+        h5py.version.hdf5_version_tuple >= (1, 10, 0)
+
+def _use_swmr():
+    return options['hdf5'].get('swmr', False) and swmr_supported()
+
+def open_reader(fname):
+    """open_reader(fname)
+
+    Opens an HDF5 file read-only.  If SWMR is supported, it is
+    first opened as a SWMR reader so a file that is being written
+    by a running sweep can be followed. Otherwise, or if that fails
+    (for example, the file was not written in SWMR mode), the file
+    is opened normally.
+
+    Args:
+      fname: HDF5 filename.
+    Returns:
+      An h5py File.
+    """
+    if swmr_supported():
+        try:
+            return h5py.File(fname, 'r', swmr=True)
+        except (IOError, OSError, ValueError):
+            pass
+    return h5py.File(fname, 'r')
+
+class HDF5Session(object):
+    """
+    HDF5Session(fname)
+
+    Keeps one writable handle to a sweep's HDF5 file open instead of
+    opening and closing the file at every step of a sweep. Use
+    :func:`session` to get the session for a file.
+
+    A session is used as a context manager, which returns the file
+    handle. Sessions nest. Inner blocks share the handle and only
+    flush on exit. The outermost block closes the file.
+
+    Before waiting on something long, such as running jobs, call
+    :meth:`checkpoint`.  Handles obtained before a checkpoint
+    should not be used afterwards; use :attr:`file` instead.
+
+    Args:
+      fname: HDF5 filename.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.hf = None
+        self.depth = 0
+
+    def is_open(self):
+        return self.hf is not None and self.hf.id.valid
+
+    @property
+    def file(self):
+        """
+        The writable file handle. It is (re)opened if necessary.
+        A handle in SWMR mode is reopened, because new groups,
+        datasets and attributes cannot be created in SWMR mode.
+        """
+        if self.is_open() and getattr(self.hf, 'swmr_mode', False):
+            self.hf.close()
+        if not self.is_open():
+            if _use_swmr():
+                self.hf = h5py.File(self.fname, 'a', libver='latest')
+            else:
+                self.hf = h5py.File(self.fname, 'a')
+        return self.hf
+
+    def checkpoint(self):
+        """
+        Flushes the file so its contents are consistent on disk.
+
+        If options['hdf5']['swmr'] is set and SWMR is supported, the
+        handle is switched to SWMR mode so SWMR readers (see
+        :func:`open_reader`) can follow the sweep. Otherwise the handle
+        is closed so other processes can open the file.
+        In both cases it is reopened for writing on next use.
+        """
+        if not self.is_open():
+            return
+        self.hf.flush()
+        if _use_swmr():
+            try:
+                if not self.hf.swmr_mode:
+                    self.hf.swmr_mode = True
+                return
+            except (IOError, OSError, ValueError):
+                # files created without libver='latest' cannot use SWMR
+                pass
+        self.hf.close()
+
+    def close(self):
+        if self.is_open():
+            self.hf.close()
+        self.hf = None
+        _sessions.pop(os.path.abspath(self.fname), None)
+
+    def __enter__(self):
+        self.depth += 1
+        return self.file
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth <= 0:
+            self.depth = 0
+            self.close()
+        elif self.is_open():
+            self.hf.flush()
+        return False
+
+def session(fname):
+    """session(fname)
+
+    Returns the :class:`HDF5Session` for a file, creating it
+    if necessary.
+
+    Args:
+      fname: HDF5 filename.
+
+    Example::
+
+      with session(sweep.fname + '.hdf5') as hf:
+          hf['/output/foo'] = 1
+    """
+    key = os.path.abspath(fname)
+    if not key in _sessions:
+        _sessions[key] = HDF5Session(fname)
+    return _sessions[key]
+
 @hdf5_wrap
 def get_output_names(hf):
     """
@@ -62,6 +220,7 @@ def set_result(hf, var, data, desc=''):
         pass
     hf['/output/data/%s' % var] = data
     hf['/output/data/%s' % var].attrs['description'] = desc
+    mark_rewritten(hf['/output/data/%s' % var])
 
 @hdf5_wrap
 def get_result_pdf(hf, var=None):
@@ -94,6 +253,28 @@ def get_result_pdf(hf, var=None):
         
     return unpickle(hf['/{}/{}/pdf'.format(psweep,var)].value)
     
+def _result_name(hf, var):
+    # Checks var against the output variables and returns it, or the
+    # only output variable if var is None. Returns None if there is
+    # no output data.
+    if not '/output/data' in hf:
+        return None
+
+    output_variables = get_output_names(hf)
+    if len(output_variables) == 0:
+        return None
+
+    if var and not var in output_variables:
+        print "Variable %s not found in output data" % var
+        raise ValueError
+    if not var:
+        if len(output_variables) > 1:
+            print "Output data contains multiple variables."
+            print "You must indicate which you want."
+            raise ValueError
+        var = output_variables[0]
+    return var
+
 @hdf5_wrap
 def get_result(hf, var=None):
     """get_result(hf, var=None)
@@ -111,24 +292,109 @@ def get_result(hf, var=None):
       ValueError: if **var** is not found or **var** is None and there
         are multiple output variables.
     """
-    if not '/output/data' in hf:
+    var = _result_name(hf, var)
+    if var is None:
         return []
+    return hf['/output/data/%s' % var].value
 
-    output_variables = get_output_names(hf)
-    if len(output_variables) == 0:
-        return []
+def get_result_view(hf, var=None):
+    """get_result_view(hf, var=None)
 
-    if var and not var in output_variables:
-        print "Variable %s not found in output data" % var
-        raise ValueError
-    if not var:
-        if len(output_variables) > 1:
-            print "Output data contains multiple variables."
-            print "You must indicate which you want."
-            raise ValueError
-        var = output_variables[0]
+    Same as :func:`get_result` except nothing is read. The h5py dataset
+    is returned. It can be sliced to read just part of the data, or
+    read in blocks with :func:`iter_chunks`.
 
-    return hf['/output/data/%s' % var].value
+    Args:
+      hf: An open HDF5 filehandle.  The view is only valid while
+        it stays open.
+      var : Output variable name. Only required if there is more than
+        one output variable.
+    Returns:
+      An h5py Dataset, or None if there is no output data.
+    Raises:
+      ValueError: if **var** is not found or **var** is None and there
+        are multiple output variables.
+    """
+    var = _result_name(hf, var)
+    if var is None:
+        return None
+    return hf['/output/data/%s' % var]
+
+def get_psamples_view(hf):
+    """get_psamples_view(hf)
+
+    Returns the h5py dataset '/psamples' without reading it, or None
+    if it does not exist.  It can be passed to
+    :meth:`puq.ResponseFunc.pdf` as *psamples*, which then reads
+    it in blocks.
+
+    Args:
+      hf: An open HDF5 filehandle.  The view is only valid while
+        it stays open.
+    """
+    if not 'psamples' in hf:
+        return None
+    return hf['psamples']
+
+def iter_chunks(ds, chunksize=None, start=0):
+    """iter_chunks(ds, chunksize=None, start=0)
+
+    Iterates over a dataset in blocks of rows, so it can be
+    processed without reading all of it into memory.
+
+    Args:
+      ds: An h5py Dataset or an array.
+      chunksize: Number of rows per block. The default is
+        options['hdf5']['chunksize'], rounded down to a multiple
+        of the dataset's HDF5 chunk size.
+      start: First row.
+    Returns:
+      A generator of tuples (row, block) where block is
+      ds[row:row + len(block)].
+    """
+    n = len(ds)
+    if chunksize is None:
+        chunksize = options['hdf5']['chunksize']
+        chunks = getattr(ds, 'chunks', None)
+        if chunks:
+            chunksize = max(chunks[0], chunksize - chunksize % chunks[0])
+    for row in xrange(start, n, chunksize):
+        yield row, ds[row:min(row + chunksize, n)]
+
+def mark_rewritten(ds):
+    """mark_rewritten(ds)
+
+    Records that rows of a dataset were rewritten, or that it was
+    (re)created.  A counter in the attributes of '/output' is
+    incremented and stored on the dataset.  Writers call this for
+    anything but appending rows.
+
+    Args:
+      ds: An h5py Dataset.
+    """
+    grp = ds.file.require_group('output')
+    count = int(grp.attrs.get('rewrites', 0)) + 1
+    grp.attrs['rewrites'] = count
+    ds.attrs['rewrites'] = count
+
+def get_rewrites(ds):
+    """get_rewrites(ds)
+
+    Returns the counter stored by :func:`mark_rewritten`.  While it
+    does not change, rows have only been appended to the dataset, so
+    results computed from its first rows can be kept without reading
+    them again.
+
+    Args:
+      ds: An h5py Dataset or an array.
+    Returns:
+      The counter, 0 if the dataset was never marked, or None for
+      arrays, whose changes are not tracked.
+    """
+    attrs = getattr(ds, 'attrs', None)
+    if attrs is None:
+        return None
+    return int(attrs.get('rewrites', 0))
 
 @hdf5_wrap
 def get_param_names(hf):
@@ -241,3 +507,239 @@ def get_sensitivity(hf, var):
         raise ValueError
         
     return unpickle(hf['/%s/%s/sensitivity' % (psweep, var)].value)
+
+@hdf5_wrap
+def get_meta(hf):
+    """get_meta(hf)
+
+    Returns a summary of the sweep from '/private/meta', which is much
+    faster than unpickling the sweep from '/private/sweep'.
+
+    Args:
+      hf: An open HDF5 filehandle or a string containing the HDF5
+        filename to use.
+    Returns:
+      A dictionary with keys 'psweep' and 'host' (class names),
+      'description', 'params' and 'outputs' (lists of names),
+      'num_jobs' and 'job_status'. 'job_status' is an array with
+      the status of each job: '0' not started, 'Q' queued,
+      'R' running, 'F' finished or 'X' finished with errors.
+      Returns None for files written before the summary existed.
+    """
+    if not '/private/meta' in hf:
+        return None
+    grp = hf['/private/meta']
+    meta = {}
+    for k, v in grp.attrs.items():
+        meta[str(k)] = str(v)
+    for k in ['params', 'outputs']:
+        meta[k] = meta[k].split('\n') if meta[k] else []
+    meta['num_jobs'] = int(grp.attrs['num_jobs'])
+    meta['job_status'] = grp['job_status'][...]
+    return meta
+
+def require_jobs_group(hf):
+    """require_jobs_group(hf)
+
+    Returns the '/output/jobs' group, creating it if necessary.
+    A new group is tagged with the job output layout from
+    options['hdf5']['joblayout']. Groups from older files, which
+    hold one group per job, are tagged 'group'.
+
+    Args:
+      hf: An open HDF5 filehandle.
+    """
+    grp = hf.require_group('output/jobs')
+    if not 'layout' in grp.attrs:
+        if [x for x in grp.keys() if x.isdigit()]:
+            grp.attrs['layout'] = 'group'
+        else:
+            grp.attrs['layout'] = options['hdf5']['joblayout']
+    return grp
+
+@hdf5_wrap
+def get_job_layout(hf):
+    """get_job_layout(hf)
+
+    Returns the layout used to store job output. 'group' means
+    each job has its own group '/output/jobs/n'. 'packed' means
+    all jobs share one dataset per stream in '/output/jobs/packed'.
+
+    Args:
+      hf: An open HDF5 filehandle or a string containing the HDF5
+        filename to use.
+    """
+    if not '/output/jobs' in hf:
+        return options['hdf5']['joblayout']
+    return str(hf['/output/jobs'].attrs.get('layout', 'group'))
+
+def _packed_append(pgrp, name, job, text):
+    # Append text for a job to packed stream 'name' and record
+    # its offset and length in 'name_index'.
+    if not name in pgrp:
+        pgrp.create_dataset(name, shape=(0,), maxshape=(None,), dtype=np.uint8,
+                            chunks=(65536,), compression='gzip')
+        pgrp.create_dataset(name + '_index', shape=(0, 3), maxshape=(None, 3),
+                            dtype=np.int64, chunks=(4096, 3))
+    ds = pgrp[name]
+    idx = pgrp[name + '_index']
+    _index_cache.pop((pgrp.file.filename, pgrp.name, name), None)
+    off = ds.shape[0]
+    if text:
+        buf = np.frombuffer(text, dtype=np.uint8)
+        ds.resize((off + len(buf),))
+        ds[off:] = buf
+    n = idx.shape[0]
+    idx.resize((n + 1, 3))
+    idx[n] = (int(job), off, len(text))
+
+def _packed_index(pgrp, name):
+    # Returns a dictionary mapping job numbers to (offset, length)
+    # in packed stream 'name'. Later entries for a job override
+    # earlier ones.
+    idx = pgrp[name + '_index']
+    key = (pgrp.file.filename, pgrp.name, name)
+    cached = _index_cache.get(key)
+    # the row count catches appends by another writer
+    if cached is None or cached[0] != idx.shape[0]:
+        index = {}
+        if idx.shape[0]:
+            for job, off, length in idx[...]:
+                index[int(job)] = (int(off), int(length))
+        cached = _index_cache[key] = (idx.shape[0], index)
+    return cached[1]
+
+@hdf5_wrap
+def get_job_numbers(hf):
+    """get_job_numbers(hf)
+
+    Returns a sorted list of the job numbers that have output
+    stored in the HDF5 file.  This includes jobs merged from
+    shards (see :mod:`puq.shard`) whose stdout and stderr
+    were not kept.
+
+    Args:
+      hf: An open HDF5 filehandle or a string containing the HDF5
+        filename to use.
+    """
+    jobs = set()
+    if '/shard/jobs' in hf:
+        jobs.update(hf['/shard/jobs'][...])
+    if '/output/jobs' in hf:
+        grp = hf['/output/jobs']
+        if str(grp.attrs.get('layout', 'group')) != 'packed':
+            jobs.update([int(x) for x in grp.keys() if x.isdigit()])
+        elif _PACKED in grp:
+            pgrp = grp[_PACKED]
+            for name in ['stdout', 'stderr']:
+                if name + '_index' in pgrp and pgrp[name + '_index'].shape[0]:
+                    jobs.update(pgrp[name + '_index'][:, 0])
+    return sorted(map(int, jobs))
+
+@hdf5_wrap
+def get_num_jobs(hf):
+    """get_num_jobs(hf)
+
+    Returns the number of jobs that have output stored in the HDF5 file.
+
+    Args:
+      hf: An open HDF5 filehandle or a string containing the HDF5
+        filename to use.
+    """
+    return len(get_job_numbers(hf))
+
+@hdf5_wrap
+def get_job_output(hf, job, name='stdout'):
+    """get_job_output(hf, job, name='stdout')
+
+    Returns the saved text of a job's stdout, stderr or output file.
+    Works for both the 'group' and 'packed' layouts.
+
+    Args:
+      hf: An open HDF5 filehandle or a string containing the HDF5
+        filename to use.
+      job: Job number.
+      name: 'stdout', 'stderr' or the name of a file from
+        :class:`TestProgram` *outfiles*.
+    Raises:
+      KeyError: if there is no output of that name for the job.
+    """
+    grp = hf['/output/jobs']
+    if str(grp.attrs.get('layout', 'group')) != 'packed':
+        return grp['%s/%s' % (job, name)].value
+    if not _PACKED in grp or not name + '_index' in grp[_PACKED]:
+        raise KeyError("No output '%s' for job %s" % (name, job))
+    pgrp = grp[_PACKED]
+    off, length = _packed_index(pgrp, name)[int(job)]
+    if length == 0:
+        return ''
+    return pgrp[name][off:off + length].tostring()
+
+def set_job_output(hf, job, name, text):
+    """set_job_output(hf, job, name, text)
+
+    Saves the text of a job's stdout, stderr or output file using
+    the layout of the file. See :func:`get_job_layout`.
+
+    Args:
+      hf: An open HDF5 filehandle.
+      job: Job number.
+      name: 'stdout', 'stderr' or an output file name.
+      text: String to save.
+    """
+    grp = require_jobs_group(hf)
+    if str(grp.attrs['layout']) == 'packed':
+        _packed_append(grp.require_group(_PACKED), name, job, text)
+    else:
+        jgrp = grp.require_group(str(job))
+        if name in jgrp:
+            del jgrp[name]
+        jgrp.create_dataset(name, data=text)
+
+def replace_job_output(hf, name, texts):
+    """replace_job_output(hf, name, texts)
+
+    Replaces one output stream for all jobs. With the 'packed' layout,
+    the old dataset is deleted and rebuilt, so *texts* must not be read
+    lazily from the stream being replaced.
+
+    Args:
+      hf: An open HDF5 filehandle.
+      name: 'stdout', 'stderr' or an output file name.
+      texts: List of (job, text) tuples.
+    """
+    grp = require_jobs_group(hf)
+    if str(grp.attrs['layout']) == 'packed':
+        pgrp = grp.require_group(_PACKED)
+        for n in [name, name + '_index']:
+            if n in pgrp:
+                del pgrp[n]
+        _index_cache.clear()
+        for job, text in texts:
+            _packed_append(pgrp, name, job, text)
+    else:
+        for job, text in texts:
+            set_job_output(hf, job, name, text)
+
+def pack_job_output(hf):
+    """pack_job_output(hf)
+
+    Converts an HDF5 file from the 'group' job output layout to the
+    'packed' layout. Use h5repack afterwards to reclaim the space.
+
+    Args:
+      hf: An open HDF5 filehandle.
+    """
+    grp = require_jobs_group(hf)
+    if str(grp.attrs['layout']) == 'packed':
+        return
+    pgrp = grp.require_group(_PACKED)
+    for job in sorted(map(int, [x for x in grp.keys() if x.isdigit()])):
+        jgrp = grp[str(job)]
+        for name in jgrp.keys():
+            if isinstance(jgrp[name], h5py.Dataset):
+                _packed_append(pgrp, name, job, str(jgrp[name].value))
+                del jgrp[name]
+        if len(jgrp) == 0:
+            del grp[str(job)]
+    grp.attrs['layout'] = 'packed'
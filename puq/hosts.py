@@ -3,7 +3,7 @@ This file is part of PUQ
 Copyright (c) 2013 PUQ Authors
 See LICENSE file for terms.
 """
-import thread,time,datetime,traceback,shlex,sys
+import thread,time,datetime,traceback,shlex,sys,errno
 from threading import Lock
 import multiprocessing
 import socket
@@ -15,10 +15,99 @@ from subprocess import Popen, PIPE
 import numpy as np
 from puq.options import options
 from util import vprint,flushStdStreams
+from puq.hdf import require_jobs_group, get_job_numbers, set_job_output
+from puq import timing
 from shutil import rmtree
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
 
 # fixme: how about supporting Host(name) where name is looked up in a host database?
 
+# Resource usage recorded for each job, written as tags to its
+# stderr. They end up in /output/jobs/<name>, one value per job.
+_usage_desc = [('time', 'wall time (s)'),
+               ('utime', 'user CPU time (s)'),
+               ('stime', 'system CPU time (s)'),
+               ('maxrss', 'maximum resident set size (bytes)'),
+               ('inblock', 'block input operations'),
+               ('oublock', 'block output operations')]
+
+# matches the usage tags, so they can be left out of error messages
+_usage_re = re.compile("HDF5:{'name':'(%s)'" % '|'.join([n for n, d in _usage_desc]))
+
+def _rusage_dict(ru):
+    # rusage fields we record. ru_maxrss is kilobytes except on OS X.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'utime': ru.ru_utime,
+            'stime': ru.ru_stime,
+            'maxrss': ru.ru_maxrss * scale,
+            'inblock': ru.ru_inblock,
+            'oublock': ru.ru_oublock}
+
+def _wait_job(popen):
+    """
+    Waits for a job started with Popen and sets its returncode.
+    Returns a dictionary with the CPU time, maximum RSS and block
+    I/O of the job (including the processes it waited for), or an
+    empty dictionary if os.wait4() is not available.
+    """
+    if not hasattr(os, 'wait4'):
+        popen.wait()
+        return {}
+    while True:
+        try:
+            pid, status, ru = os.wait4(popen.pid, 0)
+            break
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        popen.returncode = -os.WTERMSIG(status)
+    else:
+        popen.returncode = os.WEXITSTATUS(status)
+    return _rusage_dict(ru)
+
+def _usage_tags(usage):
+    """
+    Returns HDF5 tags for a job's resource usage, one per line.
+
+    Args:
+      usage: Dictionary with any of the keys of _usage_desc.
+    """
+    tags = ''
+    for name, desc in _usage_desc:
+        if name in usage:
+            tags += "HDF5:{'name':'%s','value':%r,'desc':'%s'}:5FDH\n" % (name, float(usage[name]), desc)
+    return tags
+
+def _usage_text(errname, usage):
+    """
+    Returns the text to append to a job's stderr file to record its
+    resource usage.  It starts on a new line only if the file does
+    not already end with one, so no blank line is added.
+
+    Args:
+      errname: Name of the job's stderr file.
+      usage: Dictionary with any of the keys of _usage_desc.
+    """
+    sep = ''
+    try:
+        f = open(errname, 'rb')
+    except IOError:
+        return _usage_tags(usage)
+    try:
+        f.seek(0, 2)
+        if f.tell():
+            f.seek(-1, 2)
+            if f.read(1) != '\n':
+                sep = '\n'
+    finally:
+        f.close()
+    return sep + _usage_tags(usage)
+
 class Host(object):
 
     def __init__(self):
@@ -37,7 +126,8 @@ class Host(object):
         #Called from psweep.run
         for a in args:
             output = '%s_%s' % (fname, self.run_num)
-            _dir = self.prog.setup(output)
+            with timing.phase('setup'):
+                _dir = self.prog.setup(output)
 
             if self.prog.paramsByFile:
                 cmd = self.prog.cmdByFile(a,_dir)
@@ -73,15 +163,21 @@ class Host(object):
         """
         raise NotImplementedError('This method should have been implemented.')
 
+    def shard_files(self):
+        """
+        Returns the list of HDF5 shards the jobs write their results to.
+        Empty unless the host writes shards. See :mod:`puq.shard`.
+        """
+        return []
+
     # Collect the data from individual stdout and stderr files into
     # the HDF5 file. Remove files when finished.
     def collect(self, hf):
         # Collect results from output files
         debug("Collecting")
-        hf.require_group('output')
-        run_grp = hf.require_group('output/jobs')
+        require_jobs_group(hf)
 
-        old_jobs = sorted(map(int, [x for x in hf['/output/jobs'].keys() if x.isdigit()]))
+        old_jobs = set(get_job_numbers(hf))
 
         # find the jobs that are completed and, if the stdout/stderr files are there,
         # move them to hdf5
@@ -90,12 +186,10 @@ class Host(object):
             if j in old_jobs:
                 continue
 
-            grp = run_grp.require_group(str(j))
-
             for ext in ['out', 'err']:
                 fname = '%s_%s.%s' % (self.fname, j, ext)
                 f = open(fname, 'r')
-                grp.create_dataset('std%s' % ext, data=f.read())
+                set_job_output(hf, j, 'std%s' % ext, f.read())
                 f.close()
                 if not options['keep']:
                     try:
@@ -109,7 +203,7 @@ class Host(object):
             for fn in self.prog.outfiles:
                 try:
                     f = open(fn, 'r')
-                    grp.create_dataset(fn, data=f.read())
+                    set_job_output(hf, j, fn, f.read())
                     f.close()
                 except:
                     pass
@@ -293,7 +387,7 @@ class InteractiveHost(Host):
                 # We are going to wait for each process, so we must keep the Popen object
                 # around, otherwise it will quietly wait for the process and exit,
                 # leaving our wait function waiting for nonexistent processes.
-                t_start=time.clock()
+                t_start=time.time()
                 p = Popen(cmd , shell=True, stdout=sout, stderr=serr)
                 
                 vprint(2,'pid: {}\n{}\n'.format(p.pid,'================================'))
@@ -311,16 +405,18 @@ class InteractiveHost(Host):
         #http://stackoverflow.com/questions/100624
         
         if t_start==None:
-            t_start=time.clock()
+            t_start=time.time()
             
         t_end=t_start
+        usage={}
         try: 
-            popen.wait()
+            usage=_wait_job(popen)
             
             #wait for the lock once the process finishes
             self._lock.acquire()
         finally: 
-            t_end=time.clock()
+            t_end=time.time()
+            usage['time']=t_end-t_start
             w=[popen.pid,popen.returncode]
             found=False
             for p, j in self._running:
@@ -337,10 +433,10 @@ class InteractiveHost(Host):
                     #we're done messing with the shared vars. release the lock.
                     self._lock.release()
                     
-                    #substitute the time command from Host __init__ and add a timestamp to .out file
+                    #record the resource usage and add a timestamp to .out file
+                    text=_usage_text(j['outfile']+'.err', usage)
                     f=open(j['outfile']+'.err','a')
-                    f.write("HDF5:{{'name':'time','value':{},'desc':''}}:5FDH".format(
-                        t_end-t_start))
+                    f.write(text)
                     f.close()
                     
                     f=open(j['outfile']+'.out','a')
@@ -357,7 +453,7 @@ class InteractiveHost(Host):
         str+="ERROR (pid {}): {} returned {}\n".format(pid,j['cmd'], stat)
         try:
             for line in open(j['outfile']+'.err', 'r'):
-                if not re.match("HDF5:{'name':'time','value':([0-9.]+)", line):
+                if not _usage_re.match(line):
                     str+=line
         except:
             pass
@@ -455,7 +551,8 @@ class InteractiveHostMP(Host):
         #Called from psweep.run
         for a in args:
             output = '%s_%s' % (fname, InteractiveHostMP._run_num)
-            _dir = self.prog.setup(output)
+            with timing.phase('setup'):
+                _dir = self.prog.setup(output)
 
             if self.prog.paramsByFile:
                 cmd = self.prog.cmdByFile(a,_dir)
@@ -557,7 +654,7 @@ class InteractiveHostMP(Host):
                 if cpus > InteractiveHostMP._cpus_free:
                     self.wait(cpus)
                 
-                t_start=time.clock()
+                t_start=time.time()
                 job_info_args={'jobnum':jobnum, 'start_time':t_start, 'sweepid':self.sweepid}
                 job_other_args=shlex.split(j['args']) #j['args'] should be a string
                 
@@ -579,7 +676,7 @@ class InteractiveHostMP(Host):
                     #write the output and timing info immediately
                     InteractiveHostMP._write_stdio(jobnum,
                         stdout_msg="HDF5:{{'name': 'DRY_RUN', 'value': {}, 'desc': '--DRY RUN--'}}:5FDH".format(0),
-                        stderr_msg="HDF5:{{'name':'time','value':{},'desc':''}}:5FDH".format(time.clock()-t_start),
+                        stderr_msg=_usage_tags({'time': time.time()-t_start}),
                         mode='a')
                     
                     InteractiveHostMP._lock.acquire()
@@ -652,7 +749,6 @@ class InteractiveHostMP(Host):
         # flushStdStreams('stdout')
         # s=''
         
-        t_start_lock=time.clock()
         InteractiveHostMP._lock.acquire()
         # s+='Job {} Lock acquired, waited {} sec\n'.format(jobnum,time.clock()-t_start_lock)
         # print(s)
@@ -661,13 +757,17 @@ class InteractiveHostMP(Host):
         
         try:            
             j=InteractiveHostMP._jobs[jobnum]
-            t_end=time.clock()
+            t_end=time.time()
             now=datetime.datetime.now().ctime()
+
+            # usage measured in the worker, see _InteractiveHostMP_run_testProgramFunc
+            usage=dict(args.get('usage', {}))
+            usage['time']=t_end-t_start
             
             err=''
             try:
                 InteractiveHostMP._write_stdio(jobnum,stdout_msg=now,
-                    stderr_msg="HDF5:{{'name':'time','value':{},'desc':''}}:5FDH".format(t_end-t_start),
+                    stderr_msg=_usage_text(j['outfile']+'.err', usage),
                     mode='a')
             except Exception,e:
                 err+='ERROR: could not write time data to output file.\n{}'.format(traceback.format_exc())
@@ -704,10 +804,10 @@ class InteractiveHostMP(Host):
         #the job is no longer in the queue.
         timeout=1800 #each process will only be allowed to run for 1800sec (0.5 hr)
         timeout_elapsed=False
-        timeout_start=time.clock()
+        timeout_start=time.time()
         while not async_result.ready():
             time.sleep(0.1)
-            if time.clock()-timeout_start>=timeout:
+            if time.time()-timeout_start>=timeout:
                 timeout_elapsed=True
                 break
 
@@ -730,13 +830,13 @@ class InteractiveHostMP(Host):
                 InteractiveHostMP._lock.acquire()
                 
                 j=InteractiveHostMP._jobs[jobnum]
-                t_end=time.clock()
+                t_end=time.time()
                 now=datetime.datetime.now().ctime()
             
                 try:
                     InteractiveHostMP._write_stdio(jobnum,
                         stdout_msg=now,
-                        stderr_msg="HDF5:{{'name':'time','value':{},'desc':''}}:5FDH".format(t_end-t_start),
+                        stderr_msg=_usage_text(j['outfile']+'.err', {'time': t_end-t_start}),
                         mode='a')
                 except Exception,e:
                     err+='ERROR: could not write time data to output file.\n{}'.format(traceback.format_exc())
@@ -758,11 +858,11 @@ class InteractiveHostMP(Host):
         s='\n' + 'x'*60 +'\n'
         s+='Job {} of {} completed with ERRORS, {}.\n'.format(jobnum+1,len(InteractiveHostMP._jobs),
                     datetime.datetime.now().ctime())
-        s+='Elapsed: {} sec\n'.format(time.clock()-t_start)
+        s+='Elapsed: {} sec\n'.format(time.time()-t_start)
         s+=err
         try:
             for line in open(j['outfile']+'.err', 'r'):
-                if not re.match("HDF5:{'name':'time','value':([0-9.]+)", line):
+                if not _usage_re.match(line):
                     s+=line
         except:
             pass
@@ -855,8 +955,23 @@ def _InteractiveHostMP_run_testProgramFunc(func,jobinfo,args,stdout_file=None,st
     except Exception,e:
         raise Exception('Could not change job working directory to {}'.format(wdir))
     
+    # The worker process runs many jobs, so CPU time and block I/O
+    # are the differences over this job. maxrss is the peak of the
+    # worker so far.
+    ru0=None
+    if resource is not None:
+        ru0=[_rusage_dict(resource.getrusage(who))
+             for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
     try:
         r=func(**{'jobinfo':jobinfo,'args':args})
+        if ru0 is not None and isinstance(r, dict):
+            ru1=[_rusage_dict(resource.getrusage(who))
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+            usage={}
+            for k in ['utime', 'stime', 'inblock', 'oublock']:
+                usage[k]=sum([b[k] - a[k] for a, b in zip(ru0, ru1)])
+            usage['maxrss']=max([b['maxrss'] for b in ru1])
+            r['usage']=usage
         return r
     finally:
         flushStdStreams()
@@ -7,11 +7,10 @@ Copyright (c) 2013 PUQ Authors
 See LICENSE file for terms.
 """
 
-import os
+import os, sys, base64
 import jsonpickle
 import numpy as np
-import sympy
-from scipy.interpolate import Rbf
+from puq.options import options
 
 try:
     #add handlers for shapely, if it is available
@@ -66,30 +65,28 @@ class NumpyBoolHandler(jsonpickle.handlers.BaseHandler):
         return bool(obj)
 jsonpickle.handlers.registry.register(np.bool, NumpyBoolHandler)
 
-class SympyAddHandler(jsonpickle.handlers.BaseHandler):
-    def flatten(self, obj, data):
-        data['value'] = str(obj)
-        return data
-    def restore(self, obj):
-        return sympy.S(obj['value'])
-jsonpickle.handlers.registry.register(sympy.Add, SympyAddHandler)
-
-class SympyMulHandler(jsonpickle.handlers.BaseHandler):
-    def flatten(self, obj, data):
-        data['value'] = str(obj)
-        return data
-    def restore(self, obj):
-        return sympy.S(obj['value'])
-jsonpickle.handlers.registry.register(sympy.Mul, SympyMulHandler)
-
 class NumpyArrayHandler(jsonpickle.handlers.BaseHandler):
+    """
+    Small arrays, and arrays of objects or records, are stored as
+    JSON lists.  Larger ones are stored as their raw bytes, base64
+    encoded, which is much smaller and faster to decode.
+    """
     def flatten(self, obj, data):
         #print "arrayhandler flatten", obj.dtype
+        if obj.size > options['pickle']['binary_threshold'] \
+                and not obj.dtype.hasobject and obj.dtype.fields is None:
+            data['b64'] = base64.b64encode(np.ascontiguousarray(obj).tobytes())
+            data['dtype'] = obj.dtype.str
+            data['shape'] = list(obj.shape)
+            return data
         data['value'] = obj.tolist()
         data['dtype'] = str(obj.dtype)
         return data
     def restore(self, obj):
         #print 'arrayhandler restore', obj
+        if 'b64' in obj:
+            a = np.frombuffer(base64.b64decode(obj['b64']), dtype=np.dtype(str(obj['dtype'])))
+            return a.reshape(obj['shape']).copy()
         return np.array(obj['value'], dtype=obj['dtype'])
 jsonpickle.handlers.registry.register(np.ndarray, NumpyArrayHandler)
 
@@ -99,13 +96,40 @@ class RbfHandler(jsonpickle.handlers.BaseHandler):
         return data
     def restore(self, obj):
         return obj
-jsonpickle.handlers.registry.register(Rbf, RbfHandler)
+
+class SympyHandler(jsonpickle.handlers.BaseHandler):
+    def flatten(self, obj, data):
+        data['value'] = str(obj)
+        return data
+    def restore(self, obj):
+        import sympy
+        return sympy.S(obj['value'])
+
+# Handlers for classes from modules that are slow to import.
+# They are registered when the module has been imported, or
+# when a pickle refers to it.
+_lazy_handlers = {
+    'sympy': [('sympy', 'Add', SympyHandler), ('sympy', 'Mul', SympyHandler)],
+    'scipy.interpolate': [('scipy.interpolate', 'Rbf', RbfHandler)],
+}
+
+def _register_lazy(text=None):
+    for modname in _lazy_handlers.keys():
+        if modname in sys.modules or (text is not None and modname + '.' in text):
+            for mname, cname, handler in _lazy_handlers.pop(modname):
+                mod = __import__(mname, fromlist=[cname])
+                jsonpickle.handlers.registry.register(getattr(mod, cname), handler)
 
 def pickle(obj,max_depth=None):
+    if _lazy_handlers:
+        _register_lazy()
     return jsonpickle.encode(obj,max_depth=max_depth)
 
 def unpickle(st):
-    obj = jsonpickle.decode(str(st))
+    st = str(st)
+    if _lazy_handlers:
+        _register_lazy(st)
+    obj = jsonpickle.decode(st)
     if hasattr(obj, '_reinit_'):
         obj._reinit_()
     return obj
@@ -127,27 +151,118 @@ def LoadObj(filename):
     f.close()
     return obj
 
-def NetObj(addr):
+def _cache_names(addr):
+    # filenames of the cached body and its metadata
+    import hashlib
+    cdir = os.path.expanduser(options['netobj']['cache'])
+    base = os.path.join(cdir, hashlib.md5(addr).hexdigest())
+    return base + '.json', base + '.meta'
+
+def _cache_read(addr):
+    # Returns (body, metadata) of a cached address, or (None, None).
+    import json
+    body, meta = _cache_names(addr)
+    try:
+        with open(meta, 'r') as f:
+            meta = json.load(f)
+        with open(body, 'r') as f:
+            body = f.read()
+    except (IOError, ValueError):
+        return None, None
+    if meta.get('url') != addr:
+        return None, None
+    return body, meta
+
+def _cache_write(addr, body, meta):
+    # Writes the body (unless it is None) and metadata. Each file is
+    # written to a temporary name then renamed, so concurrent readers
+    # never see a partial file.
+    import json, tempfile
+    meta = dict(meta, url=addr)
+    bname, mname = _cache_names(addr)
+    cdir = os.path.dirname(bname)
+    try:
+        if not os.path.isdir(cdir):
+            os.makedirs(cdir)
+        for fname, text in [(bname, body), (mname, json.dumps(meta))]:
+            if text is None:
+                continue
+            fd, tmpname = tempfile.mkstemp(dir=cdir)
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.rename(tmpname, fname)
+    except (IOError, OSError), e:
+        print "WARNING: Cannot write to cache %s: %s" % (cdir, e)
+
+def _net_read(addr, cache=True, offline=None):
+    # Returns the body at addr, using the on-disk cache.
+    import time
+    from urllib2 import urlopen, Request, URLError, HTTPError
+
+    if offline is None:
+        offline = options['netobj']['offline']
+    body = meta = None
+    if cache:
+        body, meta = _cache_read(addr)
+    if body is not None:
+        if offline or time.time() - meta['time'] < options['netobj']['maxage']:
+            return body
+    elif offline:
+        raise URLError('%s is not in the cache' % addr)
+
+    req = Request(addr)
+    if body is not None:
+        if meta.get('etag'):
+            req.add_header('If-None-Match', meta['etag'])
+        if meta.get('last_modified'):
+            req.add_header('If-Modified-Since', meta['last_modified'])
+    try:
+        response = urlopen(req)
+        val = response.read()
+    except HTTPError, e:
+        if e.code == 304 and body is not None:
+            # not modified
+            meta['time'] = time.time()
+            _cache_write(addr, None, meta)
+            return body
+        print e
+        raise
+    except URLError, e:
+        if body is not None:
+            print "WARNING: %s: %s. Using cached copy." % (addr, e.reason)
+            return body
+        print e.reason
+        raise
+
+    if cache:
+        info = response.info()
+        _cache_write(addr, val, {'etag': info.getheader('ETag'),
+                                 'last_modified': info.getheader('Last-Modified'),
+                                 'time': time.time()})
+    return val
+
+def NetObj(addr, cache=True, offline=None):
     """
     Retrieves a json encoded python object from a remote address.
 
+    Objects are kept in an on-disk cache, in options['netobj']['cache'].
+    If a cached copy exists, it is revalidated with a conditional request
+    (using the ETag and Last-Modified headers of the response) and only
+    downloaded again if it changed.  If the server cannot be reached,
+    the cached copy is used.
+
     :param addr: URI. Returned object must be stored in JSON format
         (from jpickle)
+    :param cache: Use the cache. Default is True.
+    :param offline: Only use the cache, never the network. Default is
+        options['netobj']['offline'].
     :returns: An object
 
     :Example:
 
     >>> u = NetObj('http://foo.com/myproject/response')
     """
-    from urllib2 import urlopen, URLError
-    try:
-        response = urlopen(addr)
-        val = response.read()
-    except URLError, e:
-        print e.reason
-        raise URLError
-
-    return unpickle(val)
+    return unpickle(_net_read(addr, cache, offline))
 
 def write_json(obj, filename):
     """
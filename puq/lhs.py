@@ -8,7 +8,7 @@ See LICENSE file for terms.
 
 import sys
 import numpy as np
-from puq.util import process_data
+from puq.util import process_data, running_moments, fingerprint
 from puq.psweep import PSweep
 from logging import debug
 from response import SampledFunc
@@ -36,6 +36,7 @@ class LHS(PSweep):
         self.ds = ds
         self.response = response
         self._start_at = 0
+        self._moments = {}
 
         if self.response:
             if hasattr(p, 'use_samples_val') and p.use_samples_val:
@@ -66,31 +67,41 @@ class LHS(PSweep):
             yield [(p.name, p.values[i],p.description) for p in self.params]
 
     def _do_pdf(self, hf, data):
+        # data is the h5py dataset. Statistics are computed in blocks
+        # and 'samples' is a hard link to it, not a copy.
         if self.response:
             # The response surface was built using Uniform distributions.
             # We are interested in the mean and deviation of the data
             # that would have been produced using the real PDFs. For this,
             # we need to compute a weighted mean and deviation
+            # The weights of rows already seen only change if the PDFs do.
             weights = np.prod([p.pdf.pdf(p.values) for p in self.params], 0)
-            tweight = np.sum(weights)
-            mean = np.average(data, weights=weights)
-            dev = np.sqrt(np.dot(weights, (data - mean)**2) / tweight)
+            key = '%s:%s' % (hf.name, fingerprint([p.pdf for p in self.params]))
+            mean, dev = running_moments(self._get_moments(), key, data, weights)
 
             print "Mean   = %s" % mean
             print "StdDev = %s" % dev
 
-            rsd = np.vstack(([p.values for p in self.params], data))
+            rsd = np.vstack(([p.values for p in self.params], data[...]))
             rs = pickle(SampledFunc(*rsd, params=self.params))
             return [('response', rs), ('mean', mean), ('dev', dev)]
 
         else:
-            print "Mean   = %s" % np.mean(data)
-            print "StdDev = %s" % np.std(data)
-            return [('samples', data), ('mean', np.mean(data)), ('dev', np.std(data))]
+            mean, dev = running_moments(self._get_moments(), hf.name, data)
+            print "Mean   = %s" % mean
+            print "StdDev = %s" % dev
+            return [('samples', data), ('mean', mean), ('dev', dev)]
+
+    def _get_moments(self):
+        # running moments of each output, so analysis after extend()
+        # only has to look at the new rows. Older pickles lack this.
+        if not hasattr(self, '_moments'):
+            self._moments = {}
+        return self._moments
 
     def analyze(self, hf):
         debug('')
-        process_data(hf, 'lhs', self._do_pdf)
+        process_data(hf, 'lhs', self._do_pdf, lazy=True)
 
     # extend the sample size by a factor of 3
     # This works for DS because it always chooses the center of the probability bins.
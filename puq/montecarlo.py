@@ -7,12 +7,15 @@ See LICENSE file for terms.
 """
 
 import numpy as np
-from puq.util import process_data
+from puq.util import process_data, running_moments, fingerprint
+from puq.hdf import iter_chunks, get_rewrites
+from puq.pdfbuilder import PDFBuilder
 from puq.psweep import PSweep
 from logging import info, debug, exception, warning, critical
 from puq.response import SampledFunc
 from puq.jpickle import pickle
 from puq.pdf import UniformPDF, ExperimentalPDF
+from puq.options import options
 
 class MonteCarlo(PSweep):
     """
@@ -32,6 +35,7 @@ class MonteCarlo(PSweep):
         self.num = num
         self.response = response
         self._start_at = 0
+        self._moments = {}
 
         if self.response:
             if hasattr(p, 'use_samples_val') and p.use_samples_val:
@@ -69,32 +73,60 @@ class MonteCarlo(PSweep):
             yield [(p.name, p.values[i],p.description) for p in self.params]
 
     def _do_pdf(self, hf, data):
+        # data is the h5py dataset. Statistics are computed in blocks
+        # and 'samples' is a hard link to it, not a copy.
         if self.response:
             # The response surface was built using Uniform distributions.
             # We are interested in the mean and deviation of the data
             # that would have been produced using the real PDFs. For this,
             # we need to compute a weighted mean and deviation
+            # The weights of rows already seen only change if the PDFs do.
             weights = np.prod([p.pdf.pdf(p.values) for p in self.params], 0)
-            tweight = np.sum(weights)
-
-            mean = np.average(data, weights=weights)
-            dev = np.sqrt(np.dot(weights, (data - mean)**2) / tweight)
-            rsd = np.vstack(([p.values for p in self.params], data))
+            key = '%s:%s' % (hf.name, fingerprint([p.pdf for p in self.params]))
+            mean, dev = running_moments(self._get_moments(), key, data, weights)
+            rsd = np.vstack(([p.values for p in self.params], data[...]))
             rs = pickle(SampledFunc(*rsd, params=self.params))
             print "Mean   = %s" % mean
             print "StdDev = %s" % dev
             return [('response', rs), ('mean', mean), ('dev', dev)]
         else:
-            pdf = ExperimentalPDF(data, fit=0)
-            mean = np.mean(data)
-            dev = np.std(data)
+            mean, dev = running_moments(self._get_moments(), hf.name, data)
+            if len(data) <= options['hdf5']['chunksize']:
+                pdf = ExperimentalPDF(data[...], fit=0)
+            else:
+                # too large to read at once, so histogram it in blocks
+                pdf = self._get_builder(hf.name, data).finalize()
             print "Mean   = %s" % mean
             print "StdDev = %s" % dev
             return [('pdf', pickle(pdf)), ('samples', data), ('mean', mean), ('dev', dev)]
 
+    def _get_moments(self):
+        # running moments of each output, so analysis after extend()
+        # only has to look at the new rows. Older pickles lack this.
+        if not hasattr(self, '_moments'):
+            self._moments = {}
+        return self._moments
+
+    def _get_builder(self, key, data):
+        # PDFBuilder of each output, so analysis after extend() only
+        # has to histogram the new rows. Like running_moments(), it
+        # is kept only while the rewrite counter of data is unchanged.
+        # Older pickles lack this.
+        builders = self.__dict__.setdefault('_builders', {})
+        n, rewrites, builder = 0, None, None
+        if len(builders.get(key, ())) == 3:
+            n, rewrites, builder = builders[key]
+        current = get_rewrites(data)
+        if builder is None or current is None or rewrites != current or n > len(data):
+            n, builder = 0, PDFBuilder()
+        for row, block in iter_chunks(data, start=n):
+            builder.add(block)
+        builders[key] = (len(data), current, builder)
+        return builder
+
     def analyze(self, hf):
         debug('')
-        process_data(hf, 'montecarlo', self._do_pdf)
+        process_data(hf, 'montecarlo', self._do_pdf, lazy=True)
 
     def extend(self, num):
         if num <= 0:
@@ -17,6 +17,64 @@ options = {
         'numpart': 100,
         'range': 0.9999,
         'srange': 0.998,
+        # Adding PDFs with more points than this convolves them
+        # with FFTs.
+        'fftmin': 500,
+        # Arithmetic on PDFs returns a PDFExpr, which is evaluated
+        # when it is used.
+        'lazy': False,
+        # Build PDFs of known distributions with AdaptivePDF(), on
+        # grids refined to a linear interpolation error of 'tol'.
+        'adaptive': False,
+        'tol': 1e-5,
+        # Size of the inverse CDF table used to sample PDFs.
+        'icdf': 4096,
+        # Number of samples in each chunk from PDF.chunks().
+        'chunksize': 2**20,
+        # ExperimentalPDF(fit=True) with more data points than this
+        # uses gaussian_kde.evaluate_binned().
+        'kdebinned': 10000,
+        # Maximum number of bins of a PDFBuilder histogram.
+        'maxbins': 2**14,
+        },
+    'pickle':
+        {
+        # numpy arrays with more elements than this are stored as
+        # base64 encoded raw bytes instead of JSON lists.
+        'binary_threshold': 64,
+        },
+    'hdf5':
+        {
+        # 'group' stores each job's stdout, stderr and outfiles in
+        # /output/jobs/<n>.  'packed' appends them to one dataset per
+        # stream with an offset/length index.
+        'joblayout': 'group',
+        # Switch the sweep file to SWMR (single writer, multiple reader)
+        # mode at checkpoints so it can be read while jobs are running.
+        # Needs HDF5 1.10 and writes files older HDF5 versions cannot read.
+        'swmr': False,
+        # Number of rows read at a time by puq.hdf.iter_chunks().
+        # MonteCarlo and LHS analyze larger outputs in blocks of this
+        # size instead of reading them into memory.
+        'chunksize': 2**20,
+        },
+    'netobj':
+        {
+        # On-disk cache of objects fetched by NetObj() and NetPDF().
+        'cache': '~/.puq/cache',
+        # Seconds a cached object is used without asking the server
+        # if it changed.
+        'maxage': 0,
+        # Only use the cache.
+        'offline': False,
+        },
+    'profile':
+        {
+        # Record the time spent in each phase of a sweep iteration
+        # in /profile. See puq.timing.
+        'enabled': True,
+        # Also run each iteration under cProfile.
+        'cprofile': False,
         },
     }
 
@@ -6,20 +6,18 @@ This file is part of PUQ
 Copyright (c) 2013 PUQ Authors
 See LICENSE file for terms.
 '''
-from puq.pdf import NormalPDF, LognormalPDF, UniformPDF, ExperimentalPDF, WeibullPDF, RayleighPDF, ExponPDF, PDF,TrianglePDF
+from puq.pdf import NormalPDF, LognormalPDF, UniformPDF, ExperimentalPDF, WeibullPDF, RayleighPDF, ExponPDF, PDF,TrianglePDF, random_state
 from puq.constant import Constant
 from logging import debug
-import sys, matplotlib, sympy
-if sys.platform == 'darwin':
-    matplotlib.use('macosx', warn=False)
-else:
-    matplotlib.use('tkagg', warn=False)
-import matplotlib.pyplot as plt
+from puq.backend import pyplot
+import sys
 import numpy as np
+from itertools import izip
 
 # return an array of parameter samples
-def get_psamples(params, psamples=None, num=None):
+def get_psamples(params, psamples=None, num=None, rng=None):
     xseed = None
+    rng = random_state(rng)
 
     use_samples = False
     for p in params:
@@ -58,11 +56,33 @@ def get_psamples(params, psamples=None, num=None):
                 xseed = np.column_stack((xseed, psamples[p.name]))
         else:
             if xseed is None:
-                xseed = p.pdf.ds(num_samples).reshape(-1, 1)
+                xseed = p.pdf.ds(num_samples, rng).reshape(-1, 1)
             else:
-                xseed = np.column_stack((xseed, p.pdf.ds(num_samples)))
+                xseed = np.column_stack((xseed, p.pdf.ds(num_samples, rng)))
     return xseed
 
+def iter_psamples(params, num, chunksize=None, rng=None):
+    """iter_psamples(params, num, chunksize=None, rng=None)
+
+    Generates random samples of parameters in chunks, so that more
+    samples than fit in memory can be propagated through a response
+    function.
+
+    Args:
+      params: List of :class:`Parameter`\s.
+      num: Total number of samples.
+      chunksize: Maximum number of samples in each chunk. Default is
+        options['pdf']['chunksize'].
+      rng: Random number generator. See :func:`puq.pdf.random_state`.
+    Returns:
+      A generator of arrays with a row for each sample and a column
+      for each parameter.
+    """
+    rng = random_state(rng)
+    gens = [p.pdf.chunks(num, chunksize, rng) for p in params]
+    for cols in izip(*gens):
+        yield np.column_stack(cols)
+
 class Parameter(object):
     '''
     Superclass for all Parameter subclasses. For backwards
@@ -116,6 +136,7 @@ class Parameter(object):
         if name=="paramsFile":
             print('The name "paramsFile" is reserved')
             sys.exit(1)
+        import sympy
         try:
             e = sympy.S(name)
             assert str(e.evalf()) == name
@@ -126,6 +147,7 @@ class Parameter(object):
         sys.exit(1)
 
     def plot(self, **kwargs):
+        plt = pyplot()
         self.pdf.plot(kwargs)
         plt.xlabel(self.name)
         if self.description and self.description != self.name:
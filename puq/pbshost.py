@@ -4,6 +4,7 @@ from jobqueue import JobQueue
 import time
 import re, os, sys, subprocess
 import numpy as np
+from puq.options import options
 
 class PBSHost(Host):
     """
@@ -20,10 +21,17 @@ class PBSHost(Host):
       modules(list): Additional required modules. Default is none.
       pack(int): Number of sequential jobs to run in each PBS script. Default is 1.
       qlimit(int): Max number of PBS jobs to submit at once. Default is 200.
+      shards(bool): Each PBS job writes the results of its jobs to its
+        own HDF5 shard, which the sweep file references with virtual
+        datasets instead of collecting everything itself.
+        See :mod:`puq.shard`. Default is False.
+      shard_logs(bool): Also keep stdout and stderr in the shards.
+        Default is True.
     """
 
     def __init__(self, env,  cpus=0, cpus_per_node=0,
-                 qname='standby', walltime='1:00:00', modules='', pack=1, qlimit=200):
+                 qname='standby', walltime='1:00:00', modules='', pack=1, qlimit=200,
+                 shards=False, shard_logs=True):
         Host.__init__(self)
         if cpus <= 0:
             print "You must specify cpus when creating a PBSHost object."
@@ -53,6 +61,9 @@ class PBSHost(Host):
         self.scaling = False
         self.jnum = 0
         self.qlimit = qlimit
+        self.shards = shards
+        self.shard_logs = shard_logs
+        self.shardlist = []
         # checkjob on Carter is frequently broken
         #self.has_checkjob = (os.system("/bin/bash -c 'checkjob --version 2> /dev/null'") >> 8) == 0
         self.has_checkjob = False
@@ -208,6 +219,14 @@ class PBSHost(Host):
             f.write('module load %s\n' % m)
         f.write('cd  $PBS_O_WORKDIR\n')
         f.write('%s\n' % cmd)
+        if getattr(self, 'shards', False):
+            shard = '%s_shard_%s.h5' % (self.fname, self.jnum)
+            f.write('wait\n')
+            f.write('cd  $PBS_O_WORKDIR\n')
+            f.write('python -m puq.shard %s%s %s\n' % (
+                '' if self.shard_logs else '--nologs ', shard,
+                ' '.join(['%s:%s_%s' % (j['num'], self.fname, j['num']) for j in joblist])))
+            self.shardlist.append(shard)
         f.close()
         while True:
             res = os.popen("qsub %s.pbs" % fname).readline()
@@ -231,6 +250,27 @@ class PBSHost(Host):
         self.jnum += 1
         return d
 
+    def shard_files(self):
+        if not getattr(self, 'shards', False):
+            return []
+        return list(self.shardlist)
+
+    def collect(self, hf):
+        if not getattr(self, 'shards', False):
+            return Host.collect(self, hf)
+
+        # The results, and the logs if wanted, are in the shards.
+        # See Sweep.collect_data.
+        finished_jobs = self.status(quiet=True)[0]
+        if not options['keep']:
+            for j in finished_jobs:
+                for ext in ['out', 'err']:
+                    try:
+                        os.remove('%s_%s.%s' % (self.fname, j, ext))
+                    except OSError:
+                        pass
+        return finished_jobs
+
     def run(self):
         debug('RUN')
 
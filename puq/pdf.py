@@ -13,15 +13,11 @@ import numpy as np
 import math, __builtin__
 from scipy import trapz, interpolate
 import scipy.stats
+from scipy.signal import fftconvolve
 from puq.options import options
 from puq.kde import gaussian_kde
 from logging import info, debug, exception, warning, critical
-import sys, matplotlib
-if sys.platform == 'darwin':
-    matplotlib.use('macosx', warn=False)
-else:
-    matplotlib.use('tkagg', warn=False)
-import matplotlib.pyplot as plt
+from puq.backend import pyplot
 
 """
 Class implementing a PDF (Probability Density Function).
@@ -37,9 +33,12 @@ class PDF(object):
     Args:
       xvals (1D array or list): x values
       yvals (1D array or list): values for PDF(x)
+      adaptive (bool): Keep the x values, which are not evenly
+        spaced, instead of trimming the tails and resampling. Used by
+        :func:`AdaptivePDF`.
     """
 
-    def __init__(self, xvals, yvals):
+    def __init__(self, xvals, yvals, adaptive=False):
         # if order is reversed, flip it
         if xvals[0] > xvals[-1]:
             xvals = xvals[::-1]
@@ -60,35 +59,36 @@ class PDF(object):
 
         # Trim tails that have grown to 10% of the range of the PDF
         resample = False
-        mmin, mmax = self.ppf([0, 1])
-        dist = mmax - mmin
-        if dist==0:
-            dist=1e-15
-        #print "range of pdf = [%s - %s]" % (mmin, mmax)
-        #print "range of PDF = [%s - %s]" % (xvals[0], xvals[-1])
-        #print "dist=%s" % dist
-        #print "proposed range = [%s - %s]" % (self.ppf(range[0]), self.ppf(range[1]))
-        #print "[%s , %s]" % ((mmin - self.ppf(range[0]))/dist, (mmax - self.ppf(range[1]))/dist)
-
-        if np.isnan(mmin) or abs((mmin - self.ppf(range[0])) / dist) > .1:
-            mmin = self.ppf(range[0])
-            resample = True
-        else:
-            mmin = xvals[0]
+        if not adaptive:
+            mmin, mmax = self.ppf([0, 1])
+            dist = mmax - mmin
+            if dist==0:
+                dist=1e-15
+            #print "range of pdf = [%s - %s]" % (mmin, mmax)
+            #print "range of PDF = [%s - %s]" % (xvals[0], xvals[-1])
+            #print "dist=%s" % dist
+            #print "proposed range = [%s - %s]" % (self.ppf(range[0]), self.ppf(range[1]))
+            #print "[%s , %s]" % ((mmin - self.ppf(range[0]))/dist, (mmax - self.ppf(range[1]))/dist)
+
+            if np.isnan(mmin) or abs((mmin - self.ppf(range[0])) / dist) > .1:
+                mmin = self.ppf(range[0])
+                resample = True
+            else:
+                mmin = xvals[0]
 
-        if np.isnan(mmax) or abs((mmax - self.ppf(range[1])) / dist) > .1:
-            mmax = self.ppf(range[1])
-            resample = True
-        else:
-            mmax = xvals[-1]
+            if np.isnan(mmax) or abs((mmax - self.ppf(range[1])) / dist) > .1:
+                mmax = self.ppf(range[1])
+                resample = True
+            else:
+                mmax = xvals[-1]
 
-        # resample if not even spacing
-        if not resample:
-            resample = not np.allclose(np.diff(xvals)[0], np.diff(xvals))
+            # resample if not even spacing
+            if not resample:
+                resample = not np.allclose(np.diff(xvals)[0], np.diff(xvals))
 
-        # resample if number of intervals is 10% too large or small
-        if not resample:
-            resample = np.abs(len(xvals) - nsamp) > (nsamp * .1)
+            # resample if number of intervals is 10% too large or small
+            if not resample:
+                resample = np.abs(len(xvals) - nsamp) > (nsamp * .1)
 
         if resample:
             self.x = np.linspace(mmin, mmax, nsamp)
@@ -191,7 +191,7 @@ class PDF(object):
         """
         return np.interp(arr, self.cdfy, self.x)
 
-    def lhs1(self, num):
+    def lhs1(self, num, rng=None):
         """
         Latin Hypercube Sample in [-1,1] for this distribution.
 
@@ -203,13 +203,14 @@ class PDF(object):
 
         Args:
           num: Number of samples to generate.
+          rng: Random number generator. See :func:`random_state`.
         Returns:
           1D array of length *num*.
         """
         pmin, pmax = self.range
-        return (2. * self.lhs(num) - (pmax + pmin)) / (pmax - pmin)
+        return (2. * self.lhs(num, rng) - (pmax + pmin)) / (pmax - pmin)
 
-    def ds1(self, num):
+    def ds1(self, num, rng=None):
         '''
         Generates a descriptive sample in [-1,1] for this distribution.
 
@@ -220,12 +221,13 @@ class PDF(object):
         This method is used by :mod:`puq.Smolyak`.
 
         :param num: Number of samples to generate.
+        :param rng: Random number generator. See :func:`random_state`.
         :returns: 1D array of length *num*.
         '''
         pmin, pmax = self.range
-        return (2. * self.ds(num) - (pmax + pmin)) / (pmax - pmin)
+        return (2. * self.ds(num, rng) - (pmax + pmin)) / (pmax - pmin)
 
-    def lhs(self, num):
+    def lhs(self, num, rng=None):
         '''
         Latin Hypercube Sample for this distribution.
 
@@ -234,11 +236,13 @@ class PDF(object):
         This method is used by :class:`LHS`.
 
         :param num: Number of samples to generate.
+        :param rng: Random number generator. See :func:`random_state`.
         :returns: 1D array of length *num*.
         '''
-        return np.random.permutation(self.ppf((np.arange(0, num) + np.random.uniform(0, 1, num))/num))
+        rng = random_state(rng)
+        return rng.permutation(self._icdf((np.arange(0, num) + rng.uniform(0, 1, num))/num))
 
-    def ds(self, num):
+    def ds(self, num, rng=None):
         '''
         Generates a descriptive sample for this distribution.
 
@@ -248,23 +252,69 @@ class PDF(object):
         This method is used by :class:`LHS`.
 
         :param num: Number of samples to generate.
+        :param rng: Random number generator. See :func:`random_state`.
         :returns: 1D array of length *num*.
         '''
-        return np.random.permutation(self.ppf(np.arange(0.5, num)/num))
+        return random_state(rng).permutation(self._icdf(np.arange(0.5, num)/num))
 
-    def random(self, num):
+    def random(self, num, rng=None):
         """
         Generate random numbers fitting this parameter's distribution.
 
         This method is used by :class:`MonteCarlo`.
 
         :param num: Number of samples to generate.
+        :param rng: Random number generator. See :func:`random_state`.
         :returns: 1D array of length *num*.
         """
-        return self.ppf(np.random.uniform(0, 1, num))
+        return self._icdf(random_state(rng).uniform(0, 1, num))
+
+    def chunks(self, num, chunksize=None, rng=None):
+        """
+        Generates random numbers fitting this distribution in chunks,
+        so that more samples than fit in memory can be propagated.
+
+        :param num: Total number of samples to generate.
+        :param chunksize: Maximum number of samples in each chunk.
+          Default is options['pdf']['chunksize'].
+        :param rng: Random number generator. See :func:`random_state`.
+        :returns: A generator of 1D arrays.
+
+        :Example:
+
+        >>> for x in p.chunks(10**8, rng=42):
+        ...     total += np.sum(f(x))
+        """
+        if chunksize is None:
+            chunksize = options['pdf']['chunksize']
+        rng = random_state(rng)
+        for start in xrange(0, num, chunksize):
+            yield self.random(__builtin__.min(chunksize, num - start), rng)
+
+    def _icdf(self, u):
+        # Inverse CDF through a table of options['pdf']['icdf'] evenly
+        # spaced quantiles, built the first time it is needed. Looking
+        # up a value does not search, so sampling is O(1) per value.
+        table = self.__dict__.get('_icdf_table')
+        if table is None:
+            table = self._icdf_table = _quantiles(self.x, self.y, options['pdf']['icdf'])
+        t = np.asarray(u, dtype=np.float64) * (len(table) - 1)
+        i = np.clip(t.astype(int), 0, len(table) - 2)
+        return table[i] + (t - i) * (table[i + 1] - table[i])
+
+    def __getstate__(self):
+        # The inverse CDF table is rebuilt when needed, so don't pickle it.
+        state = self.__dict__.copy()
+        state.pop('_icdf_table', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     def __neg__(self):
-        return PDF(-self.x[::-1], self.y[::-1])
+        if options['pdf']['lazy']:
+            return PDFExpr('neg', self)
+        return PDF(*_neg(self))
 
     def __radd__(self, b):
         #print "__radd %s %s" % (self,b)
@@ -273,102 +323,69 @@ class PDF(object):
     def _nadd(self, b):
         #print "_nadd %s" % (b)
         # add a scalar to a PDF
-        return PDF(b + self.x, self.y)
+        if options['pdf']['lazy']:
+            return PDFExpr('+', self, b)
+        return PDF(*_nadd(self, b))
 
     def __add__(self, b):
         "Add two PDFs, returning a new one."
         #print "__add__ %s %s" % (self,b)
-        if isinstance(b, int) or isinstance(b, float) or isinstance(b, long):
+        if _is_scalar(b):
             return self._nadd(b)
-
-        a = self
-        if (a.x[-1] - a.x[0] < b.x[-1] - b.x[0]):
-            a, b = b, a
-
-        a0, a1 = a.x[0], a.x[-1]
-        b0, b1 = b.x[0], b.x[-1]
-        ar = a1 - a0
-        br = b1 - b0
-
-        nsamp = options['pdf']['numpart']
-        cx = np.linspace(0, ar, nsamp)
-        dx = ar/(nsamp-1.0)
-        blen = int(math.ceil(br/dx))
-        c = np.convolve(a.pdf(cx + a0), b.pdf(cx[:blen] + b0))
-        cx = np.linspace(a0 + b0, a1 + b1, num=len(c), endpoint=False)
-        return PDF(cx, c)
+        if options['pdf']['lazy'] or isinstance(b, PDFExpr):
+            return PDFExpr('+', self, b)
+        return PDF(*_add(self, b))
 
     def __rsub__(self, b):
-        return PDF(b-self.x[::-1], self.y[::-1])
+        if options['pdf']['lazy']:
+            return PDFExpr('-', b, self)
+        return PDF(*_rsub(self, b))
 
     def __sub__(self, b):
         'Subtract two PDFs, returning a new PDF'
+        if options['pdf']['lazy'] or isinstance(b, PDFExpr):
+            return PDFExpr('-', self, b)
         return self.__add__(-b)
 
     def __rmul__(self, b):
         return self._nmul(b)
 
     def _nmul(self, b):
-        if b == 0:
-            raise ValueError("Multiplying by 0 does not produce a PDF.")
-        return PDF(b * self.x, self.y)
+        if options['pdf']['lazy']:
+            return PDFExpr('*', self, b)
+        return PDF(*_nmul(self, b))
 
     def __mul__(self, b):
         "Multiply two PDFs, returning a new PDF"
-        if isinstance(b, int) or isinstance(b, float) or isinstance(b, long):
+        if _is_scalar(b):
             return self._nmul(b)
-
-        a = self
-        # if second variable crosses 0, swap the order for best results
-        if b.x[0] < 0 and b.x[-1] > 0:
-            a, b = b, a
-        extremes = np.outer([a.x[0], a.x[-1]], [b.x[0], b.x[-1]])
-        zmin, zmax = np.min(extremes), np.max(extremes)
-        bx = b.x
-        by = b.y.reshape(-1, 1)
-        if zmin * zmax <= 0:
-            # if the range crosses 0, do not evaluate at 0
-            by = by[bx != 0.0]
-            bx = bx[bx != 0.0]
-
-        cx = np.linspace(zmin, zmax, options['pdf']['numpart'])
-        cy = np.sum(np.abs([a.pdf(cx/x)/x for x in bx]) * by, 0)
-        return PDF(cx, cy)
+        if options['pdf']['lazy'] or isinstance(b, PDFExpr):
+            return PDFExpr('*', self, b)
+        return PDF(*_mul(self, b))
 
     def _ndiv(self, b):
-        if b == 0:
-            raise ValueError("Cannot divide a PDF by 0.")
-        return PDF(self.x/b, self.y)
+        if options['pdf']['lazy']:
+            return PDFExpr('/', self, b)
+        return PDF(*_ndiv(self, b))
 
     def __rdiv__(self, b):
-        if self.x[0]*self.x[-1] <= 0:
-            raise ValueError("Cannot divide by PDFs that include 0")
-        if b == 0:
-            raise ValueError("Dividing 0 by a PDF does not return a PDF")
-        extremes = [b/self.x[0], b/self.x[-1]]
-        zmin, zmax = np.min(extremes), np.max(extremes)
-        nsamp = options['pdf']['numpart']
-        cx = np.linspace(zmin, zmax, nsamp)
-        return PDF(cx, self.pdf(b/cx)/cx**2)
+        if options['pdf']['lazy']:
+            return PDFExpr('/', b, self)
+        return PDF(*_rdiv(self, b))
+
+    def __rtruediv__(self, b):
+        return self.__rdiv__(b)
 
     def __truediv__(self, b):
         return self.__div__(b)
 
     def __div__(self, b):
         "Divide two PDFs, returning a new PDF"
-        if isinstance(b, int) or isinstance(b, float) or isinstance(b, long):
+        if _is_scalar(b):
             return self._ndiv(b)
-        if b.x[0]*b.x[-1] <= 0:
-            raise ValueError("Cannot divide by PDFs that include 0")
-        a = self
-        extremes = np.outer([a.x[0], a.x[-1]], [1.0/b.x[0], 1.0/b.x[-1]])
-        zmin, zmax = np.min(extremes), np.max(extremes)
-        bx = b.x
-        by = b.y.reshape(-1, 1)
-        nsamp = options['pdf']['numpart']
-        cx = np.linspace(zmin, zmax, nsamp)
-        cy = np.sum([a.pdf(x * cx)*x for x in bx] * by, 0)
-        return PDF(cx, cy)
+        if options['pdf']['lazy'] or isinstance(b, PDFExpr):
+            return PDFExpr('/', self, b)
+        return PDF(*_div(self, b))
 
     @property
     def mode(self):
@@ -400,6 +417,7 @@ class PDF(object):
         :param cdf: plots the CDF instead.
         :returns: A list of lines that were added.
         """
+        plt = pyplot()
         try:
             if fig:
                 plt.figure()
@@ -421,6 +439,7 @@ class PDF(object):
         :type fig: Boolean.
         :returns: A list of lines that were added.
         """
+        plt = pyplot()
         try:
             if fig:
                 plt.figure()
@@ -443,6 +462,445 @@ class PDF(object):
         self.plot()
         p.text(self.__str__())
 
+class PDFExpr(object):
+    """
+    A lazily evaluated arithmetic expression of PDFs.
+
+    When options['pdf']['lazy'] is True, arithmetic on PDFs returns a
+    PDFExpr instead of a new PDF.  Nothing is computed until the
+    expression is evaluated, which happens the first time one of its
+    PDF attributes, such as *mean* or *pdf()*, is used.  Intermediate
+    results are not trimmed, resampled and normalized like PDF
+    objects are, so deep expressions are faster and more accurate.
+    Subexpressions used more than once are computed once.
+
+    Args:
+      op (str): '+', '-', '*', '/' or 'neg'.
+      args: The operands. PDFs, PDFExprs or scalars.
+
+    :Example:
+
+    >>> options['pdf']['lazy'] = True
+    >>> f = a*b + c/d - e
+    >>> f.mean
+    >>> p = f.evaluate('sample', 10**6)
+    """
+
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+        self._cache = {}
+
+    def evaluate(self, method='transform', num=100000):
+        """
+        Evaluates the expression.
+
+        :param method: 'transform' combines the densities of the
+          operands like PDF arithmetic does, treating every operand as
+          independent.  'sample' draws *num* random samples of each
+          PDF and does the arithmetic on the samples.  Each PDF is then
+          a single random variable, so for example *a - a* is 0.
+        :param num: Number of samples for 'sample'.
+        :returns: A PDF object.
+        """
+        key = (method, num)
+        if not key in self._cache:
+            if method == 'transform':
+                d = self._transform()
+                self._cache[key] = PDF(d.x, d.y)
+            elif method == 'sample':
+                self._cache[key] = ExperimentalPDF(self._sample(num, {}))
+            else:
+                raise ValueError("Unknown method '%s'" % method)
+        return self._cache[key]
+
+    def _transform(self):
+        # Returns (x, y) of the density of this expression.
+        if not 'density' in self._cache:
+            args = [_transform(a) for a in self.args]
+            a = args[0]
+            if self.op == 'neg':
+                val = _neg(a)
+            else:
+                b = args[1]
+                if self.op == '+':
+                    if _is_scalar(a):
+                        a, b = b, a
+                    val = _nadd(a, b) if _is_scalar(b) else _add(a, b)
+                elif self.op == '-':
+                    if _is_scalar(b):
+                        val = _nadd(a, -b)
+                    elif _is_scalar(a):
+                        val = _rsub(b, a)
+                    else:
+                        val = _add(a, _Density(*_neg(b)))
+                elif self.op == '*':
+                    if _is_scalar(a):
+                        a, b = b, a
+                    val = _nmul(a, b) if _is_scalar(b) else _mul(a, b)
+                else:
+                    if _is_scalar(b):
+                        val = _ndiv(a, b)
+                    elif _is_scalar(a):
+                        val = _rdiv(b, a)
+                    else:
+                        val = _div(a, b)
+            self._cache['density'] = _Density(*val)
+        return self._cache['density']
+
+    def _sample(self, num, memo):
+        # Returns random samples of this expression. memo maps the id
+        # of each PDF and PDFExpr already sampled to its samples.
+        args = [_sample(a, num, memo) for a in self.args]
+        if self.op == 'neg':
+            return -args[0]
+        if self.op == '+':
+            return args[0] + args[1]
+        if self.op == '-':
+            return args[0] - args[1]
+        if self.op == '*':
+            return args[0] * args[1]
+        return np.true_divide(args[0], args[1])
+
+    def __getattr__(self, name):
+        # PDF attributes and methods of the evaluated expression
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.evaluate(), name)
+
+    def __neg__(self):
+        return PDFExpr('neg', self)
+
+    def __add__(self, b):
+        return PDFExpr('+', self, b)
+
+    def __radd__(self, b):
+        return PDFExpr('+', b, self)
+
+    def __sub__(self, b):
+        return PDFExpr('-', self, b)
+
+    def __rsub__(self, b):
+        return PDFExpr('-', b, self)
+
+    def __mul__(self, b):
+        return PDFExpr('*', self, b)
+
+    def __rmul__(self, b):
+        return PDFExpr('*', b, self)
+
+    def __div__(self, b):
+        return PDFExpr('/', self, b)
+
+    def __rdiv__(self, b):
+        return PDFExpr('/', b, self)
+
+    def __truediv__(self, b):
+        return self.__div__(b)
+
+    def __rtruediv__(self, b):
+        return self.__rdiv__(b)
+
+    def __str__(self):
+        return str(self.evaluate())
+
+class _Density(object):
+    # Normalized density on an arbitrary grid. Used for the
+    # intermediate results of a PDFExpr.
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.abs(np.asarray(y, dtype=np.float64))
+        if x[0] > x[-1]:
+            x = x[::-1]
+            y = y[::-1]
+        tz = trapz(y, x)
+        if tz == 0:
+            tz = 1e-15
+        self.x = x
+        self.y = y / tz
+
+    def pdf(self, arr):
+        return np.interp(arr, self.x, self.y, left=0.0, right=0.0)
+
+def _transform(a):
+    if isinstance(a, PDFExpr):
+        return a._transform()
+    return a
+
+def _sample(a, num, memo):
+    if _is_scalar(a):
+        return a
+    if not id(a) in memo:
+        if isinstance(a, PDFExpr):
+            memo[id(a)] = a._sample(num, memo)
+        else:
+            memo[id(a)] = a.random(num)
+    return memo[id(a)]
+
+# Arithmetic on densities. Each function takes PDFs, or anything with
+# x, y and pdf(), and returns the x and y arrays of the result, which
+# PDF() then trims, resamples and normalizes.
+
+def _is_scalar(b):
+    return isinstance(b, int) or isinstance(b, float) or isinstance(b, long)
+
+def _neg(a):
+    return -a.x[::-1], a.y[::-1]
+
+def _nadd(a, b):
+    return b + a.x, a.y
+
+def _rsub(a, b):
+    return b - a.x[::-1], a.y[::-1]
+
+def _nmul(a, b):
+    if b == 0:
+        raise ValueError("Multiplying by 0 does not produce a PDF.")
+    return b * a.x, a.y
+
+def _ndiv(a, b):
+    if b == 0:
+        raise ValueError("Cannot divide a PDF by 0.")
+    return a.x / b, a.y
+
+def _rdiv(a, b):
+    if a.x[0]*a.x[-1] <= 0:
+        raise ValueError("Cannot divide by PDFs that include 0")
+    if b == 0:
+        raise ValueError("Dividing 0 by a PDF does not return a PDF")
+    extremes = [b/a.x[0], b/a.x[-1]]
+    zmin, zmax = np.min(extremes), np.max(extremes)
+    nsamp = options['pdf']['numpart']
+    cx = np.linspace(zmin, zmax, nsamp)
+    return cx, a.pdf(b/cx)/cx**2
+
+def _add(a, b):
+    return _convolve(a.pdf, a.x[0], a.x[-1], b.pdf, b.x[0], b.x[-1])
+
+def _mul(a, b):
+    if a.x[0] * a.x[-1] > 0 and b.x[0] * b.x[-1] > 0:
+        # log|ab| = log|a| + log|b|
+        c = _log_convolve(a, b)
+        if c is not None:
+            return c
+
+    # if second variable crosses 0, swap the order for best results
+    if b.x[0] < 0 and b.x[-1] > 0:
+        a, b = b, a
+    extremes = np.outer([a.x[0], a.x[-1]], [b.x[0], b.x[-1]])
+    zmin, zmax = np.min(extremes), np.max(extremes)
+    bx = b.x
+    by = b.y
+    if zmin * zmax <= 0:
+        # if the range crosses 0, do not evaluate at 0
+        by = by[bx != 0.0]
+        bx = bx[bx != 0.0]
+
+    cx = np.linspace(zmin, zmax, options['pdf']['numpart'])
+    return cx, _blocked_sum(lambda x: a.pdf(cx / x) / np.abs(x), bx, _weights(bx, by), len(cx))
+
+def _div(a, b):
+    if b.x[0]*b.x[-1] <= 0:
+        raise ValueError("Cannot divide by PDFs that include 0")
+    if a.x[0] * a.x[-1] > 0:
+        # log|a/b| = log|a| - log|b|
+        c = _log_convolve(a, b, True)
+        if c is not None:
+            return c
+
+    extremes = np.outer([a.x[0], a.x[-1]], [1.0/b.x[0], 1.0/b.x[-1]])
+    zmin, zmax = np.min(extremes), np.max(extremes)
+    nsamp = options['pdf']['numpart']
+    cx = np.linspace(zmin, zmax, nsamp)
+    return cx, _blocked_sum(lambda x: a.pdf(x * cx) * np.abs(x), b.x, _weights(b.x, b.y), len(cx))
+
+def _convolve(af, a0, a1, bf, b0, b1, dx=None):
+    """
+    Convolves two densities.
+
+    Both are sampled with the same step, so that the narrower one gets
+    options['pdf']['numpart'] points, but the wider one gets at most
+    10 * numpart points.  So a density less than 1/10 as wide as the
+    other gets fewer than numpart points.  Convolutions where both
+    have more than options['pdf']['fftmin'] points use FFTs.
+
+    :param af: Function returning the first density.
+    :param a0, a1: Range of the first density.
+    :param bf: Function returning the second density.
+    :param b0, b1: Range of the second density.
+    :param dx: Step to use instead, if not None.
+    :returns: Tuple of arrays (x, y) of the density of the sum.
+    """
+    ar = a1 - a0
+    br = b1 - b0
+    if dx is None:
+        wide = __builtin__.max(ar, br)
+        narrow = __builtin__.min(ar, br)
+        nsamp = options['pdf']['numpart']
+        dx = __builtin__.max(narrow, wide / 10.0) / (nsamp - 1.0)
+    if dx == 0:
+        dx = 1e-15
+    ax = a0 + dx * np.arange(int(math.ceil(ar / dx)) + 1)
+    bx = b0 + dx * np.arange(int(math.ceil(br / dx)) + 1)
+    ay = af(ax)
+    by = bf(bx)
+    if __builtin__.min(len(ay), len(by)) > options['pdf']['fftmin']:
+        c = fftconvolve(ay, by)
+        # roundoff can leave tiny negative values
+        c[c < 0] = 0
+    else:
+        c = np.convolve(ay, by)
+    return a0 + b0 + dx * np.arange(len(c)), c
+
+def _log_pdf(p, du):
+    # Returns the sign of the values of p, which must not cross 0, and
+    # the density and range of log|p|.  The density is averaged over
+    # cells of width du, so jumps at the ends of the range are weighted
+    # correctly.
+    h = du / 2.0
+    if p.x[0] > 0:
+        return 1, lambda u: (p.cdf(np.exp(u + h)) - p.cdf(np.exp(u - h))) / du, \
+            np.log(p.x[0]), np.log(p.x[-1])
+    return -1, lambda u: (p.cdf(-np.exp(u - h)) - p.cdf(-np.exp(u + h))) / du, \
+        np.log(-p.x[-1]), np.log(-p.x[0])
+
+def _log_convolve(a, b, div=False):
+    """
+    Multiplies or divides two PDFs that do not cross 0.
+
+    The logarithm of a product is the sum of the logarithms, so the
+    densities of log|a| and log|b| are convolved (a Mellin transform)
+    and the result transformed back.
+
+    A step of du in log|x| is a step of about x*du in x, so the log
+    step is made small enough that the large end of each PDF is
+    sampled as finely as an even grid of options['pdf']['numpart']
+    points would sample it.  For a PDF whose range starts near 0
+    that takes many points.  The result is averaged over the cells of
+    an even grid by :func:`_rebin`.
+
+    :param a: The first PDF.
+    :param b: The second PDF.
+    :param div: Divide a by b instead of multiplying.
+    :returns: Tuple of arrays (x, y) of the density of the result, or
+      None if more than 100 * numpart points would be needed.
+    """
+    ar = np.abs(np.log(a.x[-1] / a.x[0]))
+    br = np.abs(np.log(b.x[-1] / b.x[0]))
+    nsamp = options['pdf']['numpart']
+    du = __builtin__.min(1 - np.exp(-ar), 1 - np.exp(-br)) / (nsamp - 1.0)
+    if du == 0 or __builtin__.max(ar, br) > 100 * nsamp * du:
+        return None
+    asign, af, a0, a1 = _log_pdf(a, du)
+    bsign, bf, b0, b1 = _log_pdf(b, du)
+    if div:
+        # density of -log|b|
+        bf, b0, b1 = (lambda u, f=bf: f(-u)), -b1, -b0
+    u, c = _convolve(af, a0, a1, bf, b0, b1, du)
+    z = np.exp(u)
+    z, c = _rebin(z, c / z)
+    return asign * bsign * z, c
+
+def _rebin(x, y):
+    """
+    Averages a density on an uneven grid over the cells of an even
+    grid of options['pdf']['numpart'] points.
+
+    PDF() would interpolate at the new points instead, which misses
+    most of the probability of a peak narrower than a cell.  Like
+    PDF(), tails longer than 10% of the range are trimmed to
+    options['pdf']['range'].
+
+    :param x: Increasing x values.
+    :param y: Density at x.
+    :returns: Tuple of arrays (x, y) of the averaged density.
+    """
+    cdf = np.append(0.0, np.cumsum((y[1:] + y[:-1]) / 2.0 * np.diff(x)))
+    if cdf[-1] == 0:
+        return x, y
+    cdf /= cdf[-1]
+    _range = options['pdf']['range']
+    lo, hi = np.interp([(1.0 - _range) / 2.0, (1.0 + _range) / 2.0], cdf, x)
+    x0, x1 = x[0], x[-1]
+    dist = x1 - x0
+    if lo - x0 > .1 * dist:
+        x0 = lo
+    if x1 - hi > .1 * dist:
+        x1 = hi
+    cx = np.linspace(x0, x1, options['pdf']['numpart'])
+    edges = np.concatenate(([x0], (cx[1:] + cx[:-1]) / 2.0, [x1]))
+    return cx, np.diff(np.interp(edges, x, cdf)) / np.diff(edges)
+
+def _weights(x, y):
+    # probability near each point of a PDF, up to a constant
+    if len(x) < 2:
+        return y
+    return y * np.gradient(x)
+
+def _blocked_sum(func, bx, by, n):
+    """
+    Returns the sum of func(x) * w over points x with weights w.
+
+    func is called with a column of points from bx and must return an
+    array with a row for each point. Blocks of points are used so that
+    each call returns about 2**20 values.
+
+    :param func: Function of a column of x values.
+    :param bx: x values.
+    :param by: Weights.
+    :param n: Length of the rows returned by func.
+    :returns: Array of length n.
+    """
+    block = __builtin__.max(1, 2**20 // n)
+    out = np.zeros(n)
+    for i in xrange(0, len(bx), block):
+        x = bx[i:i + block].reshape(-1, 1)
+        out += np.sum(func(x) * by[i:i + block].reshape(-1, 1), 0)
+    return out
+
+def random_state(rng=None):
+    """
+    Returns the random number generator to use for sampling.
+
+    :param rng: None to use numpy's global generator (np.random), an
+      integer seed for a new generator, or a
+      numpy.random.RandomState, which is returned as it is.
+    :returns: numpy.random.RandomState or the np.random module.
+    """
+    if rng is None:
+        return np.random
+    if isinstance(rng, (int, long, np.integer)):
+        return np.random.RandomState(rng)
+    return rng
+
+def _quantiles(x, y, num):
+    """
+    Computes *num* evenly spaced quantiles, from 0 to 1, of a
+    piecewise linear density.
+
+    The CDF is quadratic in each interval, so it is inverted exactly
+    instead of being interpolated linearly.
+
+    :param x: x values.
+    :param y: Density at x.
+    :returns: Array of length num.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) < 2:
+        return np.repeat(x[0], 2)
+    h = np.diff(x)
+    c = np.append([0.0], np.cumsum((y[:-1] + y[1:]) / 2.0 * h))
+    target = np.linspace(0, c[-1], num)
+    i = np.clip(np.searchsorted(c, target, side='right') - 1, 0, len(h) - 1)
+    d = target - c[i]
+    y0 = y[i]
+    slope = (y[i + 1] - y0) / np.where(h[i] > 0, h[i], 1.0)
+    # solve y0*t + slope*t**2/2 = d in a way that is stable when slope is ~0
+    denom = y0 + np.sqrt(np.maximum(y0**2 + 2 * slope * d, 0))
+    t = np.where(denom > 0, 2 * d / np.where(denom > 0, denom, 1.0), 0.0)
+    return x[i] + np.clip(t, 0, h[i])
+
 def _get_range(sfunc, min, max):
     " Truncate PDFs with long tails"
 
@@ -474,6 +932,79 @@ def _get_range(sfunc, min, max):
 
     return min, max
 
+def _adaptive_grid(func, min, max, tol, maxpts):
+    """
+    Builds a grid on which linear interpolation of func is accurate.
+
+    Starting from 17 evenly spaced points, intervals are split in two
+    while the area between func and the line through their endpoints,
+    or the error of the linearly interpolated CDF inside them, is more
+    than *tol* times the area under func.  The second check matters
+    where func is steep but nearly straight.  Splitting stops at
+    *maxpts* points, keeping the intervals with the largest errors.
+
+    :returns: Tuple of arrays (x, func(x)).
+    """
+    x = np.linspace(min, max, 17)
+    y = func(x)
+    while len(x) < maxpts:
+        h = np.diff(x)
+        xm = x[:-1] + h / 2.0
+        ym = func(xm)
+        err = np.abs(ym - (y[:-1] + y[1:]) / 2.0) * h
+        mass = np.sum((y[:-1] + 4 * ym + y[1:]) * h) / 6.0
+        # the CDF is off by about h*|y1-y0|/8 halfway across
+        err = np.maximum(err, np.abs(np.diff(y)) * h / 8.0)
+        split = np.nonzero((err > tol * mass) & (h > (max - min) * 1e-12))[0]
+        if len(split) == 0:
+            break
+        if len(split) > maxpts - len(x):
+            split = np.sort(split[np.argsort(err[split])[len(x) - maxpts:]])
+        x = np.insert(x, split + 1, xm[split])
+        y = np.insert(y, split + 1, ym[split])
+    return x, y
+
+def AdaptivePDF(func, min, max, tol=None, maxpts=None):
+    """
+    Creates a PDF on a grid that is finer where the density curves
+    sharply or has more probability.
+
+    Narrow peaks and long tails are resolved with far fewer points than
+    an evenly spaced grid needs.  The PDF works like any other.  As for
+    all PDFs, pdf(), cdf() and ppf() find values by bisection, which
+    takes O(log n) time for n points.
+
+    :param func: Function returning the (not necessarily normalized)
+      density at an array of x values.
+    :param min: The minimum value.
+    :param max: The maximum value.
+    :param tol: Maximum error, as a fraction of the total probability,
+      of linear interpolation of the PDF and CDF in each interval.
+      Default is options['pdf']['tol'].
+    :param maxpts: Maximum number of points. Default is 10 times
+      options['pdf']['numpart'].
+    :returns: A PDF object
+
+    :Example:
+
+    >>> p = AdaptivePDF(lambda x: scipy.stats.norm.pdf(x, 0, .01), -1, 1)
+    """
+    if tol is None:
+        tol = options['pdf']['tol']
+    if maxpts is None:
+        maxpts = 10 * options['pdf']['numpart']
+    if min >= max:
+        raise ValueError("min must be less than max.")
+    return PDF(*_adaptive_grid(func, float(min), float(max), tol, maxpts), adaptive=True)
+
+def _sample_pdf(func, min, max):
+    # PDF of a density function, on an adaptive grid if
+    # options['pdf']['adaptive'] is set.
+    if options['pdf']['adaptive']:
+        return AdaptivePDF(func, min, max)
+    x = np.linspace(min, max, options['pdf']['numpart'])
+    return PDF(x, func(x))
+
 def ExponPDF(rate):
     """
     Creates Exponential Probability Density Function.
@@ -488,10 +1019,8 @@ def ExponPDF(rate):
 
     sfunc = scipy.stats.expon(loc=0, scale=1.0/rate)
 
-    nsamp = options['pdf']['numpart']
     min, max = _get_range(sfunc, None, None)
-    x = np.linspace(min, max, nsamp)
-    return PDF(x, sfunc.pdf(x))
+    return _sample_pdf(sfunc.pdf, min, max)
 
 
 def RayleighPDF(scale):
@@ -509,10 +1038,8 @@ def RayleighPDF(scale):
 
     sfunc = scipy.stats.rayleigh(loc=0, scale=scale)
 
-    nsamp = options['pdf']['numpart']
     min, max = _get_range(sfunc, None, None)
-    x = np.linspace(min, max, nsamp)
-    return PDF(x, sfunc.pdf(x))
+    return _sample_pdf(sfunc.pdf, min, max)
 
 def WeibullPDF(shape, scale):
     """
@@ -530,13 +1057,11 @@ def WeibullPDF(shape, scale):
 
     sfunc = scipy.stats.exponweib(1, shape, scale=scale)
 
-    nsamp = options['pdf']['numpart']
     mmin = None
     if sfunc.pdf(0) == np.PINF:
         mmin = .01
     min, max = _get_range(sfunc, mmin, None)
-    x = np.linspace(min, max, nsamp)
-    return PDF(x, sfunc.pdf(x))
+    return _sample_pdf(sfunc.pdf, min, max)
 
 
 def NormalPDF(mean, dev, min=None, max=None):
@@ -566,9 +1091,7 @@ def NormalPDF(mean, dev, min=None, max=None):
     a = (min - mean) / dev
     b = (max - mean) / dev
     sfunc = scipy.stats.truncnorm(a, b, loc=mean, scale=dev)
-    nsamp = options['pdf']['numpart']
-    x = np.linspace(min, max, nsamp)
-    return PDF(x, sfunc.pdf(x))
+    return _sample_pdf(sfunc.pdf, min, max)
 
 def LognormalPDF(mean, dev, min=None,  max=None):
     """
@@ -595,15 +1118,17 @@ def LognormalPDF(mean, dev, min=None,  max=None):
     #http://stackoverflow.com/questions/8870982/how-do-i-get-a-lognormal-distribution-in-python-with-mu-and-sigma
     sfunc=scipy.stats.lognorm(dev,loc=0,scale=np.exp(mean))
     min, max = _get_range(sfunc, __builtin__.max(min,0), max)
-    nsamp = options['pdf']['numpart']
-    x = np.linspace(min, max, nsamp)
-    return PDF(x, sfunc.pdf(x))
+    return _sample_pdf(sfunc.pdf, min, max)
     
-def NetPDF(addr):
+def NetPDF(addr, cache=True, offline=None):
     """
-    Retrieves a PDF from a remote address.
+    Retrieves a PDF from a remote address. PDFs are cached
+    like :func:`NetObj` objects.
 
     :param addr: URI. PDF must be stored in JSON format
+    :param cache: Use the cache. Default is True.
+    :param offline: Only use the cache, never the network. Default is
+        options['netobj']['offline'].
     :returns: A PDF object
 
     :Example:
@@ -611,7 +1136,7 @@ def NetPDF(addr):
     >>> u = NetPDF('http://foo.com/myproject/parameters/density')
     """
     from jpickle import NetObj
-    p = NetObj(addr)
+    p = NetObj(addr, cache, offline)
     if not isinstance(p, PDF):
         raise Exception('Link is not a PDF')
     return p
@@ -700,7 +1225,9 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
                  2*IQR/n^(1/3) where IQR is the interquartile range
                  of the data.
     :type nbins: int
-    :param fit: Use Gaussian KDE (default=False -- linear interpolation)
+    :param fit: Use Gaussian KDE (default=False -- linear interpolation).
+        With more than options['pdf']['kdebinned'] data points, the KDE
+        is computed approximately from binned data using FFTs.
     :type fit: True or "Gaussian"
     :param bw: Bandwidth for Gaussian KDE (default=None)
     :type bw: string or float. String must be 'scott' or 'silverman'
@@ -708,7 +1235,8 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
         [default=None (uninformative)]
     :type prior: PDF
     :param error: Error in the data.  For example, the measurement error.
-        Required for Bayesian.
+        Required for Bayesian.  The likelihood is summed in the log
+        domain, so any number of measurements can be used.
     :type error: PDF. Typically a NormalPDF with a mean of 0.
     """
     data = np.array(data).astype(np.float64)
@@ -730,8 +1258,7 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
         # Bayesian parameter estimation
         if not isinstance(error, PDF):
             raise ValueError("ERROR: error is not a PDF")
-        data = data + error
-        p = posterior(data, prior)
+        p = _error_posterior(data, error, prior)
     elif fit is True or (type(fit) is str and fit.lower() == 'gaussian'):
         # Gaussian KDE
         if np.min(data) == np.max(data):
@@ -744,7 +1271,10 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
         if max is None:
             max = mean + 5 * dev
         x = np.linspace(float(min), float(max), options['pdf']['numpart'])
-        p = PDF(x, gkde.evaluate(x))
+        if len(data) > options['pdf']['kdebinned']:
+            p = PDF(x, gkde.evaluate_binned(x))
+        else:
+            p = PDF(x, gkde.evaluate(x))
     else:
         # linear interpolation from histograms
         if nbins == 0:
@@ -757,18 +1287,7 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
 
         y, bins = np.histogram(data, nbins, normed=True)
         if len(bins) > 2:
-            x = bins[:-1] + np.diff(bins) / 2.0
-            sp = interpolate.splrep(x, y, s=0, k=1)
-            mmin = bins[0]
-            mmax = bins[-1]
-            if min is not None:
-                mmin = min
-            if max is not None:
-                mmax = max
-            x = np.linspace(float(mmin), float(mmax), options['pdf']['numpart'])
-            y = interpolate.splev(x, sp, der=0)
-            y[y < 0] = 0    # if the extrapolation goes negative...
-            p = PDF(x, y)
+            p = BinnedPDF(y, bins, min, max)
         else:
             if np.min(data)!=np.max(data):
                 # not enough data. assume uniform over range
@@ -779,6 +1298,42 @@ def ExperimentalPDF(data, min=None, max=None, fit=False, bw=None, nbins=0, prior
     p.data = data
     return p
 
+def BinnedPDF(counts, bins, min=None, max=None):
+    """
+    Create a PDF from a histogram of the data.
+
+    The PDF is built the same way :func:`ExperimentalPDF` does when
+    **fit** is false, by linearly interpolating the histogram. This is
+    useful when the data is too large to fit in memory and was binned
+    in blocks.
+
+    :param counts: Number of samples (or the density) in each bin.
+    :type counts: Array
+    :param bins: Bin edges. There must be at least three, one more
+      than the number of counts.
+    :type bins: Array
+    :param min: A minimum value for the PDF range.
+    :param max: A maximum value for the PDF range.
+    :returns: A PDF object.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    bins = np.asarray(bins, dtype=np.float64)
+    if len(bins) != len(counts) + 1 or len(bins) < 3:
+        raise ValueError("ERROR: need at least two bins and one more edge than counts")
+    y = counts / np.sum(counts * np.diff(bins))
+    x = bins[:-1] + np.diff(bins) / 2.0
+    sp = interpolate.splrep(x, y, s=0, k=1)
+    mmin = bins[0]
+    mmax = bins[-1]
+    if min is not None:
+        mmin = min
+    if max is not None:
+        mmax = max
+    x = np.linspace(float(mmin), float(mmax), options['pdf']['numpart'])
+    y = interpolate.splev(x, sp, der=0)
+    y[y < 0] = 0    # if the extrapolation goes negative...
+    return PDF(x, y)
+
 def HPDF(data, min=None, max=None):
     """
     Histogram PDF - initialized with points from a histogram.
@@ -833,5 +1388,66 @@ def posterior(data, prior=None):
     rmin = max([c.x[0] for c in data])
     rmax = min([c.x[-1] for c in data])
     x = np.linspace(rmin, rmax, options['pdf']['numpart'])
-    y = np.prod([c.pdf(x) for c in data], 0)
-    return PDF(x, y)
+
+    # Multiplying many PDFs underflows, so add their logs.
+    logy = np.zeros(len(x))
+    with np.errstate(divide='ignore'):
+        for c in data:
+            logy += np.log(c.pdf(x))
+    return _exp_pdf(x, logy)
+
+def _error_posterior(data, error, prior=None):
+    """
+    Computes the posterior PDF of a quantity from measurements with
+    errors.  This is posterior([d + error for d in data], prior), but
+    the log of the likelihood is computed on the grid for all the
+    measurements at once instead of building a PDF for each one.
+
+    :param data: Array of measurements.
+    :param error: PDF of the error of each measurement.
+    :param prior: Prior PDF, or None for a noninformative prior.
+    :returns: A posterior PDF object.
+    """
+    rmin = np.max(data) + error.x[0]
+    rmax = np.min(data) + error.x[-1]
+    if prior:
+        if not isinstance(prior, PDF):
+            raise ValueError("ERROR: prior is not a PDF")
+        rmin = __builtin__.max(rmin, prior.x[0])
+        rmax = __builtin__.min(rmax, prior.x[-1])
+    if rmin >= rmax:
+        raise ValueError("The data is too spread out for the error PDF")
+
+    def loglike(x):
+        with np.errstate(divide='ignore'):
+            logy = _blocked_sum(lambda d: np.log(error.pdf(x - d)), data, np.ones(len(data)), len(x))
+            if prior:
+                logy += np.log(prior.pdf(x))
+        return logy
+
+    num = options['pdf']['numpart']
+    x = np.linspace(rmin, rmax, num)
+    logy = loglike(x)
+
+    # With many measurements the posterior is much narrower than the
+    # range, so evaluate it again where it is not negligible, until
+    # that covers at least half the points.  Each pass narrows the
+    # grid by a factor of about num/3.
+    for npass in xrange(20):
+        i = np.nonzero(logy > np.max(logy) - 36)[0]
+        if not len(i) or i[-1] - i[0] >= num // 2:
+            break
+        lo = x[__builtin__.max(i[0] - 1, 0)]
+        hi = x[__builtin__.min(i[-1] + 1, num - 1)]
+        if not lo < hi:
+            break
+        x = np.linspace(lo, hi, num)
+        logy = loglike(x)
+    return _exp_pdf(x, logy)
+
+def _exp_pdf(x, logy):
+    # Returns PDF(x, exp(logy)), scaled so the largest value is 1.
+    top = np.max(logy)
+    if not np.isfinite(top):
+        raise ValueError("The posterior is zero everywhere")
+    return PDF(x, np.exp(logy - top))
@@ -0,0 +1,301 @@
+"""
+.. module:: pdfarray
+    :synopsis: This module implements arrays of PDFs.
+
+A :class:`PDFArray` holds the PDFs of every element of a
+multidimensional output in a few 2D arrays instead of one
+:class:`puq.PDF` object per element.  Each PDF has its own range but
+they all have the same number of evenly spaced points, so pdf(), cdf()
+and ppf() are computed for all the elements at once.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+import numpy as np
+from puq.options import options
+from puq.pdf import PDF
+
+class PDFArray(object):
+    """
+    Create an array of PDFs.
+
+    PDF *i* is defined on np.linspace(lo[i], hi[i], m), where m is the
+    number of columns of *y*.
+
+    Args:
+      lo (array): Minimum of each PDF.
+      hi (array): Maximum of each PDF.
+      y (2D array): Values of each PDF, one row per PDF. They do not
+        need to be normalized.
+      shape (tuple): Shape of the array of PDFs. Default is (len(lo),).
+
+    Use :meth:`from_samples` to build one from a matrix of samples.
+    """
+
+    def __init__(self, lo, hi, y, shape=None):
+        lo = np.asarray(lo, dtype=np.float64).ravel()
+        hi = np.asarray(hi, dtype=np.float64).ravel()
+        y = np.abs(np.asarray(y, dtype=np.float64)).reshape(len(lo), -1)
+        if shape is None:
+            shape = (len(lo),)
+        shape = tuple(shape)
+        if len(hi) != len(lo) or int(np.prod(shape)) != len(lo):
+            raise ValueError("lo, hi and y must have one PDF for each element of shape")
+        if y.shape[1] < 2:
+            raise ValueError("PDFs need at least two points")
+        if np.any(hi <= lo):
+            raise ValueError("hi must be greater than lo")
+        self.shape = shape
+        self.lo = lo
+        self.hi = hi
+        dx = (hi - lo) / (y.shape[1] - 1.0)
+        area = np.sum((y[:, 1:] + y[:, :-1]) / 2.0, 1) * dx
+        area[area == 0] = 1e-15
+        self.y = y / area.reshape(-1, 1)
+        self._init_cdf()
+
+    def _init_cdf(self):
+        dx = self._dx().reshape(-1, 1)
+        cells = (self.y[:, 1:] + self.y[:, :-1]) / 2.0 * dx
+        self.cdfy = np.column_stack((np.zeros(len(self.lo)), np.cumsum(cells, 1)))
+        self.cdfy /= self.cdfy[:, -1:]
+
+    def _dx(self):
+        return (self.hi - self.lo) / (self.y.shape[1] - 1.0)
+
+    @classmethod
+    def from_samples(cls, samples, nbins=None, num=None):
+        """
+        Builds the PDFs of all the elements from a matrix of samples
+        in one pass, the way :func:`puq.ExperimentalPDF` builds one
+        from a histogram when *fit* is False.
+
+        Args:
+          samples (array): One row per sample (job). The remaining
+            dimensions are the shape of the array of PDFs.
+          nbins (int): Number of histogram bins. Default is the median
+            over the elements of 2*IQR/n^(1/3).
+          num (int): Number of points in each PDF. Default is
+            options['pdf']['numpart'].
+        Returns:
+          A PDFArray.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        shape = samples.shape[1:]
+        data = samples.reshape(len(samples), -1)
+        nsamp, n = data.shape
+        if nsamp < 2:
+            raise ValueError("need at least two samples to build a PDF")
+        if np.any(np.isnan(data)):
+            raise ValueError('NaN data cannot be handled')
+        if num is None:
+            num = options['pdf']['numpart']
+
+        lo = np.min(data, 0)
+        hi = np.max(data, 0)
+        # like np.histogram, widen the range of constant elements
+        same = lo == hi
+        lo[same] -= .5
+        hi[same] += .5
+        width = hi - lo
+
+        if not nbins:
+            q75, q25 = np.percentile(data, [75, 25], axis=0)
+            iqr = q75 - q25
+            ok = iqr > 0
+            nbins = 2
+            if np.any(ok):
+                nbins = int(np.median(width[ok] / (2 * iqr[ok] / nsamp**(1.0/3))) + .5)
+        nbins = max(int(nbins), 2)
+
+        # histogram every column at once
+        b = np.clip(((data - lo) / width * nbins).astype(int), 0, nbins - 1)
+        b += np.arange(n) * nbins
+        counts = np.bincount(b.ravel(), minlength=n * nbins).reshape(n, nbins)
+
+        # linearly interpolate the bin centers onto the grid,
+        # extrapolating to the ends like BinnedPDF
+        p = np.linspace(0, nbins, num) - .5
+        k = np.clip(np.floor(p).astype(int), 0, nbins - 2)
+        f = p - k
+        y = counts[:, k] * (1 - f) + counts[:, k + 1] * f
+        y[y < 0] = 0
+        return cls(lo, hi, y, shape)
+
+    @classmethod
+    def from_pdfs(cls, pdfs, num=None):
+        """
+        Builds a PDFArray from PDF objects.
+
+        Args:
+          pdfs: Array or nested list of PDFs.
+          num (int): Number of points in each PDF. Default is
+            options['pdf']['numpart'].
+        Returns:
+          A PDFArray with the shape of *pdfs*.
+        """
+        pdfs = np.array(pdfs, dtype=object)
+        if num is None:
+            num = options['pdf']['numpart']
+        flat = pdfs.ravel()
+        lo = np.array([p.x[0] for p in flat])
+        hi = np.array([p.x[-1] for p in flat])
+        t = np.linspace(0, 1, num)
+        y = np.array([p.pdf(l + t * (h - l)) for p, l, h in zip(flat, lo, hi)])
+        return cls(lo, hi, y, pdfs.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def size(self):
+        "Number of PDFs."
+        return len(self.lo)
+
+    @property
+    def x(self):
+        "x values of each PDF, one row per PDF."
+        return self.lo.reshape(-1, 1) + np.outer(self._dx(), np.arange(self.y.shape[1]))
+
+    def __getitem__(self, index):
+        """
+        Returns the PDF of one element as a :class:`puq.PDF` object.
+        """
+        i = np.ravel_multi_index(np.atleast_1d(index), self.shape)
+        return PDF(self.x[i], self.y[i])
+
+    def _values(self, arr):
+        # Reshapes arr to one row per PDF. Returns the array and the
+        # shape of the result.
+        arr = np.asarray(arr, dtype=np.float64)
+        if arr.ndim == 0:
+            return np.zeros((self.size, 1)) + arr, self.shape
+        if arr.shape == self.shape:
+            return arr.reshape(-1, 1), self.shape
+        if arr.shape[:-1] == self.shape:
+            return arr.reshape(self.size, -1), arr.shape
+        raise ValueError("Expected a scalar or an array of shape %s or %s + (k,)" % (self.shape, self.shape))
+
+    def _lookup(self, table, arr, left, right):
+        # linear interpolation of table (one row per PDF) at arr
+        v, out = self._values(arr)
+        m = self.y.shape[1]
+        t = (v - self.lo.reshape(-1, 1)) / self._dx().reshape(-1, 1)
+        i = np.clip(np.floor(t).astype(int), 0, m - 2)
+        f = t - i
+        rows = np.arange(self.size).reshape(-1, 1)
+        res = table[rows, i] * (1 - f) + table[rows, i + 1] * f
+        res[t < 0] = left
+        res[t > m - 1] = right
+        return res.reshape(out)
+
+    def pdf(self, arr):
+        """
+        Computes the PDFs.
+
+        Args:
+          arr: A scalar, an array with a value for each PDF, or an
+            array with k values for each PDF (shape + (k,)).
+        Returns:
+          Array of pdf(x), with the shape of *arr* (or shape, for a
+          scalar).
+        """
+        return self._lookup(self.y, arr, 0.0, 0.0)
+
+    def cdf(self, arr):
+        """
+        Computes the CDFs.
+
+        Args:
+          arr: x values, as for :meth:`pdf`.
+        Returns:
+          Array of cdf(x).
+        """
+        return self._lookup(self.cdfy, arr, 0.0, 1.0)
+
+    def ppf(self, arr):
+        """
+        Percent Point Function (inverse CDF)
+
+        Args:
+          arr: Probabilities, as for :meth:`pdf`.
+        Returns:
+          Array of ppf(x).
+        """
+        q, out = self._values(arr)
+        n, m = self.cdfy.shape
+        # Offsetting each row by 2 makes the CDFs one sorted array,
+        # so every row is searched by one call.
+        offset = 2.0 * np.arange(n).reshape(-1, 1)
+        j = np.searchsorted((self.cdfy + offset).ravel(), (np.clip(q, 0, 1) + offset).ravel(), side='right')
+        i = np.clip(j.reshape(q.shape) - 1 - m * np.arange(n).reshape(-1, 1), 0, m - 2)
+        rows = np.arange(n).reshape(-1, 1)
+        c0 = self.cdfy[rows, i]
+        dc = self.cdfy[rows, i + 1] - c0
+        f = np.where(dc > 0, (q - c0) / np.where(dc > 0, dc, 1.0), 0.0)
+        f = np.clip(f, 0, 1)
+        return (self.lo.reshape(-1, 1) + (i + f) * self._dx().reshape(-1, 1)).reshape(out)
+
+    def quantiles(self, q):
+        """
+        Computes the same quantiles of every PDF.
+
+        Args:
+          q: List of probabilities.
+        Returns:
+          Array of shape + (len(q),).
+        """
+        q = np.asarray(q, dtype=np.float64).ravel()
+        return self.ppf(np.tile(q, (self.size, 1)).reshape(self.shape + (len(q),)))
+
+    @property
+    def mean(self):
+        "Array of the means of the PDFs."
+        x = self.x
+        dx = self._dx()
+        return (np.trapz(x * self.y, axis=1) * dx).reshape(self.shape)
+
+    @property
+    def dev(self):
+        "Array of the standard deviations of the PDFs."
+        x = self.x
+        dx = self._dx()
+        mean = self.mean.reshape(-1, 1)
+        var = np.trapz(self.y * (x - mean)**2, axis=1) * dx
+        return np.sqrt(np.abs(var)).reshape(self.shape)
+
+    def save(self, hf, name):
+        """
+        Writes the PDFs to a group in an HDF5 file.
+
+        Args:
+          hf: An open HDF5 filehandle or group.
+          name: Name of the group to create. It is replaced if it
+            exists.
+        """
+        if name in hf:
+            del hf[name]
+        grp = hf.create_group(name)
+        grp.attrs['shape'] = np.array(self.shape, dtype=np.int64)
+        grp['lo'] = self.lo
+        grp['hi'] = self.hi
+        grp.create_dataset('y', data=self.y, compression='gzip', shuffle=True)
+
+    @classmethod
+    def load(cls, hf, name):
+        """
+        Reads PDFs written by :meth:`save`.
+
+        Args:
+          hf: An open HDF5 filehandle or group.
+          name: Name of the group.
+        Returns:
+          A PDFArray.
+        """
+        grp = hf[name]
+        return cls(grp['lo'][...], grp['hi'][...], grp['y'][...], tuple(grp.attrs['shape']))
+
+    def __str__(self):
+        return "PDFArray %s of %s points" % (self.shape, self.y.shape[1])
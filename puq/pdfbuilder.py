@@ -0,0 +1,255 @@
+"""
+.. module:: pdfbuilder
+    :synopsis: This module builds PDFs from data that arrives in chunks.
+
+A :class:`PDFBuilder` keeps a histogram and the running moments of the
+data added to it, so a PDF can be built from more samples than fit in
+memory, or updated as jobs finish.  Builders fed with different parts of
+the data can be merged.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+import math
+import numpy as np
+from scipy.signal import fftconvolve
+from puq.options import options
+from puq.util import update_moments
+from puq.pdf import PDF, BinnedPDF
+
+class PDFBuilder(object):
+    """
+    Builds an experimental PDF incrementally.
+
+    The data is counted in bins whose width is a power of two, aligned
+    to multiples of the width.  When the data needs more than *maxbins*
+    bins, the width is doubled by adding pairs of bins.  When builders
+    are merged, the histogram with narrower bins is coarsened the same
+    way, so the bins always line up.
+
+    Args:
+      maxbins (int): Maximum number of bins. Default is
+        options['pdf']['maxbins'].
+
+    :Example:
+
+    >>> b = PDFBuilder()
+    >>> for chunk in chunks:
+    ...     b.add(chunk)
+    >>> pdf = b.finalize()
+    """
+
+    def __init__(self, maxbins=None):
+        if maxbins is None:
+            maxbins = options['pdf']['maxbins']
+        self.maxbins = maxbins
+        self.exp = None         # bin width is 2**exp
+        self.start = 0          # index of the first bin
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.min = np.inf
+        self.max = -np.inf
+        self.moments = None     # (n, mean, m2), see update_moments()
+
+    @property
+    def n(self):
+        "Number of samples added."
+        if self.moments is None:
+            return 0
+        return int(self.moments[0])
+
+    @property
+    def mean(self):
+        "Mean of the samples added."
+        return self.moments[1]
+
+    @property
+    def dev(self):
+        "Standard deviation of the samples added."
+        return math.sqrt(self.moments[2] / self.moments[0])
+
+    def add(self, data):
+        """
+        Adds samples.
+
+        Args:
+          data: Array of samples.
+        Returns:
+          The builder.
+        """
+        data = np.asarray(data, dtype=np.float64).ravel()
+        if len(data) == 0:
+            return self
+        if np.any(np.isnan(data)):
+            raise ValueError('NaN data cannot be handled')
+        lo, hi = np.min(data), np.max(data)
+        if self.exp is None:
+            # start with about maxbins/4 bins over the first chunk
+            span = hi - lo or abs(hi) or 1.0
+            self.exp = int(math.floor(math.log(4.0 * span / self.maxbins, 2)))
+        self._extend(min(lo, self.min), max(hi, self.max))
+        idx = np.floor(data / 2.0**self.exp).astype(np.int64) - self.start
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+        self.min = min(lo, self.min)
+        self.max = max(hi, self.max)
+        self.moments = update_moments(self.moments, data)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the samples of another builder.
+
+        Args:
+          other: A PDFBuilder.
+        Returns:
+          This builder.
+        """
+        if other.exp is None:
+            return self
+        counts, start, exp = other.counts, other.start, other.exp
+        if self.exp is None:
+            self.exp = exp
+        # bring both to the same bin width
+        while self.exp < exp:
+            self._coarsen()
+        while exp < self.exp:
+            counts, start = _pairs(counts, start)
+            exp += 1
+        self._extend(min(self.min, other.min), max(self.max, other.max))
+        while exp < self.exp:
+            counts, start = _pairs(counts, start)
+            exp += 1
+        i = start - self.start
+        self.counts[i:i + len(counts)] += counts
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.moments is None:
+            self.moments = other.moments
+        else:
+            self.moments = _merge_moments(self.moments, other.moments)
+        return self
+
+    def _extend(self, lo, hi):
+        # Grows the histogram to cover [lo, hi], doubling the bin width
+        # while more than maxbins bins would be needed.
+        while True:
+            w = 2.0**self.exp
+            first = int(math.floor(lo / w))
+            last = int(math.floor(hi / w))
+            if last - first + 1 <= self.maxbins:
+                break
+            self._coarsen()
+        if len(self.counts) == 0:
+            self.start = first
+            self.counts = np.zeros(last - first + 1, dtype=np.int64)
+            return
+        end = self.start + len(self.counts)
+        first = min(first, self.start)
+        last = max(last, end - 1)
+        counts = np.zeros(last - first + 1, dtype=np.int64)
+        counts[self.start - first:end - first] = self.counts
+        self.start = first
+        self.counts = counts
+
+    def _coarsen(self):
+        self.counts, self.start = _pairs(self.counts, self.start)
+        self.exp += 1
+
+    def histogram(self):
+        """
+        Returns the histogram.
+
+        Returns:
+          Tuple (counts, bins) like numpy.histogram().
+        """
+        w = 2.0**self.exp
+        return self.counts.copy(), (self.start + np.arange(len(self.counts) + 1)) * w
+
+    def finalize(self, min=None, max=None, fit=False, nbins=0):
+        """
+        Builds the PDF of the samples added so far.  More samples can
+        be added afterwards.
+
+        Args:
+          min: A minimum value for the PDF range.
+          max: A maximum value for the PDF range.
+          fit: If True, smooth the histogram with a Gaussian kernel,
+            using Scott's rule for the bandwidth like
+            :func:`puq.ExperimentalPDF` with *fit* True. Otherwise,
+            interpolate the histogram linearly.
+          nbins: Number of bins (used if fit is False). Default is
+            2*IQR/n^(1/3) where IQR is the interquartile range of the
+            data, like :func:`puq.ExperimentalPDF`. The quartiles are
+            interpolated from the histogram.
+        Returns:
+          A PDF object.
+        """
+        if self.n < 2:
+            raise ValueError("ERROR: need at least two data points to build a PDF")
+        if self.min == self.max:
+            return PDF([self.min - .5, self.max + .5], [1, 1])
+        counts, bins = self.histogram()
+        w = bins[1] - bins[0]
+
+        if fit:
+            dev = self.dev
+            sigma = dev * self.n**(-0.2)
+            if min is None:
+                min = self.mean - 5 * dev
+            if max is None:
+                max = self.mean + 5 * dev
+            half = int(5 * sigma / w) + 1
+            kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * w / sigma)**2)
+            dens = fftconvolve(counts.astype(np.float64), kernel)
+            dens[dens < 0] = 0
+            # bin centers of the convolution
+            cx = bins[0] + w / 2.0 + (np.arange(len(dens)) - half) * w
+            x = np.linspace(float(min), float(max), options['pdf']['numpart'])
+            return PDF(x, np.interp(x, cx, dens, left=0.0, right=0.0))
+
+        # combine the fine bins into about nbins bins
+        if not nbins:
+            nbins = self._nbins()
+        nbins = np.clip(nbins, 2, len(counts))
+        group = int(len(counts) // nbins)
+        if group > 1:
+            pad = -len(counts) % group
+            counts = np.append(counts, np.zeros(pad, dtype=counts.dtype))
+            counts = counts.reshape(-1, group).sum(1)
+            bins = bins[0] + np.arange(len(counts) + 1) * w * group
+        if len(counts) < 2:
+            counts = np.append(counts, 0)
+            bins = np.append(bins, bins[-1] + bins[1] - bins[0])
+        if min is None:
+            min = self.min
+        if max is None:
+            max = self.max
+        return BinnedPDF(counts, bins, min, max)
+
+    def _nbins(self):
+        # The bin rule of ExperimentalPDF, so a PDF does not change
+        # shape when its data grows too large to histogram at once.
+        counts, bins = self.histogram()
+        cdf = np.append(0, np.cumsum(counts)) / float(self.n)
+        q25, q75 = np.interp([.25, .75], cdf, bins)
+        q25, q75 = np.clip([q25, q75], self.min, self.max)
+        if q75 == q25:
+            return 2
+        return int((self.max - self.min) / (2 * (q75 - q25) / self.n**(1.0/3)) + .5)
+
+def _pairs(counts, start):
+    # Adds pairs of bins, doubling their width. Returns the new counts
+    # and index of the first bin.
+    if start % 2:
+        counts = np.append([0], counts)
+        start -= 1
+    if len(counts) % 2:
+        counts = np.append(counts, [0])
+    return counts.reshape(-1, 2).sum(1), start // 2
+
+def _merge_moments(a, b):
+    # Combines two (n, mean, m2) tuples from update_moments().
+    n = a[0] + b[0]
+    delta = b[1] - a[1]
+    return (n, a[1] + delta * b[0] / n, a[2] + b[2] + delta**2 * a[0] * b[0] / n)
@@ -8,12 +8,9 @@ See LICENSE file for terms.
 
 from puq.jpickle import unpickle, pickle
 import sys, string, matplotlib
-if sys.platform == 'darwin':
-    matplotlib.use('macosx', warn=False)
-else:
-    matplotlib.use('tkagg', warn=False)
+from puq.backend import pyplot
+plt = pyplot()
 from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.pyplot as plt
 #from matplotlib import rc
 #rc('text', usetex=True)
 import numpy as np
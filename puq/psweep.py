@@ -5,8 +5,8 @@ See LICENSE file for terms.
 """
 
 from logging import debug
-from hdf import get_output_names
-import h5py
+from hdf import get_output_names, session
+from puq import timing
 
 class PSweep(object):
     def __init__(self, iteration_cb=None):
@@ -33,28 +33,38 @@ class PSweep(object):
         Returns True on success.
         """
 
-        while True:
-            sweep.host.add_jobs(sweep.fname, self.get_args())
-            ok = sweep._save_and_run(dryrun)
-            if not ok:
-                return False
-
-            hf = h5py.File(sweep.fname + '.hdf5')
-            if not sweep.collect_data(hf):
-                hf.close()
-                return False
-            self.analyze(hf) #defined in subclasses
-            hf.close()
-
-            if self.iteration_cb is not None:
-                hf = h5py.File(sweep.fname + '.hdf5')
-                if self.iteration_cb(sweep, hf):
-                    hf.close()
-                    sweep._save_hdf5()
+        # One file handle is shared by all the steps of an iteration.
+        # It is checkpointed while the jobs run.
+        sess = session(sweep.fname + '.hdf5')
+        with sess:
+            while True:
+                timing.start()
+                # the timings are saved, and cProfile stopped, even
+                # when the iteration fails
+                try:
+                    sweep.host.add_jobs(sweep.fname, self.get_args())
+                    ok = sweep._save_and_run(dryrun)
+                    if not ok:
+                        return False
+
+                    hf = sess.file
+                    if not sweep.collect_data(hf):
+                        return False
+                    with timing.phase('analyze'):
+                        self.analyze(hf) #defined in subclasses
+
+                    if self.iteration_cb is not None:
+                        with timing.phase('iteration_cb'):
+                            done = self.iteration_cb(sweep, sess.file)
+                    else:
+                        done = True
+                    if done:
+                        # keep any state the analysis updated
+                        sweep._save_hdf5()
+                finally:
+                    timing.save(sess.file)
+                if done:
                     return True
-                hf.close()
-            else:
-                return True
 
 class APSweep(object):
     """
@@ -89,12 +99,11 @@ class APSweep(object):
         for args in plist_full:
             out.append(self.cache[tuple(args)])
 
-        hf = h5py.File(sweep.fname + '.hdf5')
-        if not self.outvarname:
-            self.outvarname = get_output_names(hf)[0]
-            self.outvardesc = hf['output/data/%s' % self.outvarname].attrs['description']
-        #hdf5_set_result(hf, self.outvarname, np.array(out), self.iteration_num, self.outvardesc)
-        hf.close()
+        with session(sweep.fname + '.hdf5') as hf:
+            if not self.outvarname:
+                self.outvarname = get_output_names(hf)[0]
+                self.outvardesc = hf['output/data/%s' % self.outvarname].attrs['description']
+            #hdf5_set_result(hf, self.outvarname, np.array(out), self.iteration_num, self.outvardesc)
 
     def run(self, sweep):
         """
@@ -6,21 +6,15 @@ See LICENSE file for terms.
 
 import sys
 import numpy as np
-import sympy
-from scipy.interpolate import Rbf
 from puq.meshgridn import meshgridn
 from puq.pdf import ExperimentalPDF
-from puq.parameter import get_psamples
-from sympy.utilities.lambdify import lambdify
-
-import matplotlib
-if sys.platform == 'darwin':
-    matplotlib.use('macosx', warn=False)
-else:
-    matplotlib.use('tkagg', warn=False)
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import cm
-import matplotlib.pyplot as plt
+from puq.parameter import get_psamples, iter_psamples
+from puq.hdf import iter_chunks
+from puq.options import options
+from puq.backend import pyplot
+
+# sympy, scipy.interpolate and matplotlib are slow to import,
+# so they are imported when first needed.
 
 class Function(object):
     """
@@ -89,7 +83,7 @@ class Function(object):
 #    def pdf(self, fit=True, params=[], force=False, min=None, max=None,
 #            return_samples=False, psamples=None):
     def pdf(self, fit=True, params=[], force=False, min=None, max=None,
-            return_samples=False, psamples=None,numsamples=None):
+            return_samples=False, psamples=None,numsamples=None, rng=None):
 
 
         if not self.params and not params:
@@ -108,26 +102,51 @@ class Function(object):
                         self.params[i] = newp
             self.vars = self.params2vars(self.params)
 
+        # Too many samples to hold in memory. Propagate them in chunks
+        # and histogram the results as they are computed. psamples
+        # can be an h5py dataset (see puq.hdf.get_psamples_view).
+        nsamp = numsamples
+        if hasattr(psamples, 'shape'):
+            nsamp = len(psamples)
+        elif psamples is not None:
+            nsamp = None
+        stream = not return_samples and \
+            nsamp is not None and nsamp > options['pdf']['chunksize'] and \
+            not [p for p in self.params if getattr(p, 'use_samples', False)]
+
         # get parameter pdf samples
-        if psamples is None:
-            xseed = get_psamples(self.params,num=numsamples) #FR                
+        if stream:
+            from puq.pdfbuilder import PDFBuilder
+            builder = PDFBuilder()
+            if psamples is None:
+                chunks = iter_psamples(self.params, numsamples, rng=rng)
+            else:
+                chunks = (block for row, block in iter_chunks(psamples))
+            for xseed in chunks:
+                builder.add(self.evala(xseed))
+            rmin, rmax = builder.min, builder.max
         else:
-            xseed = psamples
-
-        results = np.array(self.evala(xseed))
+            if psamples is None:
+                xseed = get_psamples(self.params,num=numsamples, rng=rng) #FR                
+            elif hasattr(psamples, 'shape'):
+                xseed = psamples[...]
+            else:
+                xseed = psamples
+            results = np.array(self.evala(xseed))
+            rmin, rmax = np.min(results), np.max(results)
 
         if min is None or max is None:
             calc_min, calc_max = self.minmax()
 
         if min is None:
-            if np.min(results) < calc_min:
-                min = np.min(results)
+            if rmin < calc_min:
+                min = rmin
             else:
                 min = calc_min
 
         if max is None:
-            if np.max(results) > calc_max:
-                max = np.max(results)
+            if rmax > calc_max:
+                max = rmax
             else:
                 max = calc_max
 
@@ -135,6 +154,8 @@ class Function(object):
             self.params = saved_params
             self.vars = saved_vars
 
+        if stream:
+            return builder.finalize(min=min, max=max, fit=fit)
         if return_samples:
             return ExperimentalPDF(results, fit=fit, min=min, max=max, force=force), results
         else:
@@ -160,6 +181,9 @@ class Function(object):
 
     def _plot2(self, steps=40, legend=True, title=True, labels=True, **kwargs):
         # 2 dimensions plus result on Z-axis = 3D plot
+        plt = pyplot()
+        from mpl_toolkits.mplot3d import Axes3D
+        from matplotlib import cm
         x = np.linspace(*self.vars[0][1], num=steps+1)
         y = np.linspace(*self.vars[1][1], num=steps+1)
         xx = meshgridn(x, y)
@@ -198,6 +222,7 @@ class Function(object):
         return ax
 
     def _plot1(self, steps=100, labels=True, **kwargs):
+        plt = pyplot()
         fig = kwargs.get('fig')
         if fig is None:
             fig = plt.figure()
@@ -214,6 +239,45 @@ class Function(object):
             plt.xlabel(xlab)
         return p
 
+def _poly_terms(eqn, vnames):
+    # Returns the numeric form of a polynomial equation: a vector of
+    # coefficients and a matrix with the exponent of each variable in
+    # each term. Returns (None, None) if eqn is not a polynomial in
+    # vnames with numeric coefficients.
+    import sympy
+    try:
+        poly = sympy.Poly(eqn, *sympy.symbols(list(vnames)))
+        terms = poly.terms()
+        coef = np.array([float(c) for _e, c in terms])
+        exps = np.array([e for e, _c in terms], dtype=np.int64).reshape(len(terms), len(vnames))
+    except Exception:
+        return None, None
+    return coef, exps
+
+def _eval_poly(coef, exps, args):
+    # Evaluates the numeric form of a polynomial. A table of the
+    # powers of each variable is computed by repeated multiplication.
+    # Indexing the tables with the exponents gives every term at
+    # once, and their dot product with the coefficients is the
+    # result. Points are done in blocks of about 2**20 term values.
+    args = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in args])
+    shape = args[0].shape if args else ()
+    pts = [x.ravel() for x in args]
+    m = int(np.prod(shape))
+    res = np.empty(m)
+    block = max(1, 2**20 // max(len(coef), 1))
+    for i in xrange(0, m, block):
+        n = min(block, m - i)
+        terms = np.ones((len(coef), n))
+        for d, x in enumerate(pts):
+            tab = np.empty((exps[:, d].max() + 1, n))
+            tab[0] = 1.0
+            for k in xrange(1, len(tab)):
+                tab[k] = tab[k - 1] * x[i:i + n]
+            terms *= tab[exps[:, d]]
+        res[i:i + n] = coef.dot(terms)
+    return res.reshape(shape)[()]
+
 class ResponseFunc(Function):
     """
     Args:
@@ -239,33 +303,76 @@ class ResponseFunc(Function):
         for x, y in vars:
             vnames.append(str(x))
 
-        self._eqn = sympy.S(eqn)
         self.vars = vars
         self.vnames = vnames
-        self._reinit_()
+        self._set_eqn(eqn)
+
+    def _set_eqn(self, eqn):
+        # Parses the equation and computes its numeric form.
+        import sympy
+        self._eqn = sympy.S(eqn)
+        self._eqnstr = str(self._eqn)
+        self._coef, self._exps = _poly_terms(self._eqn, self.vnames)
+        self._lambda = None
 
     def _reinit_(self):
         self.vnames = map(str, self.vnames)
-        v = sympy.symbols(self.vnames)
-        self.eval = lambdify(v, self._eqn)
+        # Pickles from before the numeric form have the equation
+        # and a lambdified eval function instead.
+        self.__dict__.pop('eval', None)
+        if not '_eqnstr' in self.__dict__:
+            self._set_eqn(self._eqn)
+        self.__dict__.setdefault('_eqn', None)
+        self._lambda = None
+
+    def __getstate__(self):
+        # The sympy equation and lambdified function are rebuilt
+        # on demand, so don't pickle them.
+        state = self.__dict__.copy()
+        state.pop('_eqn', None)
+        state.pop('_lambda', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_eqn', None)
+        self.__dict__.setdefault('_lambda', None)
 
     @property
     def eqn(self):
+        if self._eqn is None:
+            import sympy
+            self._eqn = sympy.S(self._eqnstr)
         return self._eqn
 
     @eqn.setter
     def eqn(self, value):
-        self._eqn = value
-        v = sympy.symbols(self.vnames)
-        self.eval = lambdify(v, self._eqn)
+        self._set_eqn(value)
+
+    def eval(self, *args, **kwargs):
+        """
+        Evaluates the response function. Arguments are the values of
+        the variables, in order or by name. Arrays are broadcast.
+        """
+        if kwargs:
+            args = list(args) + [kwargs[n] for n in self.vnames[len(args):]]
+        if self._coef is None:
+            # not a polynomial in the variables
+            if self._lambda is None:
+                import sympy
+                from sympy.utilities.lambdify import lambdify
+                self._lambda = lambdify(sympy.symbols(self.vnames), self.eqn)
+            return self._lambda(*args)
+        return _eval_poly(self._coef, self._exps, args)
 
     def _plot1(self, *args, **kwargs):
         p = Function._plot1(self, *args, **kwargs)
-        plt.title('Response Plot for %s' % self._eqn)
+        plt = pyplot()
+        plt.title('Response Plot for %s' % self.eqn)
         if self.data is not None:
             # scatter plot actual data
             plt.scatter(self.data[:, 0], self.data[:, 1], color='black')
-        plt.ylabel(self._eqn)
+        plt.ylabel(self.eqn)
         return p
 
     def _plot2(self, *args, **kwargs):
@@ -292,6 +399,7 @@ class ResponseFunc(Function):
             with care.
         """
         import itertools
+        import sympy
         if not self.eqn.is_polynomial():
             return self.eqn
         ranges = [y for _x, y in self.vars]
@@ -327,11 +435,12 @@ class ResponseFunc(Function):
         .. note::
             May reduce accuracy of response surface.  Use with care.
         """
-        if not isinstance(self._eqn, sympy.Add):
-            return self._eqn
-        print [t.as_coeff_Mul() for t in self._eqn.args]
-        print [(t.as_coeff_Mul()[0].evalf(digits), t.as_coeff_Mul()[1]) for t in self._eqn.args]
-        return sympy.Add(*[sympy.Mul(t.as_coeff_Mul()[0].evalf(digits), t.as_coeff_Mul()[1]) for t in self._eqn.args])
+        import sympy
+        if not isinstance(self.eqn, sympy.Add):
+            return self.eqn
+        print [t.as_coeff_Mul() for t in self.eqn.args]
+        print [(t.as_coeff_Mul()[0].evalf(digits), t.as_coeff_Mul()[1]) for t in self.eqn.args]
+        return sympy.Add(*[sympy.Mul(t.as_coeff_Mul()[0].evalf(digits), t.as_coeff_Mul()[1]) for t in self.eqn.args])
 
     def rmse(self):
         """
@@ -352,6 +461,31 @@ class ResponseFunc(Function):
         rmsep = 100.0*rmse/(np.max(results) - np.min(results))
         return rmse, rmsep
 
+def _rbf_from_nodes(pts, function, epsilon, nodes):
+    # Returns an Rbf interpolating pts using already solved node
+    # weights, without refitting. Mirrors what Rbf.__init__ sets.
+    from scipy.interpolate import Rbf
+    pts = [np.asarray(a) for a in pts]
+    nodes = np.asarray(nodes, dtype=float).flatten()
+    rbf = Rbf.__new__(Rbf)
+    rbf.xi = np.asarray([a.astype(float).flatten() for a in pts[:-1]])
+    rbf.N = rbf.xi.shape[-1]
+    rbf.di = pts[-1].flatten()
+    if len(nodes) != rbf.N or len(rbf.di) != rbf.N:
+        raise ValueError("Node weights do not match the points.")
+    rbf.mode = '1-D'
+    if hasattr(rbf, '_euclidean_norm'):
+        rbf.norm = rbf._euclidean_norm
+    else:
+        rbf.norm = 'euclidean'
+    rbf.epsilon = float(epsilon)
+    rbf.smooth = 0.0
+    rbf.function = function
+    rbf.nodes = nodes
+    # sets rbf._function
+    rbf._init_function(np.ones((1, 1)))
+    return rbf
+
 class SampledFunc(Function):
     def __init__(self, *pts, **kwargs):
         if pts is None or len(pts) == 0:
@@ -370,12 +504,14 @@ class SampledFunc(Function):
 
     def _plot1(self, *args, **kwargs):
         p = Function._plot1(self, *args, **kwargs)
+        plt = pyplot()
         plt.title('Response Plot')
         plt.scatter(*self.pts, color='black')
         return p
 
     def _plot2(self, *args, **kwargs):
         ax = Function._plot2(self, *args, **kwargs)
+        plt = pyplot()
         plt.title('Response Plot')
         ax.scatter(*self.pts, color='black')
         return ax
@@ -388,10 +524,22 @@ class SampledFunc(Function):
         if type(self.pts) is np.ndarray:
             self.pts = [x for x in self.pts.T]
 
+        # Rebuild from the saved node weights if we have them.
+        # Fitting is a dense O(n^3) solve, rebuilding is O(n).
+        nodes = getattr(self, '_nodes', None)
+        if nodes is not None and self.eps is not None:
+            try:
+                self._interp_func = _rbf_from_nodes(self.pts, self.rbfunc, self.eps, nodes)
+                return
+            except Exception:
+                pass
+
+        from scipy.interpolate import Rbf
         if self.eps is None:
             self._interp_func = Rbf(*self.pts, function=self.rbfunc)
         else:
             self._interp_func = Rbf(*self.pts, function=self.rbfunc, epsilon=self.eps)
+        self._nodes = np.asarray(self._interp_func.nodes)
 
     def get_epsilon(self):
         return self.eps
@@ -399,6 +547,7 @@ class SampledFunc(Function):
     def set_epsilon(self, eps):
         #print "Setting epsilon to %s" % eps
         self.eps = eps
+        self._nodes = None
         self._reinit_()
     epsilon = property(get_epsilon, set_epsilon, None, None)
 
@@ -408,6 +557,7 @@ class SampledFunc(Function):
     def set_rbf(self, rbf):
         #print "Setting rbf to %s" % rbf
         self.rbfunc = rbf
+        self._nodes = None
         self._reinit_()
     rbf = property(get_rbf, set_rbf, None, None)
 
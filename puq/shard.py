@@ -0,0 +1,209 @@
+"""
+Sharded job output.
+
+Normally the master process collects every job's stdout and stderr
+into the sweep's HDF5 file and parses the tagged results there.  With
+sharding, each batch of jobs (for example, the jobs packed into one
+PBS script) writes its results to its own small HDF5 file, a shard.
+The master then presents /output/data/* from all the shards as HDF5
+virtual datasets, so collecting copies no data.
+
+A shard mirrors the layout of the sweep file::
+
+  /shard/jobs             job number of each row
+  /output/data/<name>     tagged stdout results, one row per job
+  /output/jobs/<name>     tagged stderr results, one row per job
+  /output/jobs/<n>/...    stdout and stderr of job n (optional)
+
+The sweep file gets /shard/jobs too, listing the jobs of all the
+merged shards, so the jobs are counted even when their stdout and
+stderr were not kept.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+import os, sys
+import h5py
+import numpy as np
+from logging import debug
+from puq.util import parse_hdf5_tags, decode_hdf5_tag, split_elements
+from puq.hdf import set_job_output, mark_rewritten
+
+def vds_supported():
+    """vds_supported()
+
+    Returns True if h5py and the HDF5 library support virtual
+    datasets (h5py 2.9 and HDF5 1.10 or later).
+    """
+    return hasattr(h5py, 'VirtualLayout') and \
+        h5py.version.hdf5_version_tuple >= (1, 10, 0)
+
+def write_shard(fname, jobs, logs=True):
+    """write_shard(fname, jobs, logs=True)
+
+    Writes the tagged results of a batch of jobs to a shard.
+    This runs on the worker, after the jobs have finished.
+
+    Args:
+      fname: Shard filename.
+      jobs: List of (job number, output basename) tuples. The job's
+        stdout and stderr are read from basename.out and basename.err.
+      logs: If True, stdout and stderr are saved in the shard too.
+    """
+    debug(fname)
+    nrows = len(jobs)
+    values = [{}, {}]
+    descs = {}
+    h5 = h5py.File(fname, 'w')
+    try:
+        h5['shard/jobs'] = np.array([j for j, base in jobs], dtype=np.int64)
+        if logs:
+            h5.require_group('output/jobs').attrs['layout'] = 'group'
+        for row, (job, base) in enumerate(jobs):
+            for k, ext in enumerate(['out', 'err']):
+                try:
+                    text = open('%s.%s' % (base, ext)).read()
+                except IOError:
+                    continue
+                if logs:
+                    set_job_output(h5, job, 'std%s' % ext, text)
+                for line in parse_hdf5_tags(text):
+                    x = decode_hdf5_tag(line, job)
+                    v = x['value']
+                    n = x['name']
+                    if not n in values[k]:
+                        values[k][n] = np.empty([nrows] + list(np.shape(v)))
+                        values[k][n].fill(np.nan)
+                        descs[n] = x['desc']
+                    values[k][n][row] = v
+
+        for k, gname in enumerate(['output/data', 'output/jobs']):
+            if not values[k]:
+                continue
+            grp = h5.require_group(gname)
+            for n, adata in values[k].iteritems():
+                if k == 0:
+                    elements = split_elements(n, adata)
+                else:
+                    elements = [(n, adata)]
+                for name, data in elements:
+                    grp[name] = data
+                    grp[name].attrs['description'] = str(descs[n])
+    finally:
+        h5.close()
+
+def _runs(jobs):
+    # Splits the job numbers of a shard's rows into runs of
+    # consecutive jobs. Yields (first row, last row + 1, first job).
+    start = 0
+    for i in xrange(1, len(jobs) + 1):
+        if i == len(jobs) or jobs[i] != jobs[i-1] + 1:
+            yield start, i, jobs[start]
+            start = i
+
+def merge_shards(hf, shards, njobs):
+    """merge_shards(hf, shards, njobs)
+
+    Presents the results in a list of shards as /output/data/* and
+    /output/jobs/* datasets in the sweep file, one row per job.
+    Rows of jobs without results are NaN.
+
+    If virtual datasets are supported (see :func:`vds_supported`), the
+    datasets are virtual datasets that map to the shards and no data is
+    copied. The shards must then be kept with the sweep file.  Otherwise
+    the data is copied.
+
+    Job stdout and stderr saved in a shard are linked into
+    /output/jobs/<n> with external links. The job numbers of all the
+    shards are written to /shard/jobs.
+
+    Args:
+      hf: An open HDF5 filehandle of the sweep file.
+      shards: List of shard filenames. Missing files are skipped.
+      njobs: Total number of jobs.
+    """
+    use_vds = vds_supported()
+
+    # name -> [(shard filename, shard jobs, shape, dtype)] for each group
+    sources = {'output/data': {}, 'output/jobs': {}}
+    descs = {}
+    alljobs = set()
+    for fname in shards:
+        if not os.path.exists(fname):
+            continue
+        # the sweep file and its shards live in the same directory
+        relname = os.path.relpath(fname, os.path.dirname(os.path.abspath(hf.filename)))
+        with h5py.File(fname, 'r') as sh:
+            jobs = sh['shard/jobs'][...]
+            alljobs.update(jobs)
+            for gname in sources:
+                if not gname in sh:
+                    continue
+                for name, ds in sh[gname].iteritems():
+                    if isinstance(ds, h5py.Group):
+                        if gname == 'output/jobs' and name.isdigit():
+                            jgrp = hf.require_group('output/jobs')
+                            if not 'layout' in jgrp.attrs:
+                                jgrp.attrs['layout'] = 'group'
+                            if name in jgrp:
+                                del jgrp[name]
+                            jgrp[name] = h5py.ExternalLink(relname, '%s/%s' % (gname, name))
+                        continue
+                    sources[gname].setdefault(name, []).append((relname, jobs, ds.shape, ds.dtype))
+                    descs[name] = ds.attrs.get('description', '')
+                    if not use_vds:
+                        sources[gname][name][-1] += (ds[...],)
+
+    for gname, names in sources.iteritems():
+        if not names:
+            continue
+        grp = hf.require_group(gname)
+        for name, srcs in names.iteritems():
+            shape = (njobs,) + srcs[0][2][1:]
+            if name in grp:
+                del grp[name]
+            if use_vds:
+                layout = h5py.VirtualLayout(shape=shape, dtype=np.float64)
+                for src in srcs:
+                    relname, jobs, sshape = src[:3]
+                    vsrc = h5py.VirtualSource(relname, '%s/%s' % (gname, name), shape=sshape)
+                    for r0, r1, j0 in _runs(jobs):
+                        layout[j0:j0 + r1 - r0] = vsrc[r0:r1]
+                ds = grp.create_virtual_dataset(name, layout, fillvalue=np.nan)
+            else:
+                ds = grp.create_dataset(name, shape=shape, dtype=np.float64, fillvalue=np.nan)
+                for src in srcs:
+                    jobs, data = src[1], src[4]
+                    for r0, r1, j0 in _runs(jobs):
+                        ds[j0:j0 + r1 - r0] = data[r0:r1]
+            ds.attrs['description'] = descs[name]
+            mark_rewritten(ds)
+
+    if 'shard/jobs' in hf:
+        del hf['shard/jobs']
+    if alljobs:
+        hf['shard/jobs'] = np.array(sorted(alljobs), dtype=np.int64)
+
+def main(args):
+    """
+    Command line use, from a job script::
+
+      python -m puq.shard [--nologs] shard.h5 job:basename ...
+    """
+    logs = True
+    if args and args[0] == '--nologs':
+        logs = False
+        args = args[1:]
+    if len(args) < 2:
+        print main.__doc__
+        sys.exit(1)
+    jobs = []
+    for a in args[1:]:
+        job, base = a.split(':', 1)
+        jobs.append((int(job), base))
+    write_shard(args[0], jobs, logs)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -15,6 +15,7 @@ from stat import S_ISDIR
 from glob import glob
 from threading import Thread, Event
 from util import flushStdStreams
+from puq.hdf import require_jobs_group, set_job_output
 
 class SubmitHost(Host):
     """
@@ -163,8 +164,7 @@ class SubmitHost(Host):
         cwd = os.path.abspath(os.getcwd())
         os.chdir(self.fname)
 
-        hf.require_group('output')
-        jobs_grp = hf.require_group('output/jobs')
+        jobs_grp = require_jobs_group(hf)
 
         # find the jobs that are completed and, if the stdout/stderr files are there,
         # move them to hdf5
@@ -201,17 +201,16 @@ class SubmitHost(Host):
                 print "ERROR: job %s directory not found" % j
                 continue
             os.chdir(j)
-            grp = jobs_grp.require_group(str(jobnum))
             for ext in ['out', 'err']:
                 outfile = glob('*.std%s' % ext)
                 if outfile:
                     f = open(outfile[0], 'r')
-                    grp.create_dataset('std%s' % ext, data=f.read())
+                    set_job_output(hf, jobnum, 'std%s' % ext, f.read())
                     f.close()
             for fn in self.prog.outfiles:
                 try:
                     f = open(fn, 'r')
-                    grp.create_dataset(fn, data=f.read())
+                    set_job_output(hf, jobnum, fn, f.read())
                     f.close()
                 except:
                     pass
@@ -9,18 +9,80 @@ import time, os, re, h5py, sys
 import numpy as np
 from puq.testprogram import TestProgram
 from numpy import ndarray
-from puq.hdf import get_output_names
+from puq.hdf import get_output_names, get_job_numbers, get_num_jobs, get_job_output, session, mark_rewritten
 from logging import debug
-from puq.util import vprint
+from puq.util import vprint, fingerprint, parse_hdf5_tags, decode_hdf5_tag, split_elements
 from puq.options import options
 from puq.jpickle import pickle, unpickle
 from socket import gethostname
 from puq.parameter import get_psamples
 from puq.calibrate import calibrate
+from puq.shard import merge_shards
+from puq import timing
 
 _vcache = {}
 _dcache = {}
 
+def _collected_jobs(hf):
+    """
+    _collected_jobs(hf)
+
+    Returns the number of leading jobs whose tagged output has already
+    been written to /output/data.  Files written before the output
+    datasets were resizable return 0, so everything is collected again.
+    """
+    try:
+        collected = int(hf['output'].attrs['collected'])
+    except KeyError:
+        return 0
+    # /output/data was deleted to force a re-analysis
+    if not 'output/data' in hf or not len(hf['output/data']):
+        return 0
+    for gname in ['output/data', 'output/jobs']:
+        if not gname in hf:
+            continue
+        grp = hf[gname]
+        for name in grp:
+            ds = grp[name]
+            if isinstance(ds, h5py.Group):
+                continue
+            if ds.maxshape[:1] != (None,):
+                return 0
+            collected = min(collected, ds.shape[0])
+    return collected
+
+def _append_rows(grp, name, data, start):
+    """
+    _append_rows(grp, name, data, start)
+
+    Writes data to rows start and above of dataset grp[name],
+    which is created chunked with an unlimited first dimension.
+    Rows below start are kept. If the dataset does not exist
+    or cannot be resized, it is recreated and any missing
+    rows below start are NaN.  Unless rows were only appended,
+    the dataset is marked with :func:`puq.hdf.mark_rewritten`.
+    """
+    stop = start + data.shape[0]
+    ds = grp.get(name)
+    old = None
+    if ds is not None and (ds.maxshape[:1] != (None,) or ds.shape[1:] != data.shape[1:]):
+        if ds.shape[1:] == data.shape[1:]:
+            old = ds.value[:start]
+        del grp[name]
+        ds = None
+    if ds is None:
+        ds = grp.create_dataset(name, shape=(start,) + data.shape[1:],
+                                maxshape=(None,) + data.shape[1:],
+                                dtype=data.dtype, chunks=True, fillvalue=np.nan)
+        if old is not None and len(old):
+            ds[:len(old)] = old
+        mark_rewritten(ds)
+    elif start < ds.shape[0]:
+        mark_rewritten(ds)
+    ds.resize(stop, axis=0)
+    ds[start:stop] = data
+    return ds
+
 class Sweep(object):
     """
     Creates an object that contains all the information about
@@ -65,58 +127,172 @@ class Sweep(object):
         self.input_script = os.path.abspath(sys.argv[0])
 
     def _save_hdf5(self):
+        """
+        Writes the sweep, its parameters and the input script to the
+        HDF5 file.  Digests of what was written last time are kept as
+        attributes of /private, so only the pieces that changed
+        are rewritten.
+        """
         debug('')
-        h5 = h5py.File(self.fname + '.hdf5')
-
-        # write HDF5 header information, once only
-        if not 'version' in h5.attrs:
-            h5.attrs['MEMOSA_UQ'] = 'MEMOSA'
-            h5.attrs['version'] = 201
-            #h5.attrs['id'] = self.id
-            h5.attrs['date'] = time.strftime("%b %d %H:%M %Z %Y", time.localtime())
-            h5.attrs['hostname'] = gethostname()
-            h5.attrs['username'] = "puq user" #FR
-            h5.attrs['UQtype'] = self.psweep.__class__.__name__.lower()
-            h5.attrs['description'] = self.description
-
-        # overwrite previous
-        if 'input' in h5:
-            del h5['input']
-        if 'private' in h5:
-            del h5['private']
-
-        hp = h5.require_group('private')
-        hp['sweep'] = pickle(self,max_depth=6)
-
-        # in /input write the input params in json and regular arrays
-        h = h5.require_group('input')
-
-        # basic parameter table for non-python reading of the hdf5 file
-        h.create_dataset('param_array',data=np.column_stack([p.values for p in self.psweep.params]),
-                         compression='gzip',compression_opts=9)
-        h['param_array'].attrs['name'] = [str(p.name) for p in self.psweep.params]
-        h['param_array'].attrs['description'] = [str(p.description) for p in self.psweep.params]
-
-        # json-pickled parameters
-        h = h.require_group('params')
-        for p in self.psweep.params:
-            h[p.name] = pickle(p)
-            if p.attrs!=None and len(p.attrs)>0:
-                for attrtuple in p.attrs:
-                    h[p.name].attrs[attrtuple[0]]=attrtuple[1]
-
-        # input script
-        if hasattr(self, 'input_script'):
-            h5['input/scriptname'] = str(self.input_script)
-            try:
-                h5['input/script'] = open(self.input_script).read()
-            except:
-                h5['input/script'] = "Source was unavailable."
-            h5.close()
+        with timing.phase('save'), session(self.fname + '.hdf5') as h5:
+            # write HDF5 header information, once only
+            if not 'version' in h5.attrs:
+                h5.attrs['MEMOSA_UQ'] = 'MEMOSA'
+                h5.attrs['version'] = 201
+                #h5.attrs['id'] = self.id
+                h5.attrs['date'] = time.strftime("%b %d %H:%M %Z %Y", time.localtime())
+                h5.attrs['hostname'] = gethostname()
+                h5.attrs['username'] = "puq user" #FR
+                h5.attrs['UQtype'] = self.psweep.__class__.__name__.lower()
+                h5.attrs['description'] = self.description
+
+            hp = h5.require_group('private')
+            digest = self._fingerprint()
+            if 'sweep' not in hp or hp.attrs.get('digest_sweep') != digest:
+                if 'sweep' in hp:
+                    del hp['sweep']
+                hp['sweep'] = pickle(self,max_depth=6)
+                hp.attrs['digest_sweep'] = digest
+
+            # in /input write the input params in json and regular arrays
+            h = h5.require_group('input')
+            self._save_param_array(h, hp)
+
+            # json-pickled parameters
+            h = h.require_group('params')
+            names = [p.name for p in self.psweep.params]
+            for name in list(h):
+                if name not in names:
+                    del h[name]
+                    if 'digest_param_%s' % name in hp.attrs:
+                        del hp.attrs['digest_param_%s' % name]
+            for p in self.psweep.params:
+                key = 'digest_param_%s' % p.name
+                digest = fingerprint(p)
+                if p.name in h and hp.attrs.get(key) == digest:
+                    continue
+                if p.name in h:
+                    del h[p.name]
+                h[p.name] = pickle(p)
+                if p.attrs!=None and len(p.attrs)>0:
+                    for attrtuple in p.attrs:
+                        h[p.name].attrs[attrtuple[0]]=attrtuple[1]
+                hp.attrs[key] = digest
+
+            self._save_meta(hp)
+
+            # input script
+            if hasattr(self, 'input_script'):
+                scriptname = str(self.input_script)
+                if not 'input/scriptname' in h5 or h5['input/scriptname'].value != scriptname:
+                    for name in ['input/scriptname', 'input/script']:
+                        if name in h5:
+                            del h5[name]
+                    h5['input/scriptname'] = scriptname
+                    try:
+                        h5['input/script'] = open(self.input_script).read()
+                    except:
+                        h5['input/script'] = "Source was unavailable."
+
+    def _job_list(self):
+        # the host's jobs, in job number order
+        jobs = getattr(self.host, 'jobs', [])
+        if isinstance(jobs, dict):
+            jobs = [jobs[k] for k in sorted(jobs)]
+        return jobs
+
+    def _fingerprint(self):
+        """
+        Returns the fingerprint of the sweep, leaving out the status
+        of the jobs.  The status is saved in /private/meta each time,
+        so a job finishing does not re-pickle the whole sweep.
+        See :meth:`set_job_status`.
+        """
+        jobs = [j for j in self._job_list() if isinstance(j, dict) and 'status' in j]
+        status = [j['status'] for j in jobs]
+        try:
+            for j in jobs:
+                j['status'] = None
+            return fingerprint(self)
+        finally:
+            for j, st in zip(jobs, status):
+                j['status'] = st
+
+    def set_job_status(self, status):
+        """
+        Sets the status of the jobs from the 'job_status' array
+        returned by :func:`puq.hdf.get_meta`.  The pickled sweep
+        may hold an older status.
+        """
+        for j, st in zip(self._job_list(), status):
+            if isinstance(j, dict):
+                j['status'] = 0 if st == '0' else str(st)
+
+    def _save_meta(self, hp):
+        """
+        Writes a small summary of the sweep to /private/meta, so
+        commands like 'puq status' need not unpickle the whole sweep.
+        See :func:`puq.hdf.get_meta`.
+        """
+        jobs = self._job_list()
+        status = [str(j.get('status', 0)) if isinstance(j, dict) else '0' for j in jobs]
+
+        if 'meta' in hp:
+            del hp['meta']
+        meta = hp.create_group('meta')
+        meta.attrs['psweep'] = self.psweep.__class__.__name__
+        meta.attrs['host'] = self.host.__class__.__name__
+        meta.attrs['description'] = str(self.description)
+        # name lists are stored one per line since they may be empty
+        meta.attrs['params'] = '\n'.join([str(p.name) for p in self.psweep.params])
+        outputs = []
+        if 'output/data' in hp.file:
+            outputs = [str(x) for x in hp.file['output/data']]
+        meta.attrs['outputs'] = '\n'.join(outputs)
+        meta.attrs['num_jobs'] = len(status)
+        meta.create_dataset('job_status', data=np.array(status, dtype='S1'))
+
+    def _save_param_array(self, h, hp):
+        """
+        Writes the basic parameter table /input/param_array for
+        non-python reading of the hdf5 file.  The dataset is resizable,
+        so when the previously written rows are unchanged (a
+        sweep was extended) only the new rows are appended.
+        """
+        params = self.psweep.params
+        table = np.column_stack([p.values for p in params])
+        names = [str(p.name) for p in params]
+        nrows, ncols = table.shape
+
+        start = 0
+        if 'param_array' in h:
+            ds = h['param_array']
+            old = ds.shape[0]
+            if ds.maxshape[0] is None and ds.shape[1] == ncols \
+                    and ds.dtype == table.dtype and old <= nrows \
+                    and list(ds.attrs['name']) == names \
+                    and hp.attrs.get('digest_param_array') == fingerprint(table[:old]):
+                start = old
+            else:
+                del h['param_array']
+
+        if not 'param_array' in h:
+            ds = h.create_dataset('param_array', shape=(0, ncols), maxshape=(None, ncols),
+                                  dtype=table.dtype, chunks=(max(1, 16384 // ncols), ncols),
+                                  compression='gzip', compression_opts=9)
+            ds.attrs['name'] = names
+        ds.attrs['description'] = [str(p.description) for p in params]
+
+        if start < nrows:
+            ds.resize(nrows, axis=0)
+            ds[start:] = table[start:]
+        hp.attrs['digest_param_array'] = fingerprint(table)
 
     def _save_and_run(self,dryrun=False):
         self._save_hdf5()
-        res = self.host.run(dryrun)
+        session(self.fname + '.hdf5').checkpoint()
+        with timing.phase('run'):
+            res = self.host.run(dryrun)
         if res:
             self._save_hdf5()
         return res
@@ -168,26 +344,37 @@ class Sweep(object):
 
     def collect_data(self, hf=None):
         """ Collects data from captured stdout files and puts it in arrays
-        in 'output/data'. Returns True on success.
+        in 'output/data'. On success, returns the parameter values and a
+        dictionary of the output datasets, which are not read into
+        memory and are only valid while hf is open.  If hf is None,
+        the sweep's file is opened and closed again, so the outputs
+        are returned as arrays instead.  Returns False if there is
+        no data.
         """
 
-        need_to_close = False
         if hf is None:
-            hf = h5py.File(self.fname + '.hdf5')
-            need_to_close = True
-
-        finished_jobs = self.host.collect(hf)
-        self._extract_hdf5(hf, finished_jobs)
+            with session(self.fname + '.hdf5') as hf:
+                res = self.collect_data(hf)
+                if res:
+                    params, data = res
+                    res = params, dict([(k, v[...]) for k, v in data.iteritems()])
+                return res
+
+        with timing.phase('collect'):
+            finished_jobs = self.host.collect(hf)
+        with timing.phase('extract'):
+            shards = self.host.shard_files()
+            if shards:
+                merge_shards(hf, shards, len(self.host.jobs))
+            else:
+                self._extract_hdf5(hf, finished_jobs)
 
         has_data = 'data' in hf['output']
         if has_data:
             outd = hf['output/data']
-            data = dict([(x, outd[x].value) for x in outd])
+            data = dict([(x, outd[x]) for x in outd])
             params = dict([(p.name, p.values) for p in self.psweep.params])
 
-        if need_to_close:
-            hf.close()
-
         if not has_data and not self._reinit:
             print "WARNING: There is no data in the output section!"
             print "--Check that your runs completed successfully."
@@ -196,10 +383,12 @@ class Sweep(object):
 
     def analyze_errors(self, hf):
         p = re.compile('Command exited with non-zero status \d+')
-        for job in hf['output/jobs']:
-            if job == 'time':
+        for job in get_job_numbers(hf):
+            try:
+                err = get_job_output(hf, job, 'stderr')
+            except KeyError:
+                # merged from a shard without its stdout and stderr
                 continue
-            err = hf['output/jobs/%s/stderr' % job].value
             res = p.findall(err)
             if res:
                 print "Job %s: %s" % (job, res[0])
@@ -210,7 +399,10 @@ class Sweep(object):
                 print "Job %s never completed. Walltime exceeded?" % job
 
             results = False
-            out = hf['output/jobs/%s/stdout' % job].value
+            try:
+                out = get_job_output(hf, job, 'stdout')
+            except KeyError:
+                out = ''
             for line in out.split('\n'):
                 if line.startswith('HDF5:{'):
                     results = True
@@ -228,56 +420,55 @@ class Sweep(object):
         """
         
         debug('')
-        hf = h5py.File(self.fname + '.hdf5')
-        if not self.host.status(quiet=1)[1]:
-            print "Cannot collect data or perform analysis until all jobs are completed."
-            print "You should do 'puq resume' to resume jobs."
-            sys.exit(-1)
-
-        # collect the data if it has not already been collected.
-        has_data = 'output' in hf and 'data' in hf['output']
-        if not has_data:
-            print('No data found. Attempting to collect data')
-            try:
-                if not self.collect_data(hf):
-                    raise Exception()
-                self.psweep.analyze(hf)
-            except:
-                print 'Warning: analysis failed.'
-                errors = 1
-
-        # quick error check
-        if 'data' in hf['output']:
-            errors = 0
-            try:
-                options[self.psweep.__class__.__name__]['verbose'] = verbose
-            except KeyError:
-                options[self.psweep.__class__.__name__] = {'verbose': verbose}
-
-            for var in hf['output/data']:
-                if not isinstance(hf['output/data/%s' % var], h5py.Group):
-                    tlen = len(hf['output/data/%s' % var].value)
-                    num_jobs = len(hf['output/jobs'])-1
-                    if tlen != num_jobs:
-                        errors += 1
-                        print "Expected %s data points for variable %s, but got %s." % (num_jobs, var, tlen)
-                        self.analyze_errors(hf)
-                        return errors
-
-        if not 'psamples' in hf:
-            s = get_psamples(self.psweep.params)
-            if s is not None:
-                hf['psamples'] = s
-
-        # FIXME check for correlation if multiple outputs
-
-        # calibrate
-        if hasattr(self, 'caldata') and self.caldata is not None:
-            self._calibrate(hf)
-
-        hf.close()
-        self._save_hdf5()
-        return errors
+        with session(self.fname + '.hdf5') as hf:
+            if not self.host.status(quiet=1)[1]:
+                print "Cannot collect data or perform analysis until all jobs are completed."
+                print "You should do 'puq resume' to resume jobs."
+                sys.exit(-1)
+
+            # collect the data if it has not already been collected.
+            has_data = 'output' in hf and 'data' in hf['output']
+            if not has_data:
+                print('No data found. Attempting to collect data')
+                try:
+                    if not self.collect_data(hf):
+                        raise Exception()
+                    self.psweep.analyze(hf)
+                except:
+                    print 'Warning: analysis failed.'
+                    errors = 1
+
+            # quick error check
+            if 'data' in hf['output']:
+                errors = 0
+                try:
+                    options[self.psweep.__class__.__name__]['verbose'] = verbose
+                except KeyError:
+                    options[self.psweep.__class__.__name__] = {'verbose': verbose}
+
+                for var in hf['output/data']:
+                    if not isinstance(hf['output/data/%s' % var], h5py.Group):
+                        tlen = hf['output/data/%s' % var].shape[0]
+                        num_jobs = get_num_jobs(hf)
+                        if tlen != num_jobs:
+                            errors += 1
+                            print "Expected %s data points for variable %s, but got %s." % (num_jobs, var, tlen)
+                            self.analyze_errors(hf)
+                            return errors
+
+            if not 'psamples' in hf:
+                s = get_psamples(self.psweep.params)
+                if s is not None:
+                    hf['psamples'] = s
+
+            # FIXME check for correlation if multiple outputs
+
+            # calibrate
+            if hasattr(self, 'caldata') and self.caldata is not None:
+                self._calibrate(hf)
+
+            self._save_hdf5()
+            return errors
 
     # Bayesian Calibration
     def _calibrate(self, hf):
@@ -285,7 +476,7 @@ class Sweep(object):
         rs = unpickle(hf["/smolyak/%s/response" % ovar].value)
         self.psweep.params = calibrate(self.psweep.params, self.caldata, self.err, rs.eval)
 
-    def _dump_hdf5_cache(self, hf, d):
+    def _dump_hdf5_cache(self, hf, d, start=0):
         global _vcache, _dcache
         if len(_vcache):
             if d:
@@ -293,86 +484,69 @@ class Sweep(object):
             else:
                 dgrp = hf.require_group('output/jobs')
             for n in _vcache:
-                if n in dgrp:
-                    del dgrp[n]
                 adata = _vcache[n]
                 if d and len(adata.shape) > 1:
                     # Data is a multidimensional array and we want to do analysis
                     # on each array element individually.  So we write them
                     # individually to /output/data
-                    numvals = np.prod(adata.shape[1:])
-                    for i, index in enumerate(np.ndindex(adata.shape[1:])):
-                        name = '%s%s' % (n, [ind for ind in index])
-                        data = adata.flatten()[i::numvals]
-                        ds = dgrp.create_dataset(name, data=data)
+                    for name, data in split_elements(n, adata):
+                        ds = _append_rows(dgrp, name, data, start)
                         ds.attrs["description"] = _dcache[n]
                 else:
-                    ds = dgrp.create_dataset(n, data=adata)
+                    ds = _append_rows(dgrp, n, adata, start)
                     ds.attrs["description"] = str(_dcache[n])
             _vcache = {}
             _dcache = {}
 
-    def _dump_hdf5(self, grp, line, job, mjob):
+    def _dump_hdf5(self, line, job, mjob, start=0):
         debug("Dump %s : %s" % (job, line))
         #print "Dump %s : %s" % (job, line)
         global _vcache, _dcache
 
-        # old format used single quotes.
-        if line.startswith("{'"):
-            #sometimes nans can still slip through. if so set it to null 
-            #which gets converted to None when loading the json
-            if "'value': nan" in line:
-                line=line.replace("'value': nan","'value': null")                
-                print('warning: output value for job {} was nan'.format(job))
-            
-            line = line.replace("'", '"')
-
-        
-        x = unpickle(line)
+        x = decode_hdf5_tag(line, job)
         v = x['value']
         n = x['name']
 
         if not n in _vcache:
             if isinstance(v, ndarray):
-                _vcache[n] = np.empty([mjob] + list(v.shape))
+                _vcache[n] = np.empty([mjob - start] + list(v.shape))
             else:
-                _vcache[n] = np.empty((mjob))
+                _vcache[n] = np.empty((mjob - start))
             _vcache[n].fill(np.nan)
             _dcache[n] = x['desc']
 
-        _vcache[n][job] = v
+        _vcache[n][job - start] = v
 
     # Extract tagged data to hdf5
     def _extract_hdf5(self, hf, jobs):
         debug("Extract")
         mjob = np.max(jobs) + 1
-        run_grp = hf.require_group('output/jobs')
+
+        # Rows below the watermark were collected by a previous call
+        # (before an extend()), so only the new jobs need to be parsed
+        # and appended.
+        start = min(_collected_jobs(hf), mjob)
         for ext in ['out', 'err']:
             for j in jobs:
-                grp = run_grp.require_group(str(j))
-                if not 'std%s' % ext in grp:
+                if j < start:
+                    continue
+                try:
+                    f = get_job_output(hf, j, 'std%s' % ext)
+                except KeyError:
                     continue
-                f = grp['std%s' % ext].value
-                cont = False
-                for line in f.splitlines():
-                    if cont:
-                        line = line.strip()
-                        cline += line
-                        if line.endswith(':5FDH'):
-                            cont = False
-                            cline = cline[:-5]
-                            self._dump_hdf5(grp, cline, j, mjob)
-                    elif line.startswith('HDF5:'):
-                        line = line[5:].strip()
-                        if line.endswith(':5FDH'):
-                            line = line[:-5]
-                            self._dump_hdf5(grp, line, j, mjob)
-                        else:
-                            cont = True
-                            cline = line
-                    elif ext == 'err':
+                def other(line):
+                    if ext == 'err' and line.strip():
                         print 'STDERR[job %d]: %s' % (j, line)
-            self._dump_hdf5_cache(hf, ext == 'out')
+                for line in parse_hdf5_tags(f, other):
+                    self._dump_hdf5(line, j, mjob, start)
+            self._dump_hdf5_cache(hf, ext == 'out', start)
+
+        # everything up to the first job that has not finished is complete
+        done = set(jobs)
+        collected = start
+        while collected in done:
+            collected += 1
+        hf.require_group('output').attrs['collected'] = collected
 
     def resume(self):
         if hasattr(self.host, 'jobs'):
@@ -29,7 +29,9 @@ class TestProgram(object):
         list of files that should be copied to each new directory.
       outfiles(list): An optional list of files that will be saved
         into the HDF5 file upon completion. The files will be in
-        /output/jobs/n where 'n' is the job number.
+        /output/jobs/n where 'n' is the job number, or in
+        /output/jobs/packed if options['hdf5']['joblayout'] is 'packed'.
+        Use :func:`puq.hdf.get_job_output` to read them.
       paramsByFile(boolean): If True, passes parameters to the TestProgram
         via a file rather than on the command line. The file name is 
         specified via - -paramsFile=xxx in the exe string.
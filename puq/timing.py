@@ -0,0 +1,134 @@
+"""
+Timers for the phases of a sweep.
+
+Each iteration of a sweep records how long was spent in each phase,
+for example setting up jobs, running them, collecting their output,
+saving the sweep and analyzing the results.  The timings are written
+to /profile/<iteration> in the sweep's HDF5 file and are shown by
+'puq profile'.
+
+If options['profile']['cprofile'] is True, the iteration also runs
+under cProfile and the statistics are saved with the timings.
+
+This file is part of PUQ
+Copyright (c) 2013 PUQ Authors
+See LICENSE file for terms.
+"""
+
+import time
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from puq.options import options
+
+# phase name -> [seconds, calls], for the current iteration
+_phases = OrderedDict()
+_start = None
+_profiler = None
+
+def start():
+    """start()
+
+    Starts timing a new iteration.  Clears the previous timings and,
+    if enabled, starts cProfile.
+    """
+    global _start, _profiler
+    _phases.clear()
+    _start = time.time()
+    if options['profile']['cprofile']:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+@contextmanager
+def phase(name):
+    """phase(name)
+
+    Context manager that adds the time spent in its block to the
+    phase *name*.
+
+    Example::
+
+      with phase('collect'):
+          host.collect(hf)
+    """
+    if not options['profile']['enabled']:
+        yield
+        return
+    t = time.time()
+    try:
+        yield
+    finally:
+        p = _phases.get(name)
+        if p is None:
+            p = _phases[name] = [0.0, 0]
+        p[0] += time.time() - t
+        p[1] += 1
+
+def timings():
+    """timings()
+
+    Returns a list of (phase, seconds, calls) for the current
+    iteration, in the order the phases first ran.
+    """
+    return [(n, s, c) for n, (s, c) in _phases.iteritems()]
+
+def save(hf):
+    """save(hf)
+
+    Writes the timings of the current iteration to a new group
+    /profile/<n>, where n counts iterations from 0.  Stops cProfile
+    and saves its statistics in /profile/<n>/cprofile.
+
+    Args:
+      hf: An open HDF5 filehandle.
+    """
+    global _start, _profiler
+    if not options['profile']['enabled'] or _start is None:
+        return
+    stats = None
+    if _profiler is not None:
+        import pstats, StringIO
+        _profiler.disable()
+        out = StringIO.StringIO()
+        pstats.Stats(_profiler, stream=out).sort_stats('cumulative').print_stats(50)
+        stats = out.getvalue()
+        _profiler = None
+
+    prof = hf.require_group('profile')
+    grp = prof.create_group(str(len(prof)))
+    grp.attrs['date'] = time.strftime("%b %d %H:%M %Z %Y", time.localtime(_start))
+    grp.attrs['total'] = time.time() - _start
+    t = timings()
+    grp['names'] = np.array([n for n, s, c in t], dtype='S')
+    grp['seconds'] = np.array([s for n, s, c in t], dtype=np.float64)
+    grp['calls'] = np.array([c for n, s, c in t], dtype=np.int64)
+    if stats is not None:
+        grp['cprofile'] = stats
+    _start = None
+
+def load(hf):
+    """load(hf)
+
+    Reads the timings saved in an HDF5 file.
+
+    Returns:
+      A list with a dictionary for each iteration, with keys
+      'date', 'total', 'phases' (a list of (phase, seconds, calls)),
+      and 'cprofile' (the cProfile statistics, or None).
+    """
+    out = []
+    if not 'profile' in hf:
+        return out
+    prof = hf['profile']
+    for name in sorted(prof, key=int):
+        grp = prof[name]
+        phases = zip([str(n) for n in grp['names'][...]], grp['seconds'][...], grp['calls'][...])
+        cprof = None
+        if 'cprofile' in grp:
+            cprof = grp['cprofile'][()]
+        out.append({'date': grp.attrs['date'],
+                    'total': grp.attrs['total'],
+                    'phases': phases,
+                    'cprofile': cprof})
+    return out
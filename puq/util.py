@@ -8,10 +8,12 @@ See LICENSE file for terms.
 
 #import sys, termios, tty, os, h5py #FR
 import sys, os, h5py,traceback #FR
+import hashlib, types, cPickle
 import numpy as np
 from logging import info, debug, exception, warning, critical
 from puq.options import options
-from puq.hdf import get_result
+from puq.jpickle import unpickle
+from puq.hdf import get_result, get_result_view, iter_chunks, get_rewrites, get_job_numbers, get_job_output, replace_job_output
 
 def vprint(level, str):
     if options['verbose'] >= level:
@@ -72,6 +74,81 @@ class Callback:
 class TimedOutExec(Exception):
         pass
 
+def fingerprint(obj):
+    """
+    fingerprint(obj)
+
+    Returns an md5 hex digest of an object's contents. Used to detect
+    whether something has changed since it was last written to
+    the HDF5 file.
+
+    Numpy arrays are hashed from their raw buffer, so large
+    parameter sample arrays are cheap to fingerprint. Objects are
+    hashed by class name and their attribute dictionary. Other
+    objects (with __slots__ or implemented in C) are hashed from
+    their pickled state. Cycles are followed only once.
+
+    Args:
+      obj: Any object.
+    Returns:
+      String with the hex digest.
+    """
+    md5 = hashlib.md5()
+    seen = {}
+
+    def _walk(o):
+        if isinstance(o, np.ndarray):
+            md5.update('A%s%s' % (o.dtype.str, o.shape))
+            if o.dtype.hasobject:
+                for x in o.flat:
+                    _walk(x)
+            else:
+                md5.update(np.ascontiguousarray(o).data)
+            return
+        if o is None or isinstance(o, (bool, int, long, float, complex, str, unicode, np.generic)):
+            md5.update('S%r' % (o,))
+            return
+        if id(o) in seen:
+            md5.update('R%d' % seen[id(o)][0])
+            return
+        # keep a reference so ids are not reused while walking
+        seen[id(o)] = (len(seen), o)
+        if isinstance(o, dict):
+            md5.update('D%d' % len(o))
+            for k in sorted(o.keys(), key=repr):
+                _walk(k)
+                _walk(o[k])
+        elif isinstance(o, (list, tuple)):
+            md5.update('L%s%d' % (type(o).__name__, len(o)))
+            for x in o:
+                _walk(x)
+        elif isinstance(o, (set, frozenset)):
+            md5.update('T%d' % len(o))
+            for x in sorted(o, key=repr):
+                _walk(x)
+        elif isinstance(o, types.MethodType):
+            _walk(o.im_func)
+            _walk(o.im_self)
+        elif isinstance(o, types.FunctionType):
+            md5.update('F%s.%s' % (o.__module__, o.__name__))
+            _walk(o.func_code)
+        elif isinstance(o, types.CodeType):
+            md5.update('K%s' % o.co_code)
+            _walk(o.co_consts)
+        elif isinstance(o, (type, types.ClassType, types.BuiltinFunctionType)):
+            md5.update('C%s.%s' % (getattr(o, '__module__', ''), o.__name__))
+        elif hasattr(o, '__dict__'):
+            md5.update('O%s.%s' % (o.__class__.__module__, o.__class__.__name__))
+            _walk(o.__dict__)
+        else:
+            try:
+                md5.update('P' + cPickle.dumps(o, 2))
+            except Exception:
+                md5.update('X%r' % (o,))
+
+    _walk(obj)
+    return md5.hexdigest()
+
 def getachar(prompt, echo=True):
     fd = sys.stdin.fileno()
     old_mode = termios.tcgetattr(fd)
@@ -88,7 +165,22 @@ def getachar(prompt, echo=True):
         print ch
     return ch
 
-def process_data(hf, grpname, callback):
+def process_data(hf, grpname, callback, lazy=False):
+    """
+    process_data(hf, grpname, callback, lazy=False)
+
+    Calls callback(group, data) for each output variable and
+    writes the (name, value) tuples it returns to group
+    /grpname/var.
+
+    Args:
+      hf: An open HDF5 filehandle.
+      grpname: Name of the group for the results.
+      callback: Function to call.
+      lazy: If True, data is the h5py dataset instead of an
+        array (see :func:`puq.hdf.get_result_view`), so the
+        callback can read it in blocks.
+    """
     debug(grpname)
     grp = hf.require_group(grpname)
     try:
@@ -108,7 +200,10 @@ def process_data(hf, grpname, callback):
             vgrp.attrs['description'] = str(vdesc)
 
             vprint(1, "\nProcessing %s" % d)
-            d = get_result(hf, var)
+            if lazy:
+                d = get_result_view(hf, var)
+            else:
+                d = get_result(hf, var)
             vlist = callback(vgrp, d)
             for v in vlist:
                 try:
@@ -119,14 +214,164 @@ def process_data(hf, grpname, callback):
         print("error processing data (maybe some runs failed? See stack trace.): " + str(e))
         traceback.print_exc()
 
+def update_moments(state, data, weights=None):
+    """
+    update_moments(state, data, weights=None)
+
+    Folds a block of new samples into running (optionally weighted)
+    moments using the pairwise update of Chan et al., so the
+    samples already seen do not need to be revisited.
+
+    Args:
+      state: Tuple (wsum, mean, m2) returned from a previous call,
+        or None to start from nothing.
+      data: Array of new samples.
+      weights: Optional array of weights for the new samples.
+    Returns:
+      Tuple (wsum, mean, m2). The deviation is sqrt(m2 / wsum).
+    """
+    data = np.asarray(data, dtype=float)
+    if weights is None:
+        weights = np.ones_like(data)
+    wb = np.sum(weights)
+    if wb == 0:
+        return state
+    mb = np.dot(weights, data) / wb
+    m2b = np.dot(weights, (data - mb)**2)
+    if state is None:
+        return (wb, mb, m2b)
+    wa, ma, m2a = state
+    w = wa + wb
+    delta = mb - ma
+    return (w, ma + delta * wb / w, m2a + m2b + delta**2 * wa * wb / w)
+
+def running_moments(cache, key, data, weights=None):
+    """
+    running_moments(cache, key, data, weights=None)
+
+    Returns the (weighted) mean and deviation of data. The moments
+    are kept in the dictionary cache under key, and when data only
+    had new rows appended since the last call, just the new rows
+    are folded in.  The rows seen before are not read again: the
+    moments are only reused while the counter of rewrites of data
+    (see :func:`puq.hdf.get_rewrites`) is unchanged, so arrays are
+    always read in full.  Data is read in blocks (see
+    :func:`puq.hdf.iter_chunks`), so it can be an h5py dataset
+    too large to fit in memory.
+
+    Args:
+      cache: Dictionary holding the running moments, or None.
+      key: Key for this variable.
+      data: Array or h5py Dataset of samples.
+      weights: Optional array of weights, one per sample.
+    Returns:
+      Tuple (mean, dev).
+    """
+    n = 0
+    nd = len(data)
+    state = None
+    rewrites = get_rewrites(data)
+    if cache is not None and rewrites is not None:
+        cached = cache.get(key)
+        if cached is not None and cached[0] <= nd and cached[1] == rewrites:
+            n, state = cached[0], cached[2:]
+    if n < nd:
+        for row, block in iter_chunks(data, start=n):
+            w = None if weights is None else weights[row:row + len(block)]
+            state = update_moments(state, block, w)
+        if state is not None and cache is not None and rewrites is not None:
+            cache[key] = (nd, rewrites) + tuple(float(x) for x in state)
+    if state is None:
+        return np.nan, np.nan
+    wsum, mean, m2 = state
+    return mean, np.sqrt(m2 / wsum)
+
+def parse_hdf5_tags(text, other=None):
+    """
+    parse_hdf5_tags(text, other=None)
+
+    Finds the tagged output written by a TestProgram. A tag is
+    'HDF5:' followed by JSON and ':5FDH'. Tags may be split
+    across several lines.
+
+    Args:
+      text: Job output.
+      other: Optional function called with each line which
+        is not part of a tag.
+    Returns:
+      A list of the JSON strings of the tags, in order.
+    """
+    tags = []
+    cont = False
+    for line in text.splitlines():
+        if cont:
+            line = line.strip()
+            cline += line
+            if line.endswith(':5FDH'):
+                cont = False
+                tags.append(cline[:-5])
+        elif line.startswith('HDF5:'):
+            line = line[5:].strip()
+            if line.endswith(':5FDH'):
+                tags.append(line[:-5])
+            else:
+                cont = True
+                cline = line
+        elif other is not None:
+            other(line)
+    return tags
+
+def decode_hdf5_tag(line, job=None):
+    """
+    decode_hdf5_tag(line, job=None)
+
+    Decodes a tag found by :func:`parse_hdf5_tags`.
+
+    Args:
+      line: JSON string of the tag.
+      job: Job number, for warnings.
+    Returns:
+      Dictionary with 'name', 'value' and 'desc'.
+    """
+    # old format used single quotes.
+    if line.startswith("{'"):
+        #sometimes nans can still slip through. if so set it to null 
+        #which gets converted to None when loading the json
+        if "'value': nan" in line:
+            line=line.replace("'value': nan","'value': null")                
+            print('warning: output value for job {} was nan'.format(job))
+        line = line.replace("'", '"')
+    return unpickle(line)
+
+def split_elements(name, adata):
+    """
+    split_elements(name, adata)
+
+    Splits the values of a multidimensional output, one row per job,
+    into one array per element, named like 'name[i, j]', so each
+    element can be analyzed individually.  One-dimensional data is
+    returned unchanged.
+
+    Args:
+      name: Output name.
+      adata: Array with one row per job.
+    Returns:
+      List of (name, array) tuples.
+    """
+    if len(adata.shape) < 2:
+        return [(name, adata)]
+    numvals = np.prod(adata.shape[1:])
+    flat = adata.flatten()
+    return [('%s%s' % (name, [ind for ind in index]), flat[i::numvals])
+            for i, index in enumerate(np.ndindex(adata.shape[1:]))]
+
 def strip(fname):
     tmpname = fname + '_strip'
     os.rename(fname, tmpname)
     with h5py.File(tmpname, 'r+') as h5:
-        for job in h5['output/jobs']:
-            if job == 'time':
-                continue
-            txt = h5['output/jobs/%s/stdout' % job].value
+        stripped = []
+        for job in get_job_numbers(h5):
+            txt = get_job_output(h5, job, 'stdout')
             cont = False
             sout = []
             for line in txt.splitlines():
@@ -138,8 +383,8 @@ def strip(fname):
                     sout.append(line)
                     if not line.endswith(':5FDH'):
                         cont = True
-            del h5['output/jobs/%s/stdout' % job]
-            h5['output/jobs/%s/stdout' % job] = '\n'.join(sout)
+            stripped.append((job, '\n'.join(sout)))
+        replace_job_output(h5, 'stdout', stripped)
         h5.close()
     ret = os.system('h5repack %s %s' % (tmpname, fname))
     if os.WEXITSTATUS(ret) == 0:
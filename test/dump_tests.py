@@ -0,0 +1,87 @@
+import os, h5py, tempfile, shutil, csv
+import numpy as np
+import puq.dump
+import puq.hdf
+
+dname = os.path.dirname(os.path.realpath(__file__))
+fname = os.path.join(dname, 'test1.hdf5')
+
+def _expected(hf):
+    # returns the column names and the values they should have
+    names = [str(n) for n in hf['/input/param_array'].attrs['name']]
+    data = hf['/input/param_array'][...]
+    return names + ['energy', 'kinetic_energy'], \
+        np.column_stack((data, puq.hdf.get_result(hf, 'energy'),
+                         puq.hdf.get_result(hf, 'kinetic_energy')))
+
+def test_dump_csv():
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(fname, 'r')
+        out = puq.dump.dump(hf, os.path.join(tdir, 'test1.hdf5'), chunksize=4)
+        rows = list(csv.reader(open(out, 'rb')))
+        names, expected = _expected(hf)
+        assert rows[0] == names
+        assert np.allclose(np.array(rows[2:], dtype=float), expected)
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+
+def test_dump_binary():
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(fname, 'r')
+        names, expected = _expected(hf)
+        out = puq.dump.dump(hf, os.path.join(tdir, 'test1'), format='npy',
+                            vars=['v', 'energy'], rows=(2, 7), chunksize=3)
+        a = np.load(out)
+        assert a.dtype.names == ('v', 'energy')
+        assert np.allclose(a['energy'], expected[2:7, names.index('energy')])
+        assert np.allclose(a['v'], expected[2:7, names.index('v')])
+
+        out = puq.dump.dump(hf, os.path.join(tdir, 'test1'), format='npz', chunksize=3)
+        z = np.load(out)
+        assert np.allclose(z['kinetic_energy'], expected[:, names.index('kinetic_energy')])
+        assert np.allclose(z['m'], expected[:, names.index('m')])
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+
+def test_dump_flatten():
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(os.path.join(tdir, 'nd.hdf5'), 'w')
+        hf['/input/param_array'] = np.arange(5.0).reshape(5, 1)
+        hf['/input/param_array'].attrs['name'] = ['x']
+        field = np.arange(30.0).reshape(5, 2, 3)
+        hf['/output/data/field'] = field
+
+        # multidimensional outputs need flattening for csv
+        assert puq.dump.dump(hf, os.path.join(tdir, 'nd'), chunksize=2) is None
+
+        out = puq.dump.dump(hf, os.path.join(tdir, 'nd'), flatten=True, chunksize=2)
+        rows = list(csv.reader(open(out, 'rb')))
+        names = ['field[%s, %s]' % (i, j) for i in range(2) for j in range(3)]
+        assert rows[0] == ['x'] + names
+        values = np.array(rows[2:], dtype=float)
+        assert np.all(values[:, 0] == np.arange(5))
+        assert np.all(values[:, 1:] == field.reshape(5, 6))
+
+        out = puq.dump.dump(hf, os.path.join(tdir, 'nd'), format='npy', flatten=True, chunksize=2)
+        a = np.load(out)
+        assert a.dtype.names == tuple(['x'] + names)
+        assert np.all(a['field[1, 2]'] == field[:, 1, 2])
+
+        out = puq.dump.dump(hf, os.path.join(tdir, 'nd'), format='npz', flatten=True, chunksize=2)
+        z = np.load(out)
+        assert np.all(z['field[0, 1]'] == field[:, 0, 1])
+        out = puq.dump.dump(hf, os.path.join(tdir, 'nd'), format='npz', chunksize=2)
+        assert np.all(np.load(out)['field'] == field)
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == "__main__":
+    test_dump_csv()
+    test_dump_binary()
+    test_dump_flatten()
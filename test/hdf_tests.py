@@ -1,6 +1,7 @@
 import puq.hdf
-import os, h5py
+import os, h5py, tempfile, shutil
 import numpy as np
+from puq.options import options
 
 dname = os.path.dirname(os.path.realpath(__file__))
 fname = os.path.join(dname, 'test1.hdf5')
@@ -27,7 +28,229 @@ def test3():
     assert puq.hdf.data_description(hf, 'energy') == 'A random energy equation.', 'data_description'
     assert puq.hdf.param_description(hf, 'm') == 'mass', 'param_description'
 
+def test_job_output_group():
+    jobs = puq.hdf.get_job_numbers(hf)
+    assert puq.hdf.get_job_layout(hf) == 'group'
+    assert len(jobs) == len(puq.hdf.get_result(hf, 'energy'))
+    assert puq.hdf.get_num_jobs(hf) == len(jobs)
+    out = puq.hdf.get_job_output(hf, jobs[0], 'stdout')
+    assert out == hf['/output/jobs/%s/stdout' % jobs[0]].value
+
+def test_job_output_packed():
+    tdir = tempfile.mkdtemp()
+    saved = options['hdf5']['joblayout']
+    options['hdf5']['joblayout'] = 'packed'
+    try:
+        h5 = h5py.File(os.path.join(tdir, 'packed.hdf5'), 'w')
+        for j in range(5):
+            puq.hdf.set_job_output(h5, j, 'stdout', 'out %d\n' % j)
+            puq.hdf.set_job_output(h5, j, 'stderr', '')
+        assert puq.hdf.get_job_layout(h5) == 'packed'
+        assert puq.hdf.get_job_numbers(h5) == range(5)
+        assert puq.hdf.get_job_output(h5, 3, 'stdout') == 'out 3\n'
+        assert puq.hdf.get_job_output(h5, 3, 'stderr') == ''
+        assert not [x for x in h5['/output/jobs'] if x.isdigit()]
+
+        puq.hdf.replace_job_output(h5, 'stdout', [(j, 'x%d' % j) for j in range(5)])
+        assert puq.hdf.get_job_output(h5, 4, 'stdout') == 'x4'
+
+        got_except = False
+        try:
+            puq.hdf.get_job_output(h5, 9, 'stdout')
+        except KeyError:
+            got_except = True
+        assert got_except, 'get_job_output (missing job)'
+        h5.close()
+    finally:
+        options['hdf5']['joblayout'] = saved
+        shutil.rmtree(tdir)
+
+def test_packed_index_cache():
+    tdir = tempfile.mkdtemp()
+    saved = options['hdf5']['joblayout']
+    options['hdf5']['joblayout'] = 'packed'
+    try:
+        h5 = h5py.File(os.path.join(tdir, 'packed.hdf5'), 'w')
+        for j in range(3):
+            puq.hdf.set_job_output(h5, j, 'stdout', 'out %d' % j)
+            puq.hdf.set_job_output(h5, j, 'stderr', 'err %d' % j)
+        pgrp = h5['/output/jobs/packed']
+        out = puq.hdf._packed_index(pgrp, 'stdout')
+        err = puq.hdf._packed_index(pgrp, 'stderr')
+        # reading the streams alternately reuses both indexes
+        for j in range(3):
+            assert puq.hdf.get_job_output(h5, j, 'stderr') == 'err %d' % j
+            assert puq.hdf.get_job_output(h5, j, 'stdout') == 'out %d' % j
+        assert puq.hdf._packed_index(pgrp, 'stdout') is out
+        assert puq.hdf._packed_index(pgrp, 'stderr') is err
+
+        # appending invalidates only that stream
+        puq.hdf.set_job_output(h5, 1, 'stdout', 'new')
+        assert puq.hdf.get_job_output(h5, 1, 'stdout') == 'new'
+        assert puq.hdf._packed_index(pgrp, 'stderr') is err
+        h5.close()
+    finally:
+        options['hdf5']['joblayout'] = saved
+        shutil.rmtree(tdir)
+
+def test_pack_job_output():
+    tdir = tempfile.mkdtemp()
+    try:
+        tname = os.path.join(tdir, 'test1.hdf5')
+        shutil.copy(fname, tname)
+        h5 = h5py.File(tname, 'r+')
+        jobs = puq.hdf.get_job_numbers(h5)
+        before = [puq.hdf.get_job_output(h5, j, 'stderr') for j in jobs]
+        puq.hdf.pack_job_output(h5)
+        assert puq.hdf.get_job_layout(h5) == 'packed'
+        assert puq.hdf.get_job_numbers(h5) == jobs
+        assert [puq.hdf.get_job_output(h5, j, 'stderr') for j in jobs] == before
+        h5.close()
+    finally:
+        shutil.rmtree(tdir)
+
+def test_append_rows():
+    from puq.sweep import _append_rows
+    tdir = tempfile.mkdtemp()
+    try:
+        h5 = h5py.File(os.path.join(tdir, 'rows.hdf5'), 'w')
+        grp = h5.require_group('output/data')
+        # old files have fixed size datasets
+        grp['x'] = np.arange(4.0)
+        ds = _append_rows(grp, 'x', np.array([7.0, 8.0]), 4)
+        assert ds.maxshape == (None,)
+        assert np.all(ds.value == [0, 1, 2, 3, 7, 8])
+        rewrites = puq.hdf.get_rewrites(ds)
+        assert rewrites > 0
+        ds = _append_rows(grp, 'x', np.array([9.0]), 6)
+        assert np.all(ds.value == [0, 1, 2, 3, 7, 8, 9])
+        # appending is not a rewrite, but writing earlier rows is
+        assert puq.hdf.get_rewrites(ds) == rewrites
+        ds = _append_rows(grp, 'x', np.array([5.0]), 6)
+        assert np.all(ds.value == [0, 1, 2, 3, 7, 8, 5])
+        assert puq.hdf.get_rewrites(ds) > rewrites
+        # a new variable gets NaN for the rows before it appeared
+        ds = _append_rows(grp, 'y', np.array([1.0]), 2)
+        assert np.all(np.isnan(ds.value[:2])) and ds.value[2] == 1.0
+        h5.close()
+    finally:
+        shutil.rmtree(tdir)
+
+def test_session():
+    tdir = tempfile.mkdtemp()
+    try:
+        tname = os.path.join(tdir, 'session.hdf5')
+        sess = puq.hdf.session(tname)
+        assert puq.hdf.session(tname) is sess
+        with sess as hf:
+            hf['/output/data/x'] = np.arange(3.0)
+            hf['/output/data/x'].attrs['description'] = 'x'
+            # inner blocks share the handle
+            with puq.hdf.session(tname) as hf2:
+                assert hf2 == hf
+            assert sess.is_open()
+            # helpers given the filename use the open handle
+            assert puq.hdf.get_output_names(tname) == ['x']
+            sess.checkpoint()
+            hf = sess.file
+            hf['/output/data/y'] = np.arange(3.0)
+            hf['/output/data/y'].attrs['description'] = 'y'
+        assert not sess.is_open()
+        assert puq.hdf.get_output_names(tname) == ['x', 'y']
+    finally:
+        shutil.rmtree(tdir)
+
+def test_result_view():
+    ds = puq.hdf.get_result_view(hf, 'energy')
+    assert isinstance(ds, h5py.Dataset)
+    assert np.all(ds[...] == puq.hdf.get_result(hf, 'energy'))
+    blocks = list(puq.hdf.iter_chunks(ds, chunksize=3))
+    assert [row for row, block in blocks] == range(0, len(ds), 3)
+    assert np.all(np.concatenate([block for row, block in blocks]) == ds[...])
+
+def test_meta():
+    from puq.sweep import Sweep
+    from puq.montecarlo import MonteCarlo
+    from puq.hosts import Host
+    from puq.parameter import UniformParameter
+    tdir = tempfile.mkdtemp()
+    try:
+        sw = Sweep.__new__(Sweep)
+        sw.description = 'meta test'
+        sw.psweep = MonteCarlo([UniformParameter('x', 'x', min=0, max=1)], 3, response=False)
+        sw.host = Host()
+        sw.host.jobs = [{'status': 'F'}, {'status': 'X'}, {'status': 0}]
+        h5 = h5py.File(os.path.join(tdir, 'meta.hdf5'), 'w')
+        sw._save_meta(h5.require_group('private'))
+        meta = puq.hdf.get_meta(h5)
+        assert meta['psweep'] == 'MonteCarlo' and meta['host'] == 'Host'
+        assert meta['params'] == ['x'] and meta['outputs'] == []
+        assert meta['num_jobs'] == 3
+        assert list(meta['job_status']) == ['F', 'X', '0']
+        assert puq.hdf.get_meta(hf) is None
+        h5.close()
+    finally:
+        shutil.rmtree(tdir)
+
+def test_save_unchanged():
+    import puq.sweep
+    from puq.sweep import Sweep
+    from puq.montecarlo import MonteCarlo
+    from puq.hosts import Host
+    from puq.parameter import UniformParameter
+    tdir = tempfile.mkdtemp()
+    pickled = []
+    saved = puq.sweep.pickle
+    def counting_pickle(obj, *args, **kargs):
+        pickled.append(obj.__class__.__name__)
+        return saved(obj, *args, **kargs)
+    puq.sweep.pickle = counting_pickle
+    try:
+        sw = Sweep.__new__(Sweep)
+        sw.description = 'save test'
+        sw.fname = os.path.join(tdir, 'save')
+        sw.psweep = MonteCarlo([UniformParameter('x', 'x', min=0, max=1)], 3, response=False)
+        sw.host = Host()
+        sw.host.jobs = [{'status': 0}, {'status': 0}, {'status': 0}]
+        sw._save_hdf5()
+        assert pickled == ['Sweep', 'UniformParameter']
+
+        # nothing changed
+        sw._save_hdf5()
+        assert len(pickled) == 2
+
+        # only the status changed. It is read back from /private/meta.
+        sw.host.jobs[1]['status'] = 'F'
+        sw._save_hdf5()
+        assert len(pickled) == 2
+        h5 = h5py.File(sw.fname + '.hdf5', 'r')
+        sw2 = puq.sweep.unpickle(h5['private/sweep'].value)
+        sw2.set_job_status(puq.hdf.get_meta(h5)['job_status'])
+        h5.close()
+        assert [j['status'] for j in sw2.host.jobs] == [0, 'F', 0]
+        assert sw.host.jobs[1]['status'] == 'F'
+
+        # a real change rewrites the sweep but not the parameter
+        sw.description = 'changed'
+        sw._save_hdf5()
+        assert pickled == ['Sweep', 'UniformParameter', 'Sweep']
+        h5 = h5py.File(sw.fname + '.hdf5', 'r')
+        assert puq.sweep.unpickle(h5['private/sweep'].value).description == 'changed'
+        h5.close()
+    finally:
+        puq.sweep.pickle = saved
+        shutil.rmtree(tdir)
+
 if __name__ == "__main__":
     test1()
     test2()
     test3()
+    test_job_output_group()
+    test_job_output_packed()
+    test_packed_index_cache()
+    test_pack_job_output()
+    test_append_rows()
+    test_session()
+    test_result_view()
+    test_meta()
+    test_save_unchanged()
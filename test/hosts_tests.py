@@ -0,0 +1,94 @@
+import os, sys, tempfile, shutil
+from subprocess import Popen
+from puq.hosts import _wait_job, _usage_tags, _usage_text
+from puq.util import parse_hdf5_tags, decode_hdf5_tag
+
+def test_wait_job():
+    if not hasattr(os, 'wait4'):
+        return
+    # burn some CPU in a child of the shell
+    p = Popen('%s -c "sum(range(2000000))"; exit 3' % sys.executable, shell=True)
+    usage = _wait_job(p)
+    assert p.returncode == 3
+    assert p.poll() == 3
+    assert usage['utime'] > 0
+    assert usage['maxrss'] > 1024 * 1024
+    for k in ['stime', 'inblock', 'oublock']:
+        assert usage[k] >= 0
+
+def test_usage_tags():
+    text = 'some output\n' + _usage_tags({'time': 1.5, 'maxrss': 2048, 'utime': 0.25})
+    tags = [decode_hdf5_tag(t) for t in parse_hdf5_tags(text)]
+    assert [t['name'] for t in tags] == ['time', 'utime', 'maxrss']
+    assert [t['value'] for t in tags] == [1.5, 0.25, 2048.0]
+    assert tags[0]['desc'] == 'wall time (s)'
+
+def test_usage_text():
+    tdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(tdir, 'job.err')
+        tags = _usage_tags({'time': 1.0})
+        # missing or empty file, or one ending in a newline
+        assert _usage_text(name, {'time': 1.0}) == tags
+        open(name, 'w').close()
+        assert _usage_text(name, {'time': 1.0}) == tags
+        open(name, 'w').write('warning\n')
+        assert _usage_text(name, {'time': 1.0}) == tags
+        # the tags must start on their own line
+        open(name, 'w').write('warning')
+        assert _usage_text(name, {'time': 1.0}) == '\n' + tags
+    finally:
+        shutil.rmtree(tdir)
+
+def test_clean_job_stderr():
+    import h5py, StringIO
+    from puq.sweep import Sweep
+    from puq.hdf import set_job_output
+    tdir = tempfile.mkdtemp()
+    saved = sys.stdout
+    try:
+        hf = h5py.File(os.path.join(tdir, 'sw.hdf5'), 'w')
+        for j, err in enumerate(['', 'warning']):
+            name = os.path.join(tdir, 'sw_%s.err' % j)
+            open(name, 'w').write(err)
+            open(name, 'a').write(_usage_text(name, {'time': 1.0, 'utime': .5}))
+            set_job_output(hf, j, 'stderr', open(name).read())
+            set_job_output(hf, j, 'stdout', "HDF5:{'name': 'x', 'value': %s, 'desc': ''}:5FDH\n" % j)
+        sys.stdout = out = StringIO.StringIO()
+        Sweep.__new__(Sweep)._extract_hdf5(hf, [0, 1])
+        sys.stdout = saved
+        # only the real stderr of job 1 is shown
+        assert out.getvalue() == 'STDERR[job 1]: warning\n'
+        assert list(hf['output/jobs/time'][...]) == [1.0, 1.0]
+        hf.close()
+    finally:
+        sys.stdout = saved
+        shutil.rmtree(tdir)
+
+def test_pbs_shard_collect():
+    from puq.pbshost import PBSHost
+    tdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tdir)
+        open('env.sh', 'w').close()
+        for logs in [True, False]:
+            h = PBSHost('env.sh', cpus=1, cpus_per_node=1, shards=True, shard_logs=logs)
+            h.fname = 'sw'
+            h.jobs = [{'num': 0, 'status': 'F'}, {'num': 1, 'status': 'F'}]
+            for j in range(2):
+                for ext in ['out', 'err']:
+                    open('sw_%s.%s' % (j, ext), 'w').close()
+            assert h.collect(None) == [0, 1]
+            # the logs are in the shards, or not wanted
+            assert not [f for f in os.listdir('.') if f.endswith('.out') or f.endswith('.err')]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tdir)
+
+if __name__ == "__main__":
+    test_wait_job()
+    test_usage_tags()
+    test_usage_text()
+    test_clean_job_stderr()
+    test_pbs_shard_collect()
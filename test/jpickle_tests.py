@@ -73,3 +73,85 @@ def test_numpy_bool():
         
 
 
+
+def test_numpy_binary_array():
+    for dtype in [np.float64, np.float32, np.int8, np.int64, np.complex128, np.bool]:
+        a = (np.arange(300).reshape(10, 30) % 7).astype(dtype)
+        s = pickle(a)
+        assert 'b64' in s
+        b = unpickle(s)
+        assert b.dtype == a.dtype and b.shape == a.shape
+        assert np.all(a == b)
+    # objects are still stored as lists
+    a = np.array([{'a': i} for i in range(100)])
+    assert 'b64' not in pickle(a)
+
+def test_numpy_list_array():
+    # arrays pickled as lists by older versions
+    a = unpickle('{"py/object": "numpy.ndarray", "value": [[1.5, 2.0], [3.0, 4.0]], "dtype": "float64"}')
+    assert a.dtype == np.float64 and a.shape == (2, 2) and a[1, 0] == 3.0
+
+def test_netobj_cache():
+    import threading, tempfile, shutil
+    import BaseHTTPServer
+    from urllib2 import URLError
+
+    body = pickle(NormalPDF(5, 1))
+    hits = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.getheader('If-None-Match') == '"v1"':
+                hits.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            hits.append(200)
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    addr = 'http://127.0.0.1:%d/pdf' % server.server_address[1]
+    cdir = tempfile.mkdtemp()
+    saved = options['netobj'].copy()
+    options['netobj']['cache'] = cdir
+    try:
+        p = NetPDF(addr)
+        assert hits == [200]
+        assert np.allclose(p.mean, 5, rtol=.01)
+
+        # revalidated, not downloaded again
+        p = NetPDF(addr)
+        assert hits == [200, 304]
+        assert np.allclose(p.mean, 5, rtol=.01)
+
+        # offline only uses the cache
+        p = NetObj(addr, offline=True)
+        assert hits == [200, 304]
+        assert np.allclose(p.mean, 5, rtol=.01)
+        try:
+            NetObj(addr + '2', offline=True)
+            assert False
+        except URLError:
+            pass
+
+        # no cache
+        NetObj(addr, cache=False)
+        assert hits == [200, 304, 200]
+
+        # server gone, cached copy is used
+        server.shutdown()
+        server.server_close()
+        p = NetPDF(addr)
+        assert np.allclose(p.mean, 5, rtol=.01)
+    finally:
+        options['netobj'] = saved
+        shutil.rmtree(cdir)
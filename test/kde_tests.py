@@ -0,0 +1,58 @@
+import numpy as np
+from puq import options, gaussian_kde, ExperimentalPDF
+
+def _check(data, bw=None, tol=1e-3):
+    kde = gaussian_kde(data, bw_method=bw)
+    x = np.linspace(np.min(data) - 1, np.max(data) + 1, 500)
+    exact = kde.evaluate(x)
+    binned = kde.evaluate_binned(x)
+    err = np.max(np.abs(binned - exact)) / np.max(exact)
+    assert err < tol, err
+
+def test_binned_normal():
+    np.random.seed(0)
+    _check(np.random.normal(10, 2, 5000))
+
+def test_binned_bimodal():
+    np.random.seed(1)
+    data = np.r_[np.random.normal(0, .1, 3000), np.random.normal(5, 1, 2000)]
+    _check(data)
+    _check(data, bw='silverman')
+    _check(data, bw=.05)
+
+def test_binned_heavy_tails():
+    np.random.seed(2)
+    _check(np.random.standard_cauchy(5000), tol=.05)
+
+def test_binned_gridsize():
+    np.random.seed(3)
+    kde = gaussian_kde(np.random.normal(0, 1, 2000))
+    x = np.linspace(-4, 4, 50)
+    exact = kde.evaluate(x)
+    coarse = np.max(np.abs(kde.evaluate_binned(x, gridsize=64) - exact))
+    fine = np.max(np.abs(kde.evaluate_binned(x, gridsize=4096) - exact))
+    assert fine < coarse
+
+def test_experimental_pdf():
+    # ExperimentalPDF switches to the binned KDE for large data
+    np.random.seed(4)
+    data = np.random.normal(10, 2, 20000)
+    kdebinned = options['pdf']['kdebinned']
+    try:
+        options['pdf']['kdebinned'] = 10**9
+        exact = ExperimentalPDF(data, fit=True)
+        options['pdf']['kdebinned'] = 1000
+        binned = ExperimentalPDF(data, fit=True)
+    finally:
+        options['pdf']['kdebinned'] = kdebinned
+    assert np.allclose(exact.x, binned.x)
+    assert np.allclose(exact.y, binned.y, atol=1e-3 * np.max(exact.y))
+    assert np.allclose(exact.mean, binned.mean)
+    assert np.allclose(exact.dev, binned.dev, rtol=1e-4)
+
+if __name__ == "__main__":
+    test_binned_normal()
+    test_binned_bimodal()
+    test_binned_heavy_tails()
+    test_binned_gridsize()
+    test_experimental_pdf()
@@ -451,6 +451,177 @@ def test_divide():
     print "Total Time = %s" % ttime
     print "%.2f ms per division\n" % ((ttime * 1000.0) / tops)
 
+def test_add_fft():
+    # FFT and direct convolutions must agree
+    a = NormalPDF(10, 1)
+    b = UniformPDF(2, 8)
+    fftmin = options['pdf']['fftmin']
+    try:
+        options['pdf']['fftmin'] = 0
+        c1 = a + b
+        d1 = a - b
+        options['pdf']['fftmin'] = 10**9
+        c2 = a + b
+        d2 = a - b
+    finally:
+        options['pdf']['fftmin'] = fftmin
+    assert np.allclose(c1.x, c2.x)
+    assert np.allclose(c1.y, c2.y, atol=1e-6)
+    assert np.allclose(d1.y, d2.y, atol=1e-6)
+
+def test_add_numpart():
+    # narrow plus wide, on a fine grid
+    numpart = options['pdf']['numpart']
+    try:
+        options['pdf']['numpart'] = 20000
+        c = NormalPDF(0, 100) + NormalPDF(5, .01)
+    finally:
+        options['pdf']['numpart'] = numpart
+    assert len(c.x) == 20000
+    assert np.allclose(c.mean, 5, atol=.1)
+    assert np.allclose(c.dev, np.sqrt(100**2 + .01**2), rtol=1e-2)
+
+def test_multiply_lognormal():
+    # products and quotients of lognormals are lognormal
+    def check(p, mu, sigma):
+        mean = np.exp(mu + sigma**2 / 2)
+        dev = mean * np.sqrt(np.exp(sigma**2) - 1)
+        assert np.allclose(p.mean, mean, rtol=.01)
+        assert np.allclose(p.dev, dev, rtol=.02)
+    a = LognormalPDF(0, .25, min=.1)
+    b = LognormalPDF(1, .5, min=.1)
+    check(a * b, 1, np.sqrt(.3125))
+    check(a / b, -1, np.sqrt(.3125))
+    # negative values
+    check(-(-a * b), 1, np.sqrt(.3125))
+    check(-a / -b, -1, np.sqrt(.3125))
+
+def test_multiply_near_zero():
+    # ranges starting near 0 are long in log space
+    a = UniformPDF(.001, 1)
+    p = a * a
+    m2 = (.001**2 + .001 + 1) / 3
+    assert np.allclose(p.mean, .5005**2, rtol=.01)
+    assert np.allclose(p.dev, np.sqrt(m2**2 - .5005**4), rtol=.02)
+    p = NormalPDF(10, 1) / UniformPDF(.01, 1)
+    mean = 10 * np.log(100) / .99
+    assert np.allclose(p.mean, mean, rtol=.01)
+    assert np.allclose(p.dev, np.sqrt(101 * 100 - mean**2), rtol=.02)
+
+def test_lazy():
+    a = NormalPDF(10, 1)
+    b = UniformPDF(5, 8)
+    c = TrianglePDF(1, 2, 4)
+    eager = a*b + a/c - b
+    options['pdf']['lazy'] = True
+    try:
+        ab = a*b
+        lazy = ab + a/c - b
+        twice = ab + ab
+        diff = a - a + b
+    finally:
+        options['pdf']['lazy'] = False
+    assert isinstance(lazy, PDFExpr)
+    assert np.allclose(lazy.mean, eager.mean, rtol=.01)
+    assert np.allclose(lazy.dev, eager.dev, rtol=.05)
+    assert isinstance(lazy.evaluate(), PDF)
+    # shared subexpressions are computed once
+    assert ab._transform() is ab._transform()
+    assert np.allclose(twice.mean, 2 * ab.mean, rtol=.01)
+    # when sampling, a PDF is one random variable
+    p = diff.evaluate('sample', 100000)
+    assert np.allclose(p.mean, 6.5, atol=.05)
+    assert np.allclose(p.dev, np.sqrt(.75), rtol=.05)
+    assert np.allclose(diff.mean, 6.5, atol=.05)
+    assert np.allclose(diff.dev, np.sqrt(2 + .75), rtol=.05)
+
+def test_adaptive():
+    # narrow peak on a wide range
+    func = lambda x: scipy.stats.norm.pdf(x, 0, .01)
+    p = AdaptivePDF(func, -1, 1, tol=1e-5)
+    assert len(p.x) < 1000
+    assert np.allclose(p.mean, 0, atol=1e-4)
+    assert np.allclose(p.dev, .01, rtol=1e-3)
+    x = np.linspace(-.05, .05, 101)
+    assert np.allclose(p.cdf(x), scipy.stats.norm.cdf(x, 0, .01), atol=1e-4)
+    assert np.allclose(p.ppf([.1, .5, .9]), scipy.stats.norm.ppf([.1, .5, .9], 0, .01), atol=1e-4)
+    # most points are near the peak
+    assert np.sum(np.abs(p.x) < .05) > len(p.x) / 2
+
+    options['pdf']['adaptive'] = True
+    try:
+        n = NormalPDF(10, 2)
+    finally:
+        options['pdf']['adaptive'] = False
+    assert np.allclose(n.mean, 10, rtol=1e-4)
+    assert np.allclose(n.dev, 2, rtol=1e-3)
+    assert np.allclose((n * UniformPDF(1, 2)).mean, 15, rtol=.01)
+
+def test_sampling():
+    a = TrianglePDF(1, 2, 4)
+    # quantiles of the piecewise linear density are exact
+    u = np.linspace(0, 1, 11)
+    x = a._icdf(u)
+    assert np.allclose(a.cdf(x), u, atol=1e-3)
+    assert np.allclose(x[[0, -1]], [1, 4])
+
+    # seeded generators repeat
+    assert np.allclose(a.random(100, rng=1), a.random(100, rng=1))
+    assert np.allclose(a.ds(100, rng=np.random.RandomState(2)),
+                       a.ds(100, rng=np.random.RandomState(2)))
+    assert not np.allclose(a.lhs(100, rng=1), a.lhs(100, rng=2))
+    assert np.allclose(np.sort(a.ds(1000)), np.sort(a.ds(1000, rng=3)))
+
+    # chunks
+    chunks = list(a.chunks(2500, chunksize=1000, rng=4))
+    assert [len(c) for c in chunks] == [1000, 1000, 500]
+    r = np.random.RandomState(4)
+    assert np.allclose(chunks[0], a.random(1000, r))
+    assert np.allclose(chunks[1], a.random(1000, r))
+    x = np.concatenate(chunks)
+    assert np.allclose(np.mean(x), a.mean, rtol=.02)
+
+    # Constant works the same way
+    c = Constant(3)
+    assert [len(x) for x in c.chunks(5, chunksize=2)] == [2, 2, 1]
+    assert np.all(c.random(4, rng=1) == 3)
+
+    # the table is not pickled
+    assert '_icdf_table' in a.__dict__
+    assert not '_icdf_table' in a.__getstate__()
+
+def test_error_posterior():
+    error = NormalPDF(0, .5)
+    data = NormalPDF(5, .5).random(5, rng=1)
+
+    # same as a posterior from one PDF per measurement
+    p = ExperimentalPDF(data, error=error)
+    q = posterior([error + d for d in data])
+    assert np.allclose(p.mean, q.mean, atol=.01)
+    assert np.allclose(p.dev, q.dev, rtol=.05)
+    assert np.allclose(p.data, data)
+
+    p = ExperimentalPDF(data, error=error, prior=UniformPDF(4, 5))
+    q = posterior([error + d for d in data], UniformPDF(4, 5))
+    assert np.allclose(p.mean, q.mean, atol=.01)
+    assert p.x[0] >= 4 and p.x[-1] <= 5
+
+    # Many measurements. With a flat prior and normal errors the
+    # posterior is normal with mean = mean(data), dev = .5/sqrt(n).
+    data = NormalPDF(5, .2).random(1000, rng=2)
+    p = ExperimentalPDF(data, error=error)
+    assert np.allclose(p.mean, np.mean(data), atol=.002)
+    assert np.allclose(p.dev, .5 / np.sqrt(1000), rtol=.05)
+
+    # So many that the first refinement still leaves the posterior
+    # only a few points wide
+    n = 400000
+    data = NormalPDF(5, .2).random(n, rng=3)
+    p = ExperimentalPDF(data, error=error)
+    assert np.allclose(p.mean, np.mean(data), atol=.0002)
+    assert np.allclose(p.dev, .5 / np.sqrt(n), rtol=.05)
+    assert np.sum(p.y > 1e-3 * np.max(p.y)) > 10
+
 if __name__ == "__main__":
     plot_errors = True
     test_scalar_add()
@@ -462,4 +633,11 @@ if __name__ == "__main__":
     test_subtract()
     test_multiply()
     test_divide()
-    
\ No newline at end of file
+    test_add_fft()
+    test_add_numpart()
+    test_multiply_lognormal()
+    test_multiply_near_zero()
+    test_lazy()
+    test_adaptive()
+    test_sampling()
+    test_error_posterior()
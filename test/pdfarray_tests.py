@@ -0,0 +1,58 @@
+import os, h5py, tempfile, shutil
+import numpy as np
+from puq import PDFArray, ExperimentalPDF, NormalPDF, UniformPDF
+
+def test_from_samples():
+    np.random.seed(0)
+    means = np.arange(6.0).reshape(2, 3)
+    data = np.random.normal(means, 1 + means / 10, (20000, 2, 3))
+    pa = PDFArray.from_samples(data)
+    assert pa.shape == (2, 3)
+    assert pa.size == 6
+    assert np.allclose(pa.mean, means, atol=.05)
+    assert np.allclose(pa.dev, 1 + means / 10, rtol=.05)
+
+    # agrees with one ExperimentalPDF per element
+    p = ExperimentalPDF(data[:, 1, 2])
+    e = pa[1, 2]
+    assert np.allclose(e.mean, p.mean, atol=.05)
+    assert np.allclose(e.dev, p.dev, rtol=.05)
+    x = np.linspace(p.x[0], p.x[-1], 20)
+    assert np.allclose(pa.cdf(np.tile(x, (2, 3, 1)))[1, 2], p.cdf(x), atol=.02)
+
+def test_vectorized():
+    pdfs = [NormalPDF(0, 1), UniformPDF(2, 4), NormalPDF(10, 2)]
+    pa = PDFArray.from_pdfs(pdfs)
+    assert pa.shape == (3,)
+    x = np.array([0, 3, 12])
+    assert np.allclose(pa.pdf(x), [p.pdf(v) for p, v in zip(pdfs, x)], rtol=.01)
+    assert np.allclose(pa.cdf(x), [p.cdf(v) for p, v in zip(pdfs, x)], atol=.01)
+    assert np.allclose(pa.ppf(.5), [0, 3, 10], atol=.02)
+    q = pa.quantiles([.1, .5, .9])
+    assert q.shape == (3, 3)
+    assert np.allclose(q[1], [2.2, 3, 3.8], atol=.01)
+    assert np.allclose(pa.ppf(pa.cdf(x)), x, atol=.02)
+    assert np.allclose(pa.mean, [p.mean for p in pdfs], atol=.01)
+    assert np.all(pa.pdf(100) == 0)
+    assert np.all(pa.cdf(100) == 1)
+
+def test_hdf5():
+    tdir = tempfile.mkdtemp()
+    try:
+        np.random.seed(1)
+        pa = PDFArray.from_samples(np.random.uniform(0, 1, (1000, 4, 5)))
+        with h5py.File(os.path.join(tdir, 'pa.hdf5'), 'w') as hf:
+            pa.save(hf, 'pdfs')
+            pa.save(hf, 'pdfs')
+        with h5py.File(os.path.join(tdir, 'pa.hdf5'), 'r') as hf:
+            pb = PDFArray.load(hf, 'pdfs')
+        assert pb.shape == (4, 5)
+        assert np.allclose(pa.y, pb.y)
+        assert np.allclose(pa.mean, pb.mean)
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == "__main__":
+    test_from_samples()
+    test_vectorized()
+    test_hdf5()
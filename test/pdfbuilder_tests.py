@@ -0,0 +1,145 @@
+import os, h5py, tempfile, shutil
+import numpy as np
+from puq import PDFBuilder, ExperimentalPDF, NormalParameter, UniformParameter, ResponseFunc, options
+
+def test_chunks():
+    np.random.seed(0)
+    data = np.random.normal(10, 2, 100000)
+    b = PDFBuilder()
+    for chunk in np.split(data, 10):
+        b.add(chunk)
+    assert b.n == len(data)
+    assert np.allclose(b.mean, np.mean(data))
+    assert np.allclose(b.dev, np.std(data))
+    assert b.min == np.min(data) and b.max == np.max(data)
+    counts, bins = b.histogram()
+    assert np.sum(counts) == len(data)
+    assert len(counts) <= b.maxbins
+
+    p = b.finalize()
+    e = ExperimentalPDF(data)
+    assert np.allclose(p.mean, e.mean, rtol=.01)
+    assert np.allclose(p.dev, e.dev, rtol=.02)
+    assert np.allclose(p.pdf(e.x), e.y, atol=.05 * np.max(e.y))
+    p = b.finalize(fit=True)
+    e = ExperimentalPDF(data, fit=True)
+    assert np.allclose(p.mean, e.mean, rtol=.001)
+    assert np.allclose(p.dev, e.dev, rtol=.01)
+    assert np.allclose(p.pdf(e.x), e.y, atol=.02 * np.max(e.y))
+
+def test_nbins():
+    # same bin rule as ExperimentalPDF
+    np.random.seed(2)
+    for data in [np.random.normal(10, 2, 20000), np.random.exponential(1, 20000)]:
+        q75, q25 = np.percentile(data, [75, 25])
+        nbins = int((np.max(data) - np.min(data)) / (2 * (q75 - q25) / len(data)**(1.0/3)) + .5)
+        assert abs(PDFBuilder().add(data)._nbins() - nbins) <= .02 * nbins + 1
+    assert PDFBuilder().add(np.ones(10))._nbins() == 2
+
+def test_grow():
+    # later chunks outside the range coarsen the bins
+    b = PDFBuilder(maxbins=64)
+    b.add(np.linspace(0, 1, 1000))
+    w = np.diff(b.histogram()[1])[0]
+    b.add(np.linspace(100, 101, 1000))
+    counts, bins = b.histogram()
+    assert np.diff(bins)[0] > w
+    assert len(counts) <= 64
+    assert np.sum(counts) == 2000
+    assert bins[0] <= 0 and bins[-1] > 101
+
+def test_merge():
+    np.random.seed(1)
+    a = np.random.normal(0, 1, 5000)
+    c = np.random.uniform(5, 50, 5000)
+    ba = PDFBuilder().add(a)
+    bc = PDFBuilder().add(c)
+    both = PDFBuilder().add(a).add(c)
+    ba.merge(bc)
+    assert ba.n == 10000
+    assert np.allclose(ba.mean, both.mean)
+    assert np.allclose(ba.dev, both.dev)
+    assert np.sum(ba.histogram()[0]) == 10000
+    assert np.allclose(ba.finalize().mean, both.finalize().mean, rtol=.01)
+    assert PDFBuilder().merge(ba).n == 10000
+
+def test_montecarlo_builder():
+    from puq import MonteCarlo
+    from puq.hdf import mark_rewritten
+    mc = MonteCarlo([UniformParameter('x', 'x', min=0, max=1)], 3, response=False)
+    np.random.seed(3)
+    data = np.random.normal(0, 1, 3000)
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(os.path.join(tdir, 'builder.hdf5'), 'w')
+        ds = hf.create_dataset('output/data/out', data=data[:2000], maxshape=(None,))
+        b = mc._get_builder('out', ds)
+        assert b.n == 2000
+        # new rows are added to the same builder
+        ds.resize((3000,))
+        ds[2000:] = data[2000:]
+        assert mc._get_builder('out', ds) is b
+        assert b.n == 3000 and np.allclose(b.mean, np.mean(data))
+        # a rewritten row starts over
+        ds[10] += 100
+        mark_rewritten(ds)
+        b2 = mc._get_builder('out', ds)
+        assert b2 is not b
+        assert b2.n == 3000 and np.allclose(b2.mean, np.mean(ds[...]))
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+    # changes to arrays are not tracked
+    assert mc._get_builder('out', data) is not mc._get_builder('out', data)
+
+def test_response_stream():
+    # Function.pdf() streams samples it cannot hold in memory
+    x = NormalParameter('x', 'x', mean=5, dev=1)
+    y = UniformParameter('y', 'y', min=1, max=2)
+    rf = ResponseFunc('x*y', params=[x, y])
+    chunksize = options['pdf']['chunksize']
+    try:
+        options['pdf']['chunksize'] = 10000
+        p = rf.pdf(numsamples=50000, rng=2)
+    finally:
+        options['pdf']['chunksize'] = chunksize
+    assert np.allclose(p.mean, 7.5, rtol=.02)
+
+def test_response_psamples_view():
+    # samples stored in an HDF5 file are read in blocks
+    import puq.hdf
+    x = NormalParameter('x', 'x', mean=5, dev=1)
+    y = UniformParameter('y', 'y', min=1, max=2)
+    rf = ResponseFunc('x*y', params=[x, y])
+    np.random.seed(4)
+    samples = np.column_stack((np.random.normal(5, 1, 30000), np.random.uniform(1, 2, 30000)))
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(os.path.join(tdir, 'psamples.hdf5'), 'w')
+        assert puq.hdf.get_psamples_view(hf) is None
+        hf['psamples'] = samples
+        view = puq.hdf.get_psamples_view(hf)
+        assert isinstance(view, h5py.Dataset)
+        chunksize = options['pdf']['chunksize']
+        try:
+            options['pdf']['chunksize'] = 10000
+            p = rf.pdf(psamples=view)
+        finally:
+            options['pdf']['chunksize'] = chunksize
+        e = rf.pdf(psamples=samples)
+        p2, results = rf.pdf(psamples=view, return_samples=True)
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+    assert np.allclose(p.mean, e.mean, rtol=.01)
+    assert np.allclose(p.dev, e.dev, rtol=.02)
+    assert np.allclose(results, samples[:, 0] * samples[:, 1])
+
+if __name__ == "__main__":
+    test_chunks()
+    test_nbins()
+    test_grow()
+    test_merge()
+    test_montecarlo_builder()
+    test_response_stream()
+    test_response_psamples_view()
@@ -1,4 +1,5 @@
 import numpy as np
+import sympy
 from puq import *
 
 def test_rf_simp_0():
@@ -287,3 +288,58 @@ def test_sf_eval1_P():
     assert np.allclose(sf.eval(np.array([0]), np.array([0,5,10])), [0.,3.2,0.], rtol=.1)
     assert np.allclose(sf.eval(np.array([3]), np.array([0,5,10])), [2.88,7.45,2.88], rtol=.1)
     assert np.allclose(sf.eval(np.array([7]), np.array([0,5,10])), [7.18,11.95,7.18], rtol=.1)
+
+def test_sf_nodes_P():
+    # unpickling rebuilds the interpolant from the saved node weights
+    x = np.array([0,0,5,5,5,10,10])
+    y = np.array([0,10,0,5,10,0,10])
+    z = np.array([0,0,5,10,5,10,10])
+    sf = SampledFunc(x,y,z, vars=(('x',(0,100)),('y',(0,100))), rbf='gaussian')
+    xe, ye = np.array([1,3,7]), np.array([2,5,9])
+    expected = sf.eval(xe, ye)
+    sf2 = unpickle(pickle(sf))
+    assert np.allclose(sf2._interp_func.nodes, sf._nodes)
+    assert np.allclose(sf2.eval(xe, ye), expected)
+    assert sf2.eps == sf.eps
+
+    # changing epsilon refits
+    sf2.epsilon = sf.eps * 2
+    assert not np.allclose(sf2._nodes, sf._nodes)
+    assert np.allclose(sf2.eval(x, y), z, rtol=1e-6)
+
+def test_rf_numeric():
+    rf = ResponseFunc('1.5 + 2*x - y**3 + 0.25*x**2*y', vars=(('x',(0,10)),('y',(0,10))))
+    assert rf._coef is not None
+    x = np.array([0., 1., 2.5, 7.])
+    y = np.array([1., 3., 0.5, 2.])
+    expected = 1.5 + 2*x - y**3 + 0.25*x**2*y
+    assert np.allclose(rf.eval(x, y), expected)
+    assert np.allclose(rf.eval(y=y, x=x), expected)
+    assert np.allclose(rf.evala(np.column_stack([x, y])), expected)
+    assert np.allclose(rf.eval(2.5, 0.5), expected[2])
+
+    # equation is not kept in the pickle, only the numeric form
+    rf = unpickle(pickle(rf))
+    assert rf._eqn is None
+    assert np.allclose(rf.eval(x, y), expected)
+    assert str(rf.eqn) == str(sympy.S('1.5 + 2*x - y**3 + 0.25*x**2*y'))
+
+def test_rf_numeric_many_terms():
+    # 286 terms
+    eqn = sympy.expand('(1 + x/2 - y + z/3)**10')
+    rf = ResponseFunc(str(eqn), vars=(('x',(-1,1)),('y',(-1,1)),('z',(-1,1))))
+    assert rf._coef is not None and len(rf._coef) == 286
+    np.random.seed(3)
+    x, y, z = np.random.uniform(-1, 1, (3, 200))
+    f = sympy.lambdify(sympy.symbols('x y z'), eqn)
+    assert np.allclose(rf.eval(x, y, z), f(x, y, z), rtol=1e-10, atol=1e-10)
+    assert np.allclose(rf.eval(.3, -.2, .1), float(eqn.subs({'x': .3, 'y': -.2, 'z': .1})))
+    # broadcasting
+    assert rf.eval(x.reshape(20, 10), .5, 0).shape == (20, 10)
+
+def test_rf_nonpoly():
+    rf = ResponseFunc('exp(x) + y', vars=(('x',(0,1)),('y',(0,1))))
+    assert rf._coef is None
+    assert np.allclose(rf.eval(np.array([0., 1.]), np.array([1., 2.])), [2., np.e + 2])
+    rf = unpickle(pickle(rf))
+    assert np.allclose(rf.eval(np.array([0., 1.]), np.array([1., 2.])), [2., np.e + 2])
@@ -0,0 +1,48 @@
+import os, h5py, tempfile, shutil
+import numpy as np
+import puq.hdf
+from puq.shard import write_shard, merge_shards, _runs
+
+def _write_job(base, job):
+    f = open(base + '.out', 'w')
+    f.write("starting\n")
+    f.write("HDF5:{'name': 'x', 'value': %s, 'desc': 'the x'}:5FDH\n" % (job * 10.0))
+    f.write("HDF5:{'name': 'v', 'value': [%s, %s], 'desc': 'vec'}:5FDH\n" % (job, -job))
+    f.close()
+    f = open(base + '.err', 'w')
+    f.write("HDF5:{'name': 'time', 'value': 1.5, 'desc': ''}:5FDH\n")
+    f.close()
+
+def test_runs():
+    assert list(_runs([0, 1, 2, 5, 6, 4])) == [(0, 3, 0), (3, 5, 5), (5, 6, 4)]
+
+def test_merge_shards():
+    tdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tdir)
+        for j in range(4):
+            _write_job('sw_%s' % j, j)
+        write_shard('sw_shard_0.h5', [(0, 'sw_0'), (1, 'sw_1')])
+        write_shard('sw_shard_1.h5', [(3, 'sw_3'), (2, 'sw_2')], logs=False)
+
+        hf = h5py.File('sw.hdf5', 'w')
+        merge_shards(hf, ['sw_shard_0.h5', 'sw_shard_1.h5', 'sw_shard_2.h5'], 5)
+        x = puq.hdf.get_result(hf, 'x')
+        assert np.all(x[:4] == [0, 10, 20, 30]) and np.isnan(x[4])
+        assert np.all(puq.hdf.get_result(hf, 'v[1]')[:4] == [0, -1, -2, -3])
+        assert puq.hdf.data_description(hf, 'x') == 'the x'
+        assert puq.hdf.get_rewrites(hf['output/data/x']) > 0
+        assert np.all(hf['output/jobs/time'][:4] == 1.5)
+        # jobs without logs are counted too
+        assert puq.hdf.get_job_numbers(hf) == [0, 1, 2, 3]
+        assert puq.hdf.get_num_jobs(hf) == 4
+        assert 'starting' in puq.hdf.get_job_output(hf, 1, 'stdout')
+        hf.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tdir)
+
+if __name__ == "__main__":
+    test_runs()
+    test_merge_shards()
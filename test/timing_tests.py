@@ -0,0 +1,84 @@
+import os, h5py, tempfile, shutil, time
+from puq import options
+import puq.timing as timing
+
+def test_phases():
+    timing.start()
+    for i in range(3):
+        with timing.phase('setup'):
+            pass
+    with timing.phase('run'):
+        time.sleep(.01)
+    try:
+        with timing.phase('collect'):
+            raise ValueError
+    except ValueError:
+        pass
+    t = timing.timings()
+    assert [n for n, s, c in t] == ['setup', 'run', 'collect']
+    assert [c for n, s, c in t] == [3, 1, 1]
+    assert t[1][1] >= .01
+
+def test_save_load():
+    tdir = tempfile.mkdtemp()
+    saved = options['profile'].copy()
+    options['profile']['cprofile'] = True
+    try:
+        hf = h5py.File(os.path.join(tdir, 'prof.hdf5'), 'w')
+        for it in range(2):
+            timing.start()
+            with timing.phase('run'):
+                sum(range(1000))
+            with timing.phase('analyze'):
+                pass
+            timing.save(hf)
+        hf.close()
+
+        hf = h5py.File(os.path.join(tdir, 'prof.hdf5'), 'r')
+        iters = timing.load(hf)
+        hf.close()
+        assert len(iters) == 2
+        for it in iters:
+            assert [n for n, s, c in it['phases']] == ['run', 'analyze']
+            assert it['total'] >= sum([s for n, s, c in it['phases']])
+            assert 'function calls' in it['cprofile']
+    finally:
+        options['profile'] = saved
+        shutil.rmtree(tdir)
+
+class _FailingHost(object):
+    def add_jobs(self, fname, args):
+        pass
+
+class _FailingSweep(object):
+    # the jobs fail to run
+    host = _FailingHost()
+    def _save_and_run(self, dryrun=False):
+        with timing.phase('run'):
+            return False
+
+def test_failed_iteration():
+    from puq.psweep import PSweep
+    tdir = tempfile.mkdtemp()
+    saved = options['profile'].copy()
+    options['profile']['cprofile'] = True
+    try:
+        sw = _FailingSweep()
+        sw.fname = os.path.join(tdir, 'fail')
+        ps = PSweep()
+        ps.get_args = lambda: []
+        assert ps.run(sw) is False
+        assert timing._profiler is None
+        hf = h5py.File(sw.fname + '.hdf5', 'r')
+        iters = timing.load(hf)
+        hf.close()
+        assert len(iters) == 1
+        assert [n for n, s, c in iters[0]['phases']] == ['run']
+    finally:
+        options['profile'] = saved
+        shutil.rmtree(tdir)
+
+if __name__ == "__main__":
+    test_phases()
+    test_save_load()
+    test_failed_iteration()
@@ -0,0 +1,94 @@
+import os, h5py, tempfile, shutil
+import numpy as np
+from puq.util import fingerprint, update_moments, running_moments
+from puq.hdf import mark_rewritten
+from puq.options import options
+
+def test_fingerprint():
+    a = {'x': np.arange(10.0), 'y': [1, 'two', 3.0]}
+    b = {'y': [1, 'two', 3.0], 'x': np.arange(10.0)}
+    assert fingerprint(a) == fingerprint(b), 'fingerprint order'
+    b['x'][3] = 0
+    assert fingerprint(a) != fingerprint(b), 'fingerprint array change'
+    assert fingerprint(np.arange(4)) != fingerprint(np.arange(4.0)), 'fingerprint dtype'
+
+class Slotted(object):
+    __slots__ = ('a',)
+
+def test_fingerprint_slots():
+    s = Slotted()
+    s.a = [1, 2]
+    f = fingerprint(s)
+    assert fingerprint(s) == f
+    s.a.append(3)
+    assert fingerprint(s) != f, 'fingerprint slots change'
+
+def test_update_moments():
+    x = np.random.rand(1000)
+    w = np.random.rand(1000)
+    s = update_moments(None, x[:300], w[:300])
+    s = update_moments(s, x[300:], w[300:])
+    mean = np.average(x, weights=w)
+    assert np.allclose(s[1], mean)
+    assert np.allclose(np.sqrt(s[2] / s[0]), np.sqrt(np.average((x - mean)**2, weights=w)))
+
+def test_running_moments():
+    tdir = tempfile.mkdtemp()
+    try:
+        hf = h5py.File(os.path.join(tdir, 'moments.hdf5'), 'w')
+        x = np.random.randn(500)
+        ds = hf.create_dataset('output/data/a', data=x[:200], maxshape=(None,))
+        cache = {}
+        mean, dev = running_moments(cache, 'a', ds)
+        assert np.allclose([mean, dev], [np.mean(x[:200]), np.std(x[:200])])
+        ds.resize((500,))
+        ds[200:] = x[200:]
+        mean, dev = running_moments(cache, 'a', ds)
+        assert np.allclose([mean, dev], [np.mean(x), np.std(x)])
+        assert cache['a'][0] == 500
+
+        # rows seen before are not read again
+        ds[10] += 100
+        mean, dev = running_moments(cache, 'a', ds)
+        assert np.allclose([mean, dev], [np.mean(x), np.std(x)])
+
+        # unless the dataset is marked as rewritten
+        mark_rewritten(ds)
+        y = ds[...]
+        mean, dev = running_moments(cache, 'a', ds)
+        assert np.allclose([mean, dev], [np.mean(y), np.std(y)])
+
+        # a recreated dataset starts over too
+        del hf['output/data/a']
+        ds = hf.create_dataset('output/data/a', data=x + 1.0)
+        mark_rewritten(ds)
+        mean, dev = running_moments(cache, 'a', ds)
+        assert np.allclose([mean, dev], [np.mean(x + 1.0), np.std(x)])
+        hf.close()
+    finally:
+        shutil.rmtree(tdir)
+
+    # changes to arrays are not tracked, so they are always read
+    y = x.copy()
+    running_moments(cache, 'b', y[:300])
+    y[10] += 100
+    mean, dev = running_moments(cache, 'b', y)
+    assert np.allclose([mean, dev], [np.mean(y), np.std(y)])
+    assert not 'b' in cache
+
+def test_chunked():
+    x = np.random.randn(1000)
+    saved = options['hdf5']['chunksize']
+    options['hdf5']['chunksize'] = 64
+    try:
+        mean, dev = running_moments(None, None, x)
+        assert np.allclose([mean, dev], [np.mean(x), np.std(x)])
+    finally:
+        options['hdf5']['chunksize'] = saved
+
+if __name__ == "__main__":
+    test_fingerprint()
+    test_fingerprint_slots()
+    test_update_moments()
+    test_running_moments()
+    test_chunked()